@@ -131,8 +131,39 @@ export default function TicketDetail() {
         }
       );
 
+      // Streamed assistant replies arrive as an empty message followed by
+      // updates carrying the full text so far
+      socketRef.current.on(
+        "messageUpdated",
+        (data: { ticketId: string; messageId: string; content: string }) => {
+          if (data.ticketId === ticket.ticketId) {
+            setChatMessages((prev) =>
+              prev.map((msg) =>
+                msg._id === data.messageId
+                  ? { ...msg, content: data.content }
+                  : msg
+              )
+            );
+          }
+        }
+      );
+
+      // A streamed reply that failed is removed before it is retried
+      socketRef.current.on(
+        "messageDeleted",
+        (data: { ticketId: string; messageId: string }) => {
+          if (data.ticketId === ticket.ticketId) {
+            setChatMessages((prev) =>
+              prev.filter((msg) => msg._id !== data.messageId)
+            );
+          }
+        }
+      );
+
       return () => {
         socketRef.current?.off("newMessage");
+        socketRef.current?.off("messageUpdated");
+        socketRef.current?.off("messageDeleted");
       };
     }
   }, [ticket?.ticketId]);
@@ -0,0 +1,222 @@
+"""In-memory IMAP stand-in for exercising the fetcher without a mail server.
+
+Implements the subset of imaplib.IMAP4 the fetcher uses (login, select,
+response, uid search/fetch/store, noop, close, logout) with an optional
+per-command latency to mimic a remote server. FETCH understands UID,
+BODYSTRUCTURE, BODY.PEEK[HEADER.FIELDS (...)] and BODY.PEEK[section]<o.n>.
+IDLE is not supported.
+"""
+import email
+import re
+import threading
+import time
+from email.message import EmailMessage
+
+PEEK_RE = re.compile(r"BODY\.PEEK\[([^\]]*)\](?:<(\d+)\.(\d+)>)?", re.IGNORECASE)
+
+
+def make_message(account, n):
+    msg = EmailMessage()
+    msg["From"] = f"user{n}@example.com"
+    msg["To"] = account
+    msg["Subject"] = f"VPN not connecting #{n}"
+    msg["Message-ID"] = f"<{n}.{account}@standin.local>"
+    msg.set_content(f"Hi, my VPN keeps dropping since this morning (report {n}).\nThanks")
+    return msg.as_bytes()
+
+
+def _quote(value):
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _payload_bytes(part):
+    payload = part.get_payload()
+    return payload.encode("utf-8", "surrogateescape") if isinstance(payload, str) else b""
+
+
+def bodystructure(part):
+    """Renders an email.message part as an IMAP BODYSTRUCTURE string."""
+    if part.is_multipart():
+        children = "".join(bodystructure(p) for p in part.get_payload())
+        return f"({children} {_quote(part.get_content_subtype().upper())})"
+
+    params = part.get_params()[1:] if part.get_params() else []
+    params = "(" + " ".join(f"{_quote(k.upper())} {_quote(v)}" for k, v in params) + ")" if params else "NIL"
+    payload = _payload_bytes(part)
+    fields = (f"{_quote(part.get_content_maintype().upper())} {_quote(part.get_content_subtype().upper())} "
+              f"{params} NIL NIL {_quote(part.get('Content-Transfer-Encoding', '7BIT').upper())} {len(payload)}")
+    if part.get_content_maintype() == "text":
+        fields += " " + str(payload.count(b"\n"))
+    disposition = part.get_content_disposition()
+    if disposition:
+        filename = part.get_filename()
+        extra = f"({_quote('FILENAME')} {_quote(filename)})" if filename else "NIL"
+        fields += f" NIL ({_quote(disposition.upper())} {extra})"
+    return f"({fields})"
+
+
+def section_bytes(msg, section):
+    """Returns the raw (still transfer-encoded) bytes of a body section."""
+    if section.upper().startswith("HEADER.FIELDS"):
+        wanted = section[section.index("(") + 1:section.rindex(")")].upper().split()
+        lines = "".join(f"{k}: {v}\r\n" for k, v in msg.items() if k.upper() in wanted)
+        return (lines + "\r\n").encode()
+    if not section:
+        return msg.as_bytes()
+    part = msg
+    for index in section.split("."):
+        if part.is_multipart():
+            part = part.get_payload()[int(index) - 1]
+        elif index != "1":
+            return b""
+    return _payload_bytes(part)
+
+
+class StandInServer:
+    """Holds the mailboxes shared by all StandInIMAP connections."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.folders = {}  # (account, folder) -> {uid: [raw, flags]}
+        self.uidvalidity = "1"
+        self.bytes_sent = 0
+        self.parsed = {}  # id(raw) -> parsed message, for BODYSTRUCTURE/sections
+
+    def add_messages(self, account, folder, count):
+        with self.lock:
+            box = self.folders.setdefault((account, folder.lower()), {})
+            start = max(box, default=0) + 1
+            for uid in range(start, start + count):
+                box[uid] = [make_message(account, uid), set()]
+
+    def add_raw(self, account, folder, raw_messages):
+        with self.lock:
+            box = self.folders.setdefault((account, folder.lower()), {})
+            start = max(box, default=0) + 1
+            for uid, raw in enumerate(raw_messages, start):
+                box[uid] = [raw, set()]
+
+    def parse(self, raw):
+        msg = self.parsed.get(id(raw))
+        if msg is None:
+            msg = self.parsed[id(raw)] = email.message_from_bytes(raw)
+        return msg
+
+    def connect(self, folder="inbox", server=None, account=None, password=None):
+        """Drop-in replacement for main.connect_to_imap."""
+        mail = StandInIMAP(self)
+        mail.login(account, password)
+        mail.select(folder)
+        return mail
+
+
+def parse_uid_set(spec, highest):
+    uids = set()
+    for part in spec.split(","):
+        if ":" in part:
+            lo, hi = part.split(":")
+            lo = int(lo)
+            hi = highest if hi == "*" else int(hi)
+            if lo > hi:
+                lo, hi = hi, lo
+            uids.update(range(lo, hi + 1))
+        else:
+            uids.add(int(part))
+    return uids
+
+
+class StandInIMAP:
+    def __init__(self, server):
+        self.server = server
+        self.account = None
+        self.box = None
+        self.untagged = {}
+
+    def _round_trip(self):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+    def login(self, account, password):
+        self._round_trip()
+        self.account = account
+        return "OK", [b"LOGIN completed"]
+
+    def select(self, folder="inbox"):
+        self._round_trip()
+        with self.server.lock:
+            self.box = self.server.folders.setdefault((self.account, folder.lower()), {})
+        self.untagged["UIDVALIDITY"] = [self.server.uidvalidity.encode()]
+        return "OK", [str(len(self.box)).encode()]
+
+    def response(self, code):
+        # Like imaplib, an untagged response is handed out once
+        return code, self.untagged.pop(code, [None])
+
+    def uid(self, command, *args):
+        self._round_trip()
+        command = command.lower()
+        with self.server.lock:
+            if command == "search":
+                return self._search(args[-1])
+            if command == "fetch":
+                return self._fetch(args[0], args[1] if len(args) > 1 else "(UID BODY.PEEK[])")
+            if command == "store":
+                return self._store(args[0], args[2])
+        return "BAD", [f"unsupported command {command}".encode()]
+
+    def _search(self, criteria):
+        criteria = criteria.strip("()").upper()
+        if criteria == "UNSEEN":
+            uids = [u for u, (_, flags) in self.box.items() if "\\Seen" not in flags]
+        elif criteria.startswith("UID "):
+            wanted = parse_uid_set(criteria[4:], max(self.box, default=0))
+            uids = [u for u in self.box if u in wanted]
+            if not uids and self.box:
+                uids = [max(self.box)]
+        else:
+            uids = list(self.box)
+        return "OK", [b" ".join(str(u).encode() for u in sorted(uids))]
+
+    def _fetch(self, spec, items):
+        data = []
+        for seq, uid in enumerate(sorted(parse_uid_set(spec, max(self.box, default=0))), 1):
+            if uid not in self.box:
+                continue
+            raw = self.box[uid][0]
+            head = f"{seq} (UID {uid}"
+            if "BODYSTRUCTURE" in items.upper():
+                head += f" BODYSTRUCTURE {bodystructure(self.server.parse(raw))}"
+            literals = []
+            for section, offset, count in PEEK_RE.findall(items):
+                body = raw if not section else section_bytes(self.server.parse(raw), section)
+                key = f"BODY[{section}]"
+                if offset:
+                    body = body[int(offset):int(offset) + int(count)]
+                    key += f"<{offset}>"
+                literals.append((key, body))
+            if not literals:
+                data.append((head + ")").encode())
+                continue
+            for i, (key, body) in enumerate(literals):
+                prefix = head + " " if i == 0 else " "
+                data.append((f"{prefix}{key} {{{len(body)}}}".encode(), body))
+                self.server.bytes_sent += len(body)
+            data.append(b")")
+        return "OK", data
+
+    def _store(self, spec, flags):
+        for uid in parse_uid_set(spec, max(self.box, default=0)):
+            if uid in self.box and "\\Seen" in flags:
+                self.box[uid][1].add("\\Seen")
+        return "OK", []
+
+    def noop(self):
+        self._round_trip()
+        return "OK", []
+
+    def close(self):
+        return "OK", []
+
+    def logout(self):
+        return "BYE", []
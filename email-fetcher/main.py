@@ -6,6 +6,12 @@ import redis # Example for Redis queue
 import hashlib
 import time
 import os
+import argparse
+import re
+import select
+import ssl
+
+import mime_stream
 # import dotenv
 # dotenv.load_dotenv()
 # --- Configuration ---
@@ -14,7 +20,35 @@ EMAIL_ACCOUNT = "sihticketing@gmail.com"
 APP_PASSWORD = "shmo nodv yyyz txza" # NEVER hardcode this in production
 REDIS_HOST = "localhost"
 REDIS_PORT = 6379
-TICKET_QUEUE_NAME = "tickets_queue"
+# Redis stream read by the triage service's redis_consumer group
+TICKET_QUEUE_NAME = "tickets_stream"
+TICKET_QUEUE_MAXLEN = int(os.getenv("TICKET_QUEUE_MAXLEN", "100000"))
+FETCH_BATCH_SIZE = int(os.getenv("FETCH_BATCH_SIZE", "50"))
+
+# Ingestion-time dedup: one key per Message-ID hash, expiring after DEDUP_TTL
+DEDUP_KEY_PREFIX = "fetcher:dedup:"
+DEDUP_STATS_KEY = "fetcher:dedup_stats"
+DEDUP_TTL = int(os.getenv("DEDUP_TTL", str(7 * 24 * 3600)))
+
+# SET NX and XADD run atomically, so a message is never marked as seen by the
+# filter without its ticket actually being queued.
+QUEUE_IF_NEW_LUA = """
+if redis.call('SET', KEYS[1], 1, 'NX', 'EX', ARGV[1]) then
+    redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[2], '*', 'data', ARGV[3])
+    redis.call('HINCRBY', KEYS[3], 'misses', 1)
+    return 1
+end
+redis.call('HINCRBY', KEYS[3], 'hits', 1)
+return 0
+"""
+
+IDLE_TIMEOUT = int(os.getenv("IDLE_TIMEOUT", "1500"))  # re-issue IDLE before the 29 min server cutoff
+RECONNECT_DELAY = int(os.getenv("RECONNECT_DELAY", "10"))
+# Fetch only capped text parts (BODYSTRUCTURE + partial BODY.PEEK), see mime_stream.py
+STREAMING_PARSE = os.getenv("STREAMING_PARSE", "0") == "1"
+
+UID_RE = re.compile(rb"UID (\d+)")
+EXISTS_RE = re.compile(rb"^\* \d+ EXISTS")
 
 
 def connect_to_redis():
@@ -56,6 +90,28 @@ def process_email(msg):
             
     return sender, subject, body.strip()
 
+def message_key(msg_id, sender="", subject="", body=""):
+    """Stable hash for a message: its Message-ID, or the content when the
+    header is missing."""
+    source = msg_id.strip() if msg_id else f"{sender}\n{subject}\n{body}"
+    return hashlib.sha1(source.encode()).hexdigest()
+
+def queue_ticket(redis_client, ticket_json, key, client=None):
+    """Pushes the ticket unless the same message was queued within DEDUP_TTL.
+    Pass a pipeline as `client` to batch the call. Returns 1 if queued."""
+    script = redis_client.register_script(QUEUE_IF_NEW_LUA)
+    return script(
+        keys=[DEDUP_KEY_PREFIX + key, TICKET_QUEUE_NAME, DEDUP_STATS_KEY],
+        args=[DEDUP_TTL, TICKET_QUEUE_MAXLEN, ticket_json],
+        client=client,
+    )
+
+def dedup_stats(redis_client):
+    stats = redis_client.hgetall(DEDUP_STATS_KEY)
+    hits, misses = int(stats.get("hits", 0)), int(stats.get("misses", 0))
+    total = hits + misses
+    return {"hits": hits, "misses": misses, "hit_rate": hits / total if total else 0.0}
+
 def create_ticket_json(sender, subject, body, msg_id):
     """Constructs the standard JSON object for a ticket."""
     # Simple NLP for category/priority suggestion
@@ -68,10 +124,9 @@ def create_ticket_json(sender, subject, body, msg_id):
     if "urgent" in subject.lower() or "asap" in body.lower():
         priority = "High"
 
-    # Create a unique ID
+    # Deterministic ID, so a re-fetched message maps to the same ticket
     timestamp = int(time.time())
-    unique_hash = hashlib.sha1(msg_id.encode()).hexdigest()[:8]
-    ticket_id = f"eml-{timestamp}-{unique_hash}"
+    ticket_id = f"eml-{message_key(msg_id, sender, subject, body)[:16]}"
     print(f"Generated Ticket ID: {ticket_id}")
     print(f"Category: {category}, Priority: {priority}")
     print(f"ticket_id: {ticket_id}, sender: {sender}, subject: {subject}")
@@ -91,18 +146,317 @@ def create_ticket_json(sender, subject, body, msg_id):
     }
     return json.dumps(ticket)
 
+def is_valid_ticket(sender, body):
+    """Simple validation: we only accept non-empty mails from a known domain."""
+    return bool(body) and ".com" in sender
+
+def connect_to_imap(folder="inbox", server=IMAP_SERVER, account=EMAIL_ACCOUNT, password=APP_PASSWORD):
+    """Logs into the mailbox and selects the folder."""
+    mail = imaplib.IMAP4_SSL(server)
+    mail.login(account, password)
+    mail.select(folder)
+    print("✅ Logged into email account successfully.")
+    return mail
+
+def uid_set(uids):
+    """Compacts a list of UIDs into an IMAP sequence set, e.g. 1:4,7,9:10."""
+    ranges = []
+    nums = sorted(int(u) for u in uids)
+    start = prev = nums[0]
+    for n in nums[1:]:
+        if n == prev + 1:
+            prev = n
+            continue
+        ranges.append(f"{start}:{prev}" if start != prev else str(start))
+        start = prev = n
+    ranges.append(f"{start}:{prev}" if start != prev else str(start))
+    return ",".join(ranges)
+
+def fetch_batch(mail, uids):
+    """Fetches a batch of messages in one UID FETCH round trip.
+
+    BODY.PEEK[] is used instead of RFC822 so the server does not set \\Seen
+    before the tickets have actually been queued.
+    """
+    status, msg_data = mail.uid("fetch", uid_set(uids), "(UID BODY.PEEK[])")
+    if status != "OK":
+        # Raise rather than return nothing, so the batch stays unseen and is retried
+        raise imaplib.IMAP4.error(f"Fetch failed for UIDs {uid_set(uids)}: {status}")
+
+    messages = []
+    for response_part in msg_data:
+        if isinstance(response_part, tuple):
+            match = UID_RE.search(response_part[0])
+            if match:
+                messages.append((match.group(1), email.message_from_bytes(response_part[1])))
+    return messages
+
+def fetch_parsed_batch(mail, uids, streaming=None):
+    """Yields (uid, sender, subject, body, message_id) for a batch, either
+    from full messages or from the size-capped streaming path."""
+    if streaming is None:
+        streaming = STREAMING_PARSE
+    if streaming:
+        for uid, parsed in mime_stream.fetch_text_batch(mail, uids):
+            yield (str(uid).encode(), parsed["sender"], parsed["subject"],
+                   parsed["body"], parsed["message_id"])
+        return
+    for uid, msg in fetch_batch(mail, uids):
+        sender, subject, body = process_email(msg)
+        yield uid, sender, subject, body, msg["Message-ID"]
+
+def process_batch(mail, redis_client, uids, streaming=None):
+    """Parses a batch, pushes valid tickets through one pipeline and marks the
+    messages that were handled as seen with a single STORE.
+
+    Returns (queued, handled): the number of tickets queued and the UIDs that
+    were fetched and parsed. UIDs the server did not return stay unseen.
+    """
+    pipe = redis_client.pipeline(transaction=False)
+    candidates = 0
+    handled = []
+    for uid, sender, subject, body, msg_id in fetch_parsed_batch(mail, uids, streaming):
+        handled.append(uid)
+        if not is_valid_ticket(sender, body):
+            print(f"⚠️ Skipping invalid or external email from {sender}.")
+            continue
+        ticket_json = create_ticket_json(sender, subject, body, msg_id)
+        queue_ticket(redis_client, ticket_json, message_key(msg_id, sender, subject, body), client=pipe)
+        candidates += 1
+
+    queued = sum(pipe.execute()) if candidates else 0
+    if candidates > queued:
+        print(f"🔁 Skipped {candidates - queued} already-queued message(s).")
+    if len(handled) < len(uids):
+        print(f"⚠️ Server returned {len(handled)} of {len(uids)} messages, leaving the rest unseen.")
+    # Invalid mails are marked as seen too, same as the per-message path. Only
+    # after the pipeline ran, so nothing is marked seen without being queued.
+    if handled:
+        mail.uid("store", uid_set(handled), "+FLAGS", "(\\Seen)")
+    return queued, handled
+
+def main_batched(batch_size=FETCH_BATCH_SIZE):
+    """Fetches unseen mail in UID batches and reports throughput."""
+    redis_client = connect_to_redis()
+    if not redis_client:
+        return
+
+    try:
+        mail = connect_to_imap()
+
+        status, messages = mail.uid("search", None, "(UNSEEN)")
+        if status != "OK":
+            print("❌ No new messages to process.")
+            return
+
+        uids = messages[0].split()
+        print(f"📧 Found {len(uids)} new emails.")
+
+        started = time.perf_counter()
+        queued = 0
+        for i in range(0, len(uids), batch_size):
+            batch = uids[i:i + batch_size]
+            queued += process_batch(mail, redis_client, batch)[0]
+            print(f"🚀 Batch {i // batch_size + 1}: {len(batch)} fetched, {queued} queued so far.")
+        elapsed = time.perf_counter() - started
+
+        rate = len(uids) / elapsed if elapsed > 0 else 0.0
+        print(f"📊 Processed {len(uids)} emails ({queued} queued) in {elapsed:.2f}s "
+              f"- {rate:.1f} msg/s (batch size {batch_size}).")
+        stats = dedup_stats(redis_client)
+        print(f"🔁 Dedup filter: {stats['hits']} hits, {stats['misses']} misses "
+              f"({stats['hit_rate']:.1%} hit rate).")
+
+        mail.close()
+        mail.logout()
+
+    except Exception as e:
+        print(f"An error occurred: {e}")
+
+def checkpoint_key(folder="inbox", account=EMAIL_ACCOUNT):
+    return f"fetcher:checkpoint:{account}:{folder}"
+
+def load_checkpoint(redis_client, folder="inbox", account=EMAIL_ACCOUNT):
+    """Returns (uidvalidity, last_uid) stored in Redis, or (None, 0)."""
+    data = redis_client.hgetall(checkpoint_key(folder, account))
+    if not data:
+        return None, 0
+    return data.get("uidvalidity"), int(data.get("last_uid", 0))
+
+def save_checkpoint(redis_client, uidvalidity, last_uid, folder="inbox", account=EMAIL_ACCOUNT):
+    redis_client.hset(checkpoint_key(folder, account), mapping={
+        "uidvalidity": uidvalidity,
+        "last_uid": last_uid,
+    })
+
+def get_uidvalidity(mail):
+    """Reads UIDVALIDITY from the untagged SELECT response. imaplib hands an
+    untagged response out only once, so read it right after select() and
+    keep the value for the rest of the session."""
+    _, data = mail.response("UIDVALIDITY")
+    if not data or data[0] is None:
+        return None
+    value = data[0]
+    return value.decode() if isinstance(value, bytes) else str(value)
+
+def search_new_uids(mail, uidvalidity, stored_validity, last_uid):
+    """Finds the UIDs to process since the checkpoint.
+
+    Without a usable checkpoint (first run, or the server reset UIDVALIDITY)
+    we fall back to a one-off UNSEEN search.
+    """
+    if stored_validity != uidvalidity or not last_uid:
+        status, messages = mail.uid("search", None, "(UNSEEN)")
+    else:
+        status, messages = mail.uid("search", None, f"UID {last_uid + 1}:*")
+    if status != "OK" or not messages or not messages[0]:
+        return []
+    # "n:*" always matches the newest message, even when its UID is below n
+    return [u for u in messages[0].split() if int(u) > last_uid]
+
+def buffered(mail):
+    """True when a line can be read without waiting on the socket.
+
+    select() only sees the socket, but imaplib reads through a buffered file
+    (and TLS keeps decrypted bytes of its own), so an EXISTS that arrived with
+    the IDLE continuation may already be sitting in a buffer. The peek runs on
+    a non-blocking socket and only pulls in bytes that are already there.
+    """
+    if getattr(mail.sock, "pending", lambda: 0)():
+        return True
+    timeout = mail.sock.gettimeout()
+    mail.sock.setblocking(False)
+    try:
+        return bool(mail.file.peek(1))
+    except (BlockingIOError, ssl.SSLWantReadError):
+        return False
+    finally:
+        mail.sock.settimeout(timeout)
+
+def idle_wait(mail, timeout=IDLE_TIMEOUT):
+    """Issues IMAP IDLE and blocks until the server reports new mail or the
+    timeout expires. Returns True when an EXISTS notification arrived.
+
+    imaplib has no IDLE support before Python 3.14, so the command is driven
+    on the raw connection.
+    """
+    tag = mail._new_tag()
+    mail.send(tag + b" IDLE\r\n")
+    line = mail.readline()
+    if not line.startswith(b"+"):
+        raise imaplib.IMAP4.error(f"IDLE not accepted: {line!r}")
+
+    got_mail = False
+    deadline = time.monotonic() + timeout
+    while not got_mail:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        if not buffered(mail):
+            ready, _, _ = select.select([mail.sock], [], [], remaining)
+            if not ready:
+                break
+        line = mail.readline()
+        if not line:
+            raise imaplib.IMAP4.abort("connection closed during IDLE")
+        got_mail = bool(EXISTS_RE.match(line))
+
+    mail.send(b"DONE\r\n")
+    while True:
+        line = mail.readline()
+        if not line:
+            raise imaplib.IMAP4.abort("connection closed while ending IDLE")
+        if line.startswith(tag):
+            break
+    return got_mail
+
+def drain_new_mail(mail, redis_client, folder="inbox", batch_size=FETCH_BATCH_SIZE, account=EMAIL_ACCOUNT,
+                   uidvalidity=None):
+    """Processes everything after the stored checkpoint and advances it.
+    `uidvalidity` is the value read after select(); pass it on every drain
+    after the first one on a connection. Returns (fetched, queued)."""
+    if uidvalidity is None:
+        uidvalidity = get_uidvalidity(mail)
+    if uidvalidity is None:
+        raise imaplib.IMAP4.error(f"No UIDVALIDITY for {folder}, select it before draining")
+    stored_validity, last_uid = load_checkpoint(redis_client, folder, account)
+    resync = stored_validity != uidvalidity
+    if resync:
+        if stored_validity is not None:
+            print(f"⚠️ UIDVALIDITY changed ({stored_validity} -> {uidvalidity}), resetting checkpoint.")
+        last_uid = 0
+
+    ceiling = 0
+    if resync:
+        # Newest UID before the UNSEEN search. Everything up to it is either
+        # read or in the UNSEEN result, so the checkpoint can start there and
+        # already-read mail is never picked up by "UID n:*". Searched first, so
+        # mail arriving during the pass is above it and not skipped.
+        status, messages = mail.uid("search", None, "ALL")
+        if status == "OK" and messages and messages[0]:
+            ceiling = max(int(u) for u in messages[0].split())
+
+    uids = search_new_uids(mail, uidvalidity, stored_validity, last_uid)
+    if uids:
+        print(f"📧 Found {len(uids)} new emails since UID {last_uid}.")
+    queued = 0
+    for i in range(0, len(uids), batch_size):
+        batch = uids[i:i + batch_size]
+        batch_queued, handled = process_batch(mail, redis_client, batch)
+        queued += batch_queued
+        if handled:
+            last_uid = max(last_uid, max(int(u) for u in handled))
+            save_checkpoint(redis_client, uidvalidity, last_uid, folder, account)
+
+    if resync:
+        last_uid = max(last_uid, ceiling)
+        save_checkpoint(redis_client, uidvalidity, last_uid, folder, account)
+    return len(uids), queued
+
+def run_idle(folder="inbox", batch_size=FETCH_BATCH_SIZE):
+    """Daemon mode: keeps one IMAP connection open, waits on IDLE and resumes
+    from the Redis checkpoint after restarts or reconnects."""
+    redis_client = connect_to_redis()
+    if not redis_client:
+        return
+
+    while True:
+        mail = None
+        try:
+            mail = connect_to_imap(folder)
+            uidvalidity = get_uidvalidity(mail)
+            drain_new_mail(mail, redis_client, folder, batch_size, uidvalidity=uidvalidity)
+            print("👂 Waiting for new mail (IDLE)...")
+            while True:
+                if idle_wait(mail):
+                    drain_new_mail(mail, redis_client, folder, batch_size, uidvalidity=uidvalidity)
+                else:
+                    # Periodic re-IDLE doubles as a keepalive
+                    mail.noop()
+        except KeyboardInterrupt:
+            print("\n👋 Email fetcher stopped")
+            break
+        except Exception as e:
+            print(f"❌ IMAP connection error: {e}, reconnecting in {RECONNECT_DELAY}s")
+            time.sleep(RECONNECT_DELAY)
+        finally:
+            if mail is not None:
+                try:
+                    mail.logout()
+                except Exception:
+                    pass
+
 def main():
     """Main function to fetch, process, and queue tickets."""
     redis_client = connect_to_redis()
     if not redis_client:
         return
+    if STREAMING_PARSE:
+        print("⚠️ STREAMING_PARSE only applies to --batched and --idle, fetching full messages.")
 
     try:
         # Connect to the mail server
-        mail = imaplib.IMAP4_SSL(IMAP_SERVER)
-        mail.login(EMAIL_ACCOUNT, APP_PASSWORD)
-        mail.select("inbox")
-        print("✅ Logged into email account successfully.")
+        mail = connect_to_imap()
 
         # Search for all unseen emails
         status, messages = mail.search(None, "(UNSEEN)")
@@ -125,7 +479,7 @@ def main():
                     sender, subject, body = process_email(msg)
 
                     # 2. Validate Ticket (Simple validation)
-                    if not body or ".com" not in sender:
+                    if not is_valid_ticket(sender, body):
                         print(f"⚠️ Skipping invalid or external email from {sender}.")
                         mail.store(email_id, '+FLAGS', '\\Seen') # Mark as seen and skip
                         continue
@@ -134,9 +488,12 @@ def main():
                     ticket_json = create_ticket_json(sender, subject, body, msg_id_header)
                     print(f"📄 Generated JSON for ticket from {sender}")
 
-                    # 4. Push to Queue
-                    redis_client.lpush(TICKET_QUEUE_NAME, ticket_json)
-                    print(f"🚀 Pushed ticket {json.loads(ticket_json)['ticket_id']} to queue.")
+                    # 4. Push to Queue (skipped when the Message-ID was already queued)
+                    key = message_key(msg_id_header, sender, subject, body)
+                    if queue_ticket(redis_client, ticket_json, key):
+                        print(f"🚀 Pushed ticket {json.loads(ticket_json)['ticketId']} to queue.")
+                    else:
+                        print(f"🔁 Duplicate message {msg_id_header}, not queued.")
 
                     # 5. Mark as Processed (Important!)
                     mail.store(email_id, '+FLAGS', '\\Seen')
@@ -151,4 +508,23 @@ def main():
         print(f"An error occurred: {e}")
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Fetch unseen mail and queue tickets.")
+    parser.add_argument("--batched", action="store_true",
+                        help="fetch in UID batches with pipelined queue pushes")
+    parser.add_argument("--batch-size", type=int, default=FETCH_BATCH_SIZE)
+    parser.add_argument("--idle", action="store_true",
+                        help="run as a daemon using IMAP IDLE and a Redis UID checkpoint")
+    parser.add_argument("--streaming", action="store_true",
+                        help="fetch only size-capped text parts instead of full messages")
+    args = parser.parse_args()
+    if args.streaming and not (args.batched or args.idle):
+        # main() fetches whole messages one by one; only the UID batch paths stream
+        parser.error("--streaming needs --batched or --idle")
+    STREAMING_PARSE = STREAMING_PARSE or args.streaming
+
+    if args.idle:
+        run_idle(batch_size=args.batch_size)
+    elif args.batched:
+        main_batched(args.batch_size)
+    else:
+        main()
@@ -0,0 +1,368 @@
+"""Size-capped MIME handling for the fetcher.
+
+Instead of downloading whole RFC822 messages, the streaming path asks the
+server for BODYSTRUCTURE plus a few header fields, picks the first inline
+text/plain part (text/html as a fallback) and fetches only the first bytes
+of that part with a partial BODY.PEEK. Attachments are listed but never
+downloaded or decoded unless fetch_attachment() is called for them.
+
+When a server does not return a usable BODYSTRUCTURE, the message prefix is
+fed incrementally into a BytesFeedParser, capped at MAX_MESSAGE_BYTES.
+"""
+import binascii
+import imaplib
+import os
+import quopri
+import re
+from email.header import decode_header, make_header
+from email.parser import BytesFeedParser
+from html.parser import HTMLParser
+
+MAX_BODY_CHARS = int(os.getenv("MAX_BODY_CHARS", "20000"))
+MAX_MESSAGE_BYTES = int(os.getenv("MAX_MESSAGE_BYTES", str(256 * 1024)))
+FEED_CHUNK_SIZE = 64 * 1024
+HEADER_FIELDS = "FROM SUBJECT MESSAGE-ID"
+
+TOKEN_RE = re.compile(
+    rb'\s*(?:(?P<open>\()|(?P<close>\))|"(?P<quoted>(?:[^"\\]|\\.)*)"'
+    rb'|(?P<literal>\{\d+\}\s*$)|(?P<atom>[^\s()"\[\]{}]+(?:\[[^\]]*\](?:<\d+>)?)?))'
+)
+MESSAGE_START_RE = re.compile(rb"^\d+ \(")
+
+
+# --- IMAP response parsing -------------------------------------------------
+
+class Literal(bytes):
+    """Marks literal ({n}) payloads so they are not confused with atoms."""
+
+
+def _tokenize(text, tokens):
+    pos = 0
+    while pos < len(text):
+        match = TOKEN_RE.match(text, pos)
+        if not match or match.end() == pos:
+            break
+        pos = match.end()
+        if match.group("open"):
+            tokens.append("(")
+        elif match.group("close"):
+            tokens.append(")")
+        elif match.group("quoted") is not None:
+            tokens.append(re.sub(rb"\\(.)", rb"\1", match.group("quoted")))
+        elif match.group("atom"):
+            atom = match.group("atom")
+            tokens.append(None if atom.upper() == b"NIL" else atom)
+
+
+def _build(tokens, pos=0):
+    items = []
+    while pos < len(tokens):
+        token = tokens[pos]
+        if token == "(":
+            sub, pos = _build(tokens, pos + 1)
+            items.append(sub)
+        elif token == ")":
+            return items, pos + 1
+        else:
+            items.append(token)
+            pos += 1
+    return items, pos
+
+
+def parse_fetch_response(data):
+    """Turns imaplib FETCH data into {uid: {item_name: value}}.
+
+    imaplib splits a response at every literal, so one message can span
+    several tuples followed by a closing b")" line.
+    """
+    messages = []
+    for item in data:
+        head, literal = (item[0], item[1]) if isinstance(item, tuple) else (item, None)
+        if head is None:
+            continue
+        if MESSAGE_START_RE.match(head):
+            messages.append([])
+        if not messages:
+            continue
+        _tokenize(head, messages[-1])
+        if literal is not None:
+            messages[-1].append(Literal(literal))
+
+    result = {}
+    for tokens in messages:
+        tree, _ = _build(tokens)
+        if len(tree) < 2 or not isinstance(tree[1], list):
+            continue
+        fields = tree[1]
+        items = {}
+        for i in range(0, len(fields) - 1, 2):
+            key = fields[i].upper() if isinstance(fields[i], bytes) else fields[i]
+            items[bytes(key)] = fields[i + 1]
+        if b"UID" in items:
+            result[int(items[b"UID"])] = items
+    return result
+
+
+# --- BODYSTRUCTURE ----------------------------------------------------------
+
+def _str(value):
+    return value.decode("utf-8", "replace").lower() if isinstance(value, bytes) else ""
+
+
+def _params(value):
+    if not isinstance(value, list):
+        return {}
+    return {_str(value[i]): value[i + 1].decode("utf-8", "replace")
+            for i in range(0, len(value) - 1, 2) if isinstance(value[i + 1], bytes)}
+
+
+def walk_structure(node, section=""):
+    """Yields a dict per leaf part with its IMAP section number."""
+    if not isinstance(node, list) or not node:
+        return
+    if isinstance(node[0], list):
+        index = 0
+        for child in node:
+            if not isinstance(child, list):
+                break
+            index += 1
+            yield from walk_structure(child, f"{section}.{index}" if section else str(index))
+        return
+
+    params = _params(node[2]) if len(node) > 2 else {}
+    disposition = None
+    filename = params.get("name")
+    for extra in node[7:]:
+        if isinstance(extra, list) and extra and _str(extra[0]) in ("attachment", "inline"):
+            disposition = _str(extra[0])
+            filename = _params(extra[1] if len(extra) > 1 else None).get("filename", filename)
+            break
+
+    yield {
+        "section": section or "1",
+        "type": f"{_str(node[0])}/{_str(node[1])}",
+        "charset": params.get("charset", "utf-8"),
+        "encoding": _str(node[5]) if len(node) > 5 else "7bit",
+        "size": int(node[6]) if len(node) > 6 and isinstance(node[6], bytes) and node[6].isdigit() else 0,
+        "disposition": disposition,
+        "filename": filename,
+    }
+
+
+def select_parts(structure):
+    """Returns (text_part, attachments): the first inline text/plain part,
+    or text/html when there is none, plus metadata for everything else."""
+    text = html = None
+    attachments = []
+    for part in walk_structure(structure):
+        is_attachment = part["disposition"] == "attachment" or part["filename"]
+        if not is_attachment and part["type"] == "text/plain" and text is None:
+            text = part
+        elif not is_attachment and part["type"] == "text/html" and html is None:
+            html = part
+        elif is_attachment or not part["type"].startswith("text/"):
+            attachments.append(part)
+    return text or html, attachments
+
+
+# --- Decoding ---------------------------------------------------------------
+
+def decode_transfer(data, encoding):
+    """Decodes a (possibly truncated) transfer-encoded payload."""
+    if encoding == "base64":
+        data = re.sub(rb"\s+", b"", data)
+        data = data[:len(data) - len(data) % 4]
+        try:
+            return binascii.a2b_base64(data)
+        except binascii.Error:
+            return b""
+    if encoding == "quoted-printable":
+        return quopri.decodestring(data)
+    return data
+
+
+class _HTMLText(HTMLParser):
+    BLOCK_TAGS = {"p", "div", "br", "li", "tr", "h1", "h2", "h3", "h4", "table"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("script", "style"):
+            self.skip += 1
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in ("script", "style") and self.skip:
+            self.skip -= 1
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self.skip:
+            self.parts.append(data)
+
+
+def html_to_text(html):
+    parser = _HTMLText()
+    parser.feed(html)
+    parser.close()
+    lines = (re.sub(r"[ \t\r\f\v]+", " ", line).strip() for line in "".join(parser.parts).splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def part_text(data, part, max_chars=MAX_BODY_CHARS):
+    raw = decode_transfer(data, part["encoding"])
+    try:
+        text = raw.decode(part["charset"] or "utf-8", "replace")
+    except LookupError:
+        text = raw.decode("utf-8", "replace")
+    if part["type"] == "text/html":
+        text = html_to_text(text)
+    return text[:max_chars].strip()
+
+
+def decode_header_value(value):
+    if value is None:
+        return ""
+    try:
+        return str(make_header(decode_header(value)))
+    except Exception:
+        return value
+
+
+# --- Incremental full-message fallback -------------------------------------
+
+def parse_capped(chunks, max_bytes=MAX_MESSAGE_BYTES):
+    """Feeds message chunks into a BytesFeedParser, stopping at max_bytes.
+    Returns (message, truncated)."""
+    parser = BytesFeedParser()
+    fed = 0
+    truncated = False
+    for chunk in chunks:
+        if fed + len(chunk) > max_bytes:
+            chunk = chunk[:max_bytes - fed]
+            truncated = True
+        parser.feed(chunk)
+        fed += len(chunk)
+        if truncated:
+            break
+    return parser.close(), truncated
+
+
+def iter_chunks(data, size=FEED_CHUNK_SIZE):
+    view = memoryview(data)
+    for i in range(0, len(view), size):
+        yield view[i:i + size].tobytes()
+
+
+def extract_text(msg, max_chars=MAX_BODY_CHARS):
+    """Like main.process_email's body walk, but decodes only the chosen text
+    part and never touches attachments. Falls back to text/html."""
+    text = html = None
+    for part in msg.walk():
+        if part.is_multipart() or part.get_content_disposition() == "attachment":
+            continue
+        content_type = part.get_content_type()
+        if content_type == "text/plain" and text is None:
+            text = part
+        elif content_type == "text/html" and html is None:
+            html = part
+    chosen = text or html
+    if chosen is None:
+        return ""
+    payload = chosen.get_payload(decode=True) or b""
+    body = payload.decode(chosen.get_content_charset() or "utf-8", "replace")
+    if chosen is html:
+        body = html_to_text(body)
+    return body[:max_chars].strip()
+
+
+# --- Fetching ---------------------------------------------------------------
+
+def _uid_list(uids):
+    return ",".join(str(int(u)) for u in uids)
+
+
+def _body_item(items, prefix):
+    for key, value in items.items():
+        if key.startswith(prefix):
+            return value if isinstance(value, bytes) else b""
+    return b""
+
+
+def fetch_text_batch(mail, uids, max_chars=MAX_BODY_CHARS):
+    """Fetches sender, subject, Message-ID and a capped text body for a batch
+    of UIDs without downloading attachments.
+
+    Returns a list of (uid, parsed) where parsed holds sender, subject,
+    message_id, body and attachments (metadata only). A FETCH error raises,
+    and a message whose text part the server did not return is left out, so
+    the caller never marks a message seen on a transient failure.
+    """
+    status, data = mail.uid(
+        "fetch", _uid_list(uids),
+        f"(UID BODYSTRUCTURE BODY.PEEK[HEADER.FIELDS ({HEADER_FIELDS})])",
+    )
+    if status != "OK":
+        raise imaplib.IMAP4.error(f"Header fetch failed for UIDs {_uid_list(uids)}: {status}")
+
+    parsed = {}
+    wanted = {}    # (section, byte count) -> [uid, ...]
+    fallback = []  # UIDs without a usable BODYSTRUCTURE
+    for uid, items in parse_fetch_response(data).items():
+        headers, _ = parse_capped([_body_item(items, b"BODY[HEADER")])
+        text_part, attachments = select_parts(items.get(b"BODYSTRUCTURE"))
+        parsed[uid] = {
+            "sender": decode_header_value(headers.get("From")),
+            "subject": decode_header_value(headers.get("Subject")),
+            "message_id": headers.get("Message-ID"),
+            "body": "",
+            "text_part": text_part,
+            "attachments": attachments,
+        }
+        if items.get(b"BODYSTRUCTURE") is None:
+            fallback.append(uid)
+        elif text_part:
+            # Transfer encodings inflate the payload, base64 by a third
+            limit = max_chars * 4 if text_part["type"] == "text/html" else max_chars
+            count = limit * 4 // 3 + limit // 38 + 4 if text_part["encoding"] == "base64" else limit * 3
+            wanted.setdefault((text_part["section"], count), []).append(uid)
+
+    missing = set()
+    for (section, count), group in wanted.items():
+        status, data = mail.uid("fetch", _uid_list(group), f"(UID BODY.PEEK[{section}]<0.{count}>)")
+        if status != "OK":
+            raise imaplib.IMAP4.error(f"Body fetch failed for UIDs {_uid_list(group)}: {status}")
+        items_by_uid = parse_fetch_response(data)
+        for uid in group:
+            if uid not in items_by_uid:
+                missing.add(uid)
+                continue
+            parsed[uid]["body"] = part_text(_body_item(items_by_uid[uid], b"BODY["), parsed[uid]["text_part"], max_chars)
+
+    if fallback:
+        status, data = mail.uid("fetch", _uid_list(fallback), f"(UID BODY.PEEK[]<0.{MAX_MESSAGE_BYTES}>)")
+        if status != "OK":
+            raise imaplib.IMAP4.error(f"Message fetch failed for UIDs {_uid_list(fallback)}: {status}")
+        items_by_uid = parse_fetch_response(data)
+        for uid in fallback:
+            if uid not in items_by_uid:
+                missing.add(uid)
+                continue
+            msg, _ = parse_capped(iter_chunks(_body_item(items_by_uid[uid], b"BODY[")))
+            parsed[uid]["body"] = extract_text(msg, max_chars)
+
+    return [(uid, parsed[uid]) for uid in sorted(parsed) if uid not in missing]
+
+
+def fetch_attachment(mail, uid, part):
+    """Downloads and decodes a single attachment on demand."""
+    status, data = mail.uid("fetch", str(int(uid)), f"(UID BODY.PEEK[{part['section']}])")
+    if status != "OK":
+        return None
+    items = parse_fetch_response(data).get(int(uid), {})
+    return decode_transfer(_body_item(items, b"BODY["), part["encoding"])
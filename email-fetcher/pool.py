@@ -0,0 +1,237 @@
+"""Concurrent ingestion pool for several mailboxes and folders.
+
+Every (mailbox, folder) pair gets its own worker thread and IMAP connection;
+a global semaphore caps how many connections are open at the same time.
+An IDLE connection holds its slot for good, so in --idle mode with more
+folders than MAX_IMAP_CONNECTIONS one slot is kept free: the first
+MAX_IMAP_CONNECTIONS - 1 folders use IDLE and the rest are polled every
+POLL_INTERVAL seconds, taking turns on the free slot for one fetch cycle.
+
+Mailboxes are read from MAILBOXES_CONFIG (default mailboxes.json):
+
+    [
+      {"name": "it-support", "server": "imap.gmail.com",
+       "account": "it-support@example.com", "password_env": "IT_SUPPORT_PASSWORD",
+       "folders": ["inbox", "Escalations"]}
+    ]
+
+Usage:
+    python pool.py                       # drain every mailbox once and report
+    python pool.py --idle                # keep one IDLE connection per mailbox
+    python pool.py --standin 5 --messages 200 --latency 0.05
+"""
+import argparse
+import json
+import os
+import threading
+import time
+
+import main as fetcher
+
+MAILBOXES_CONFIG = os.getenv("MAILBOXES_CONFIG", "mailboxes.json")
+MAX_IMAP_CONNECTIONS = int(os.getenv("MAX_IMAP_CONNECTIONS", "4"))
+REPORT_INTERVAL = int(os.getenv("REPORT_INTERVAL", "60"))
+POLL_INTERVAL = int(os.getenv("POLL_INTERVAL", "60"))
+
+
+def load_mailboxes(path=MAILBOXES_CONFIG):
+    """Expands the config into one target per (mailbox, folder). Falls back to
+    the single mailbox configured in main.py when no config file exists."""
+    if not os.path.exists(path):
+        return [{
+            "name": fetcher.EMAIL_ACCOUNT,
+            "server": fetcher.IMAP_SERVER,
+            "account": fetcher.EMAIL_ACCOUNT,
+            "password": fetcher.APP_PASSWORD,
+            "folder": "inbox",
+        }]
+
+    with open(path) as f:
+        config = json.load(f)
+
+    targets = []
+    for box in config:
+        password = box.get("password") or os.getenv(box.get("password_env", ""), "")
+        for folder in box.get("folders", ["inbox"]):
+            targets.append({
+                "name": box.get("name", box["account"]),
+                "server": box.get("server", fetcher.IMAP_SERVER),
+                "account": box["account"],
+                "password": password,
+                "folder": folder,
+            })
+    return targets
+
+
+class MailboxStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.fetched = 0
+        self.queued = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+
+    def record(self, fetched, queued, elapsed):
+        with self.lock:
+            self.fetched += fetched
+            self.queued += queued
+            self.busy_seconds += elapsed
+
+    @property
+    def rate(self):
+        return self.fetched / self.busy_seconds if self.busy_seconds > 0 else 0.0
+
+
+class MailboxWorker(threading.Thread):
+    """Owns one IMAP connection for a single mailbox folder.
+
+    With `idle` the connection stays open on IMAP IDLE; with `poll_interval`
+    it reconnects every `poll_interval` seconds; otherwise it drains once.
+    """
+
+    def __init__(self, target, redis_client, slots, stop_event,
+                 connect=fetcher.connect_to_imap, batch_size=fetcher.FETCH_BATCH_SIZE, idle=False,
+                 poll_interval=0):
+        super().__init__(name=f"{target['name']}/{target['folder']}", daemon=True)
+        self.target = target
+        self.redis_client = redis_client
+        self.slots = slots
+        self.stop_event = stop_event
+        self.connect = connect
+        self.batch_size = batch_size
+        self.idle = idle
+        self.poll_interval = poll_interval
+        self.stats = MailboxStats()
+
+    def _drain(self, mail, uidvalidity):
+        started = time.perf_counter()
+        fetched, queued = fetcher.drain_new_mail(
+            mail, self.redis_client, self.target["folder"], self.batch_size, self.target["account"],
+            uidvalidity=uidvalidity,
+        )
+        self.stats.record(fetched, queued, time.perf_counter() - started)
+
+    def _session(self):
+        with self.slots:
+            mail = self.connect(
+                self.target["folder"], self.target["server"],
+                self.target["account"], self.target["password"],
+            )
+            try:
+                uidvalidity = fetcher.get_uidvalidity(mail)
+                self._drain(mail, uidvalidity)
+                while self.idle and not self.stop_event.is_set():
+                    if fetcher.idle_wait(mail):
+                        self._drain(mail, uidvalidity)
+                    else:
+                        mail.noop()
+            finally:
+                try:
+                    mail.logout()
+                except Exception:
+                    pass
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                self._session()
+                if self.poll_interval:
+                    self.stop_event.wait(self.poll_interval)
+                elif not self.idle:
+                    return
+            except Exception as e:
+                self.stats.errors += 1
+                print(f"❌ [{self.name}] IMAP error: {e}, reconnecting in {fetcher.RECONNECT_DELAY}s")
+                self.stop_event.wait(fetcher.RECONNECT_DELAY)
+
+
+def report(workers):
+    print(f"{'mailbox/folder':40} {'fetched':>8} {'queued':>8} {'errors':>7} {'msg/s':>8}")
+    for w in workers:
+        s = w.stats
+        print(f"{w.name[:40]:40} {s.fetched:>8} {s.queued:>8} {s.errors:>7} {s.rate:>8.1f}")
+
+
+def run_pool(targets, redis_client, max_connections=MAX_IMAP_CONNECTIONS,
+             connect=fetcher.connect_to_imap, batch_size=fetcher.FETCH_BATCH_SIZE, idle=False,
+             poll_interval=POLL_INTERVAL):
+    # IDLE workers never give their slot back, so keep one for the rest
+    idle_count = len(targets) if len(targets) <= max_connections else max_connections - 1
+    if idle and idle_count < len(targets):
+        print(f"⚠️ {len(targets)} mailbox folders but only {max_connections} connection slots; "
+              f"{idle_count} use IDLE, {len(targets) - idle_count} are polled every {poll_interval}s.")
+
+    slots = threading.BoundedSemaphore(max_connections)
+    stop_event = threading.Event()
+    workers = [
+        MailboxWorker(t, redis_client, slots, stop_event, connect, batch_size,
+                      idle=idle and i < idle_count, poll_interval=poll_interval if idle and i >= idle_count else 0)
+        for i, t in enumerate(targets)
+    ]
+
+    started = time.perf_counter()
+    for w in workers:
+        w.start()
+
+    try:
+        last_report = time.monotonic()
+        while any(w.is_alive() for w in workers):
+            for w in workers:
+                w.join(timeout=1)
+            if idle and time.monotonic() - last_report >= REPORT_INTERVAL:
+                report(workers)
+                last_report = time.monotonic()
+    except KeyboardInterrupt:
+        print("\n👋 Ingestion pool stopping")
+        stop_event.set()
+
+    elapsed = time.perf_counter() - started
+    report(workers)
+    total = sum(w.stats.fetched for w in workers)
+    print(f"📊 {total} emails across {len(workers)} mailbox folders in {elapsed:.2f}s "
+          f"- {total / elapsed if elapsed > 0 else 0.0:.1f} msg/s overall "
+          f"({max_connections} max connections).")
+    stats = fetcher.dedup_stats(redis_client)
+    print(f"🔁 Dedup filter: {stats['hits']} hits, {stats['misses']} misses "
+          f"({stats['hit_rate']:.1%} hit rate).")
+    return workers
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest several mailboxes concurrently.")
+    parser.add_argument("--config", default=MAILBOXES_CONFIG)
+    parser.add_argument("--max-connections", type=int, default=MAX_IMAP_CONNECTIONS)
+    parser.add_argument("--batch-size", type=int, default=fetcher.FETCH_BATCH_SIZE)
+    parser.add_argument("--idle", action="store_true", help="keep connections open with IMAP IDLE")
+    parser.add_argument("--poll-interval", type=int, default=POLL_INTERVAL,
+                        help="seconds between fetch cycles for folders beyond the IDLE connections")
+    parser.add_argument("--streaming", action="store_true",
+                        help="fetch only size-capped text parts instead of full messages")
+    parser.add_argument("--standin", type=int, default=0,
+                        help="run against N in-memory stand-in mailboxes instead of real servers")
+    parser.add_argument("--messages", type=int, default=100, help="messages per stand-in mailbox")
+    parser.add_argument("--latency", type=float, default=0.02, help="stand-in round-trip latency (s)")
+    args = parser.parse_args()
+    fetcher.STREAMING_PARSE = fetcher.STREAMING_PARSE or args.streaming
+
+    redis_client = fetcher.connect_to_redis()
+    if not redis_client:
+        raise SystemExit(1)
+
+    connect = fetcher.connect_to_imap
+    if args.standin:
+        from imap_standin import StandInServer
+
+        server = StandInServer(latency=args.latency)
+        targets = []
+        for i in range(args.standin):
+            account = f"dept{i}@standin.local"
+            server.add_messages(account, "inbox", args.messages)
+            targets.append({"name": f"dept{i}", "server": "standin", "account": account,
+                            "password": "", "folder": "inbox"})
+        connect = server.connect
+        args.idle = False
+    else:
+        targets = load_mailboxes(args.config)
+
+    run_pool(targets, redis_client, args.max_connections, connect, args.batch_size, args.idle, args.poll_interval)
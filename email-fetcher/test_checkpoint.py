@@ -0,0 +1,89 @@
+"""Checkpoint handling of drain_new_mail against the in-memory IMAP stand-in.
+
+    python -m unittest test_checkpoint     (from email-fetcher/)
+"""
+import unittest
+
+import main as fetcher
+from imap_standin import StandInServer
+
+ACCOUNT = "support@example.com"
+
+
+class FakeRedis:
+    """The few Redis calls the fetcher makes, kept in dicts."""
+
+    class Pipeline:
+        def __init__(self):
+            self.calls = []
+
+        def execute(self):
+            results = [call() for call in self.calls]
+            self.calls = []
+            return results
+
+    def __init__(self):
+        self.hashes, self.seen, self.queued = {}, set(), []
+
+    def pipeline(self, transaction=False):
+        return self.Pipeline()
+
+    def register_script(self, script):
+        def run(keys, args, client=None):
+            def call():
+                if keys[0] in self.seen:
+                    return 0
+                self.seen.add(keys[0])
+                self.queued.append(args[2])
+                return 1
+            if client is not None:
+                client.calls.append(call)
+                return None
+            return call()
+        return run
+
+    def hgetall(self, key):
+        return dict(self.hashes.get(key, {}))
+
+    def hset(self, key, mapping):
+        if any(value is None for value in mapping.values()):
+            raise TypeError("Redis does not accept None")
+        self.hashes.setdefault(key, {}).update({k: str(v) for k, v in mapping.items()})
+
+
+class DrainTest(unittest.TestCase):
+    def setUp(self):
+        self.server = StandInServer()
+        self.redis = FakeRedis()
+        self.mail = self.server.connect("inbox", None, ACCOUNT, "")
+
+    def checkpoint(self):
+        return fetcher.load_checkpoint(self.redis, "inbox", ACCOUNT)
+
+    def test_uidvalidity_is_only_handed_out_once(self):
+        self.assertEqual(fetcher.get_uidvalidity(self.mail), self.server.uidvalidity)
+        self.assertIsNone(fetcher.get_uidvalidity(self.mail))
+
+    def test_second_drain_on_one_connection_resumes_from_checkpoint(self):
+        self.server.add_messages(ACCOUNT, "inbox", 3)
+        uidvalidity = fetcher.get_uidvalidity(self.mail)
+        self.assertEqual(fetcher.drain_new_mail(self.mail, self.redis, "inbox", 50, ACCOUNT,
+                                                uidvalidity=uidvalidity), (3, 3))
+        self.assertEqual(self.checkpoint(), (self.server.uidvalidity, 3))
+
+        # Mail arriving during IDLE: no new SELECT, so no untagged UIDVALIDITY
+        self.server.add_messages(ACCOUNT, "inbox", 2)
+        self.assertEqual(fetcher.drain_new_mail(self.mail, self.redis, "inbox", 50, ACCOUNT,
+                                                uidvalidity=uidvalidity), (2, 2))
+        self.assertEqual(self.checkpoint(), (self.server.uidvalidity, 5))
+        self.assertEqual(len(self.redis.queued), 5)
+
+    def test_drain_without_uidvalidity_fails_before_touching_the_checkpoint(self):
+        fetcher.get_uidvalidity(self.mail)
+        with self.assertRaises(fetcher.imaplib.IMAP4.error):
+            fetcher.drain_new_mail(self.mail, self.redis, "inbox", 50, ACCOUNT)
+        self.assertEqual(self.checkpoint(), (None, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
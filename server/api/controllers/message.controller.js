@@ -141,4 +141,93 @@ export const sendMessage = async (req, res) => {
     console.error("❌ Send message error:", error);
     res.status(500).json({ message: error.message });
   }
-};
\ No newline at end of file
+};
+
+// Streamed assistant replies: the triage service opens an empty message,
+// then sends the text generated so far until the reply is complete.
+export const startAIMessage = async (req, res) => {
+  try {
+    const { ticketId } = req.params;
+    const userId = req.user?.userId || "68de96b00ca9e85f42aeaa86";
+
+    const ticket = await Ticket.findOne({ ticketId });
+    if (!ticket) {
+      return res.status(404).json({ message: "Ticket not found" });
+    }
+
+    ticket.chat.push({
+      user: userId,
+      content: req.body?.content || "",
+      attachment: "",
+      mimeType: "",
+      createdAt: new Date(),
+    });
+    await ticket.save();
+
+    const populatedTicket = await Ticket.findOne({ ticketId })
+      .select("chat")
+      .populate("chat.user", "name email profilePicture");
+
+    const lastMessage = populatedTicket.chat[populatedTicket.chat.length - 1];
+
+    req.io.to(ticketId).emit("newMessage", {
+      ticketId,
+      message: lastMessage,
+    });
+
+    res.status(201).json(lastMessage);
+  } catch (error) {
+    console.error("❌ Start AI message error:", error);
+    res.status(500).json({ message: error.message });
+  }
+};
+
+export const updateAIMessage = async (req, res) => {
+  try {
+    const { ticketId, messageId } = req.params;
+    const { content, done } = req.body;
+
+    const result = await Ticket.updateOne(
+      { ticketId, "chat._id": messageId },
+      { $set: { "chat.$.content": content || "" } }
+    );
+    if (result.matchedCount === 0) {
+      return res.status(404).json({ message: "Message not found" });
+    }
+
+    req.io.to(ticketId).emit("messageUpdated", {
+      ticketId,
+      messageId,
+      content: content || "",
+      done: !!done,
+    });
+
+    res.status(200).json({ messageId, done: !!done });
+  } catch (error) {
+    console.error("❌ Update AI message error:", error);
+    res.status(500).json({ message: error.message });
+  }
+};
+
+// Removes a streamed message whose generation failed, so the retried reply
+// is the only one left in the chat
+export const deleteAIMessage = async (req, res) => {
+  try {
+    const { ticketId, messageId } = req.params;
+
+    const result = await Ticket.updateOne(
+      { ticketId },
+      { $pull: { chat: { _id: messageId } } }
+    );
+    if (result.matchedCount === 0) {
+      return res.status(404).json({ message: "Ticket not found" });
+    }
+
+    req.io.to(ticketId).emit("messageDeleted", { ticketId, messageId });
+
+    res.status(200).json({ messageId });
+  } catch (error) {
+    console.error("❌ Delete AI message error:", error);
+    res.status(500).json({ message: error.message });
+  }
+};
@@ -1,5 +1,11 @@
 import express from "express";
-import { getTicketMessages, sendMessage } from "../controllers/message.controller.js";
+import {
+  getTicketMessages,
+  sendMessage,
+  startAIMessage,
+  updateAIMessage,
+  deleteAIMessage,
+} from "../controllers/message.controller.js";
 import { authMiddleware } from "../utils/verifyUser.js";
 import { handleUpload } from "../utils/upload.js";
 
@@ -8,5 +14,8 @@ const router = express.Router();
 router.get("/:ticketId/messages", authMiddleware, getTicketMessages);
 router.post("/:ticketId/messages", authMiddleware, handleUpload, sendMessage);
 router.post("/:ticketId/messagesAI", handleUpload, sendMessage);
+router.post("/:ticketId/messagesAI/stream", startAIMessage);
+router.patch("/:ticketId/messagesAI/:messageId", updateAIMessage);
+router.delete("/:ticketId/messagesAI/:messageId", deleteAIMessage);
 
 export default router;
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""Per-ticket token and latency cost of single vs. batched classification.
+
+Classifies the same tickets once per ticket and once in batches of
+--batch-size against the Groq API (needs GROQ_API_KEY), with the
+classification cache disabled, and prints the usage counters:
+    python scripts/bench_batch_classify.py --tickets 20 --batch-size 5
+"""
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+os.environ["CLASSIFY_CACHE_ENABLED"] = "false"
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from src.triage.config import settings
+from src.triage.llm import classifier
+
+SAMPLES = [
+    ("VPN down for the whole sales team", "Nobody in sales can connect to the VPN since 9am, we have client calls in an hour."),
+    ("Password reset", "I locked myself out of my account after too many attempts, please reset my password."),
+    ("Build pipeline failing on main", "The deploy stage fails with 'image pull backoff' after yesterday's merge."),
+    ("Suspicious email", "Got an email claiming to be from HR asking me to confirm my bank details via a link."),
+    ("Export button does nothing", "Clicking Export CSV on the reports page does nothing, console shows a 500 from /api/export."),
+    ("Need a second monitor", "Could I get a second monitor for my desk? Nice to have, not urgent."),
+    ("Wifi drops on floor 3", "The office wifi on floor 3 keeps disconnecting every few minutes."),
+    ("Add dark mode to dashboard", "Feature request: a dark mode option for the internal dashboard."),
+    ("Database queries slow", "Customer search queries take 20+ seconds since the last migration."),
+    ("Printer out of toner", "The printer near the kitchen is out of toner."),
+]
+
+
+def make_tickets(n):
+    return [
+        {"ticketId": f"BENCH-{i:04d}", "title": title, "description": description, "createdBy": "bench@example.com"}
+        for i, (title, description) in enumerate(SAMPLES[i % len(SAMPLES)] for i in range(n))
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tickets", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=5)
+    args = parser.parse_args()
+
+    settings.CLASSIFY_BATCH_SIZE = args.batch_size
+    tickets = make_tickets(args.tickets)
+
+    started = time.perf_counter()
+    single = {ticket["ticketId"]: classifier.classify_ticket(ticket) for ticket in tickets}
+    single_wall = time.perf_counter() - started
+
+    started = time.perf_counter()
+    batched = classifier.classify_batch(tickets)
+    batch_wall = time.perf_counter() - started
+
+    agree = sum(
+        (single[t].department, single[t].type, single[t].priority)
+        == (batched[t].department, batched[t].type, batched[t].priority)
+        for t in single
+    )
+    print(f"Tickets: {len(tickets)}, batch size {args.batch_size}")
+    for line in classifier.format_usage_report(classifier.usage_report()):
+        print(line)
+    print(f"Wall time: single {single_wall:.1f}s, batched {batch_wall:.1f}s")
+    print(f"Agreement (department/type/priority): {agree}/{len(tickets)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""Before/after throughput of redis_consumer: one ticket per loop vs. micro-batches.
+
+Runs against a scratch Redis db and Mongo database so real queues are untouched:
+    python scripts/bench_consumer.py --tickets 2000 --batch-size 50
+"""
+import argparse
+import os
+import sys
+import time
+import uuid
+from pathlib import Path
+
+os.environ["REDIS_URL"] = os.environ.get("BENCH_REDIS_URL", "redis://localhost:6379/15")
+os.environ["MONGO_DB_NAME"] = os.environ.get("BENCH_MONGO_DB_NAME", "triage_bench")
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from src.triage.utils import queue
+from src.triage.workers import redis_consumer
+
+GROUP = "bench_consumer"
+
+
+def fill(job_type, count):
+    queue.r.delete(queue.stream_key(job_type))
+    queue.ensure_group(job_type, GROUP)
+    run_id = uuid.uuid4().hex[:8]
+    queue.enqueue_jobs(job_type, [{
+        "ticketId": f"bench-{run_id}-{i}",
+        "title": "VPN not connecting",
+        "description": f"Cannot reach the VPN gateway since 9am (bench ticket {i}).",
+        "createdBy": "bench@example.com",
+    } for i in range(count)])
+
+
+def drain(job_type, handler, batch_size, linger_ms, batch_handler):
+    consumer = queue.consumer_name()
+    processed = 0
+    started = time.perf_counter()
+    while True:
+        jobs = queue.read_batch(job_type, GROUP, consumer, batch_size, linger_ms)
+        if not jobs:
+            break
+        if batch_handler:
+            handler([data for _, data in jobs])
+        else:
+            for _, data in jobs:
+                handler(data)
+        queue.ack_jobs(job_type, GROUP, [entry_id for entry_id, _ in jobs])
+        processed += len(jobs)
+    return processed, time.perf_counter() - started
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="redis_consumer throughput benchmark")
+    parser.add_argument("--tickets", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--linger-ms", type=int, default=50)
+    args = parser.parse_args()
+
+    # Short block so drain() ends once the stream is empty
+    queue.settings.QUEUE_BLOCK_MS = 200
+    redis_consumer.db.tickets.delete_many({"ticketId": {"$regex": "^bench-"}})
+
+    results = {}
+    for label, handler, size, linger, batched in [
+        ("single", redis_consumer.process_ticket, 1, 0, False),
+        ("batched", redis_consumer.process_tickets, args.batch_size, args.linger_ms, True),
+    ]:
+        fill("bench_tickets", args.tickets)
+        processed, elapsed = drain("bench_tickets", handler, size, linger, batched)
+        results[label] = processed / elapsed if elapsed else 0.0
+        print(f"{label:8} {processed:>6} tickets in {elapsed:>7.2f}s -> {results[label]:>8.1f} tickets/s")
+
+    if results.get("single"):
+        print(f"speedup: {results['batched'] / results['single']:.1f}x")
+
+    redis_consumer.db.tickets.delete_many({"ticketId": {"$regex": "^bench-"}})
+    queue.r.delete(queue.stream_key("bench_tickets"), queue.stream_key("classify"))
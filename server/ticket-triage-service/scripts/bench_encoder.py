@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""Load time, memory and latency of the query encoder, per backend.
+
+For each backend a fresh process loads the model and measures: load
+time, resident memory after loading, single-query latency, throughput of
+concurrent queries coalesced by the batcher, and a cache hit.
+
+    python scripts/bench_encoder.py                       # torch and onnx
+    python scripts/bench_encoder.py --backends torch --threads 16
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+os.environ.setdefault("GROQ_API_KEY", "offline")
+os.environ.setdefault("REDIS_URL", "redis://localhost:6379")
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+QUERIES = [
+    "VPN disconnects every few minutes when working from home",
+    "Outlook keeps asking for my password after the update",
+    "Printer on the third floor shows error 0x80070005",
+    "Need access to the finance shared drive for the audit",
+    "Laptop fan is loud and the machine is very slow",
+    "MFA codes are not arriving on my new phone",
+    "Cannot join Teams meetings, camera is not detected",
+    "Payroll report dashboard times out when filtering by month",
+]
+
+
+def rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KB on Linux
+
+
+def measure(backend: str, queries: int, threads: int) -> dict:
+    os.environ["EMBEDDING_BACKEND"] = backend
+    from src.triage.retriever import encoder
+
+    before = rss_mb()
+    started = time.perf_counter()
+    encoder.warm()
+    load = time.perf_counter() - started
+    memory = rss_mb() - before
+
+    texts = [f"{QUERIES[i % len(QUERIES)]} (#{i})" for i in range(queries)]
+    latencies = []
+    for text in texts[:min(queries, 50)]:
+        started = time.perf_counter()
+        encoder.encode([text])
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(encoder.encode_query, texts))
+    concurrent = time.perf_counter() - started
+
+    started = time.perf_counter()
+    encoder.encode_query(texts[0])
+    hit = (time.perf_counter() - started) * 1000
+    report = encoder.encoder_report()
+    return {
+        "backend": report["backend"],
+        "load_seconds": load,
+        "memory_mb": memory,
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": sorted(latencies)[int(0.95 * (len(latencies) - 1))],
+        "concurrent_qps": queries / concurrent,
+        "avg_batch": report["avg_batch"],
+        "cache_hit_ms": hit,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", nargs="+", default=["torch", "onnx"], choices=["torch", "onnx"])
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--threads", type=int, default=8, help="concurrent callers sharing the batcher")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(args.child, args.queries, args.threads)))
+        return
+
+    print(f"{args.queries} queries, {args.threads} concurrent callers\n")
+    print(f"{'backend':<8} {'load s':>7} {'memory MB':>10} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'conc. q/s':>10} {'avg batch':>10} {'cache hit ms':>13}")
+    for backend in args.backends:
+        # A fresh process per backend so load time and memory are not shared
+        out = subprocess.run([sys.executable, __file__, "--child", backend, "--queries", str(args.queries),
+                              "--threads", str(args.threads)], capture_output=True, text=True)
+        if out.returncode != 0:
+            print(f"{backend:<8} failed: {out.stderr.strip().splitlines()[-1] if out.stderr.strip() else out.returncode}")
+            continue
+        r = json.loads(out.stdout.strip().splitlines()[-1])
+        label = r["backend"] if r["backend"] == backend else f"{backend}->{r['backend']}"
+        print(f"{label:<8} {r['load_seconds']:>7.1f} {r['memory_mb']:>10.0f} {r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} "
+              f"{r['concurrent_qps']:>10.0f} {r['avg_batch']:>10.1f} {r['cache_hit_ms']:>13.3f}")
+
+
+if __name__ == "__main__":
+    main()
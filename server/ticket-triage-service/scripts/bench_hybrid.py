@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""BM25 index build time, memory and query latency, alone and fused with
+vector search, on a synthetic knowledge base.
+
+Chunks are helpdesk-like word soup with an error code or hostname planted
+in some of them; queries ask for one planted token plus a few words, so
+hit@k shows whether the exact token is found. Vectors are random (the
+encoder is not involved), so only the BM25 side has meaningful hits.
+
+    python scripts/bench_hybrid.py --chunks 100000 --queries 500
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+os.environ.setdefault("GROQ_API_KEY", "offline")
+os.environ.setdefault("REDIS_URL", "redis://localhost:6379")
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+import numpy as np
+
+from src.triage.config import settings
+from src.triage.retriever.bm25 import BM25Index, reciprocal_rank_fusion
+from src.triage.retriever.index import EmbeddedIndex
+
+WORDS = ("vpn printer password reset laptop outlook email server access network wifi account locked "
+         "install update license disk backup restore share drive permission certificate browser proxy "
+         "login token mfa phone teams meeting calendar invoice payroll ticket monitor keyboard docking "
+         "driver firmware crash slow timeout sync mailbox quota database report dashboard").split()
+
+
+def synthetic_kb(chunks, words_per_chunk, planted_share, seed):
+    rng = np.random.default_rng(seed)
+    # Zipf-like word frequencies, as in real text
+    weights = 1.0 / np.arange(1, len(WORDS) + 1)
+    weights /= weights.sum()
+    texts, planted = [], []
+    for i in range(chunks):
+        words = list(rng.choice(WORDS, words_per_chunk, p=weights))
+        if rng.random() < planted_share:
+            token = f"0x{rng.integers(0, 2**32):08x}" if rng.random() < 0.5 else \
+                f"srv-{rng.choice(WORDS)}{rng.integers(1, 999):03d}.corp.local"
+            words.insert(int(rng.integers(0, len(words))), token)
+            planted.append((i, token))
+        texts.append(" ".join(words))
+    return texts, planted
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    return (latencies[len(latencies) // 2], latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))],
+            statistics.mean(latencies))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=100000)
+    parser.add_argument("--words", type=int, default=120, help="words per chunk")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--updates", type=int, default=1000, help="chunks changed in the incremental update")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    texts, planted = synthetic_kb(args.chunks, args.words, 0.2, args.seed)
+    ids = [f"kb/doc{i // 10}.md#{i % 10}" for i in range(args.chunks)]
+    print(f"{args.chunks} chunks of {args.words} words, {len(planted)} with a planted error code or hostname\n")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        started = time.perf_counter()
+        index = BM25Index()
+        for chunk_id, text in zip(ids, texts):
+            index.add(chunk_id, text)
+        index.save(Path(tmp) / "bm25")
+        build = time.perf_counter() - started
+        memory = index.memory()
+        print(f"BM25 build:   {build:.1f}s ({args.chunks / build:.0f} chunks/s), {memory['postings']} postings "
+              f"in {memory['segments']} segment(s), {memory['bytes'] / 2**20:.1f} MB")
+
+        started = time.perf_counter()
+        index = BM25Index.load(Path(tmp) / "bm25")
+        print(f"BM25 load:    {(time.perf_counter() - started) * 1000:.0f} ms")
+
+        started = time.perf_counter()
+        for i in rng.choice(args.chunks, args.updates, replace=False):
+            index.add(ids[i], texts[i] + " updated")
+        index.save(Path(tmp) / "bm25")
+        print(f"BM25 update:  {args.updates} changed chunks applied and saved in "
+              f"{(time.perf_counter() - started) * 1000:.0f} ms")
+
+        vectors = rng.standard_normal((args.chunks, args.dim)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        vector_index = EmbeddedIndex.write(Path(tmp) / "vectors", vectors,
+                                           [{"id": chunk_id} for chunk_id in ids], graph="never", quantization="none")
+
+        queries = [planted[i] for i in rng.integers(0, len(planted), args.queries)]
+        bm25_latencies, hybrid_latencies, hits, hybrid_hits = [], [], 0, 0
+        candidates = settings.RETRIEVER_HYBRID_CANDIDATES
+        for row, token in queries:
+            query = f"{token} {' '.join(rng.choice(WORDS, 4))}"
+            started = time.perf_counter()
+            keyword = [chunk_id for chunk_id, _ in index.search(query, candidates)]
+            bm25_latencies.append((time.perf_counter() - started) * 1000)
+            hits += ids[row] in keyword[:args.k]
+
+            query_vector = vectors[rng.integers(0, args.chunks)]
+            started = time.perf_counter()
+            rows, _ = vector_index.search(query_vector, candidates)
+            semantic = [vector_index.docs[r]["id"] for r in rows]
+            fused = reciprocal_rank_fusion([semantic, [chunk_id for chunk_id, _ in index.search(query, candidates)]])
+            hybrid_latencies.append((time.perf_counter() - started) * 1000)
+            hybrid_hits += ids[row] in [chunk_id for chunk_id, _ in fused[:args.k]]
+
+    print(f"\n{'search':<22} {'hit@' + str(args.k):>7} {'p50 ms':>8} {'p95 ms':>8} {'mean ms':>8}")
+    for name, latencies, found in (("BM25", bm25_latencies, hits),
+                                   ("hybrid (vector + BM25)", hybrid_latencies, hybrid_hits)):
+        p50, p95, mean = percentiles(latencies)
+        print(f"{name:<22} {found / len(queries):>7.3f} {p50:>8.2f} {p95:>8.2f} {mean:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""Tail latency with and without hedging, against the mock LLM provider.
+
+Runs classification-sized requests through ResilientProvider backed by
+MockProvider, once with hedging off and once with it on, and prints
+p50/p95/p99 latency, hedges sent and error counts. Needs no API key or
+Redis (the rate limiter is disabled):
+    python scripts/bench_provider.py --requests 500 --latency lognormal:600:0.8
+    python scripts/bench_provider.py --error-rate 0.6   # watch the breaker open
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+os.environ["LLM_PROVIDER"] = "mock"
+os.environ["RATE_LIMIT_ENABLED"] = "false"
+os.environ.setdefault("GROQ_API_KEY", "offline")
+os.environ.setdefault("REDIS_URL", "redis://localhost:6379")
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from src.triage.config import settings
+from src.triage.llm.provider import MockProvider, ResilientProvider, CircuitOpenError
+
+REQUEST = {
+    "model": "openai/gpt-oss-120b",
+    "messages": [{"role": "user", "content": "Classify: VPN is down for the whole sales team"}],
+    "max_completion_tokens": 512,
+}
+
+
+async def run(provider, requests, concurrency, timeout):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors, rejected = [], 0, 0
+
+    async def one(i):
+        nonlocal errors, rejected
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await provider.acomplete(**REQUEST, timeout=timeout)
+                latencies.append(time.perf_counter() - started)
+            except CircuitOpenError:
+                rejected += 1
+            except Exception:
+                errors += 1
+
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return latencies, errors, rejected
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000 if ordered else float("nan")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", default="lognormal:600:0.8", help="mock latency distribution")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--timeout", type=float, default=10.0)
+    parser.add_argument("--percentile", type=float, default=0.95, help="hedge after this latency percentile")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    settings.LLM_HEDGE_PERCENTILE = args.percentile
+    print(f"{args.requests} requests, {args.concurrency} in flight, latency {args.latency}, "
+          f"error rate {args.error_rate:.0%}, deadline {args.timeout:.0f}s")
+    for hedging in (False, True):
+        settings.LLM_HEDGE_ENABLED = hedging
+        provider = ResilientProvider(MockProvider(args.latency, {}, args.error_rate, args.seed))
+        started = time.perf_counter()
+        latencies, errors, rejected = asyncio.run(run(provider, args.requests, args.concurrency, args.timeout))
+        elapsed = time.perf_counter() - started
+        stats = provider.stats()
+        print(f"\nHedging {'on' if hedging else 'off'}:")
+        print(f"  latency   p50 {percentile(latencies, 0.5):.0f} ms, p95 {percentile(latencies, 0.95):.0f} ms, "
+              f"p99 {percentile(latencies, 0.99):.0f} ms, mean "
+              f"{statistics.mean(latencies) * 1000 if latencies else float('nan'):.0f} ms")
+        print(f"  backups   {stats['hedges']} hedges, {stats['retries']} retries, {stats['hedge_wins']} won by the "
+              f"backup, {(stats['hedges'] + stats['retries']) / args.requests:.1%} extra requests")
+        print(f"  failures  {errors} errors, {stats['timeouts']} timeouts, {rejected} rejected by the breaker "
+              f"({sum(b.trips for b in provider.breakers.values())} trips)")
+        print(f"  wall time {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
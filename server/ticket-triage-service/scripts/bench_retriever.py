@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""Recall and latency of the retriever backends on the same vectors.
+
+Generates a synthetic corpus of clustered, normalized vectors (the encoder
+is not involved, so this measures search only), computes exact top-k with
+numpy as ground truth, and reports recall@k and per-query latency for:
+  - embedded, exhaustive: the memory-mapped index with a dot product per row
+  - embedded, HNSW:       the same index with an hnswlib graph (if installed)
+  - embedded, int8/binary: quantized codes scanned in memory, candidates
+                          re-ranked against the float vectors on disk
+  - qdrant:               a temporary collection at VECTOR_DB_URL (--qdrant)
+along with the memory each one scans per query.
+
+    python scripts/bench_retriever.py --docs 100000 --queries 200
+    python scripts/bench_retriever.py --docs 20000 --qdrant
+    python scripts/bench_retriever.py --no-hnsw --rerank 4 10 30
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+os.environ.setdefault("GROQ_API_KEY", "offline")
+os.environ.setdefault("REDIS_URL", "redis://localhost:6379")
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+import numpy as np
+
+from src.triage.config import settings
+from src.triage.retriever.index import EmbeddedIndex, GRAPH_FILE, top_k, _load_hnswlib
+from src.triage.retriever.quantize import QUANTIZERS
+
+
+def normalize(vectors):
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def synthetic_corpus(docs, queries, dim, clusters, spread, seed):
+    """Documents scattered around topic centroids, and queries that are
+    noisy copies of random documents (a question about a KB article)."""
+    rng = np.random.default_rng(seed)
+    centroids = normalize(rng.standard_normal((clusters, dim)))
+    # Noise of norm `spread` around unit vectors: ~0.7 puts documents at about
+    # 0.8 cosine from their topic and queries at about 0.8 from their source,
+    # similar to what sentence embeddings give for paraphrases
+    noise = rng.standard_normal((docs, dim)) / np.sqrt(dim)
+    vectors = normalize(centroids[rng.integers(0, clusters, docs)] + spread * noise)
+    picked = vectors[rng.integers(0, docs, queries)]
+    questions = normalize(picked + spread * rng.standard_normal((queries, dim)) / np.sqrt(dim))
+    return vectors, questions
+
+
+def measure(search, queries, truth, k, memory):
+    latencies, hits = [], 0
+    for query, expected in zip(queries, truth):
+        started = time.perf_counter()
+        found = search(query, k)
+        latencies.append((time.perf_counter() - started) * 1000)
+        hits += len(set(found) & set(expected))
+    latencies.sort()
+    return {
+        "recall": hits / (len(queries) * k),
+        "p50": latencies[len(latencies) // 2],
+        "p95": latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))],
+        "mean": statistics.mean(latencies),
+        "memory": memory,
+    }
+
+
+def qdrant_search(vectors, batch=1000):
+    """Loads the vectors into a throwaway collection; returns a search function and a cleanup."""
+    from qdrant_client import QdrantClient
+    from qdrant_client.models import Distance, PointStruct, VectorParams
+
+    client = QdrantClient(url=settings.VECTOR_DB_URL, timeout=60, check_compatibility=False)
+    name = f"bench_{os.getpid()}"
+    client.create_collection(name, vectors_config=VectorParams(size=vectors.shape[1], distance=Distance.COSINE))
+    for i in range(0, len(vectors), batch):
+        client.upsert(name, [PointStruct(id=j, vector=vectors[j].tolist()) for j in range(i, min(i + batch, len(vectors)))])
+
+    def search(query, k):
+        if hasattr(client, "query_points"):
+            points = client.query_points(name, query=query.tolist(), limit=k).points
+        else:
+            points = client.search(name, query_vector=query.tolist(), limit=k)
+        return [p.id for p in points]
+
+    return search, lambda: client.delete_collection(name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--spread", type=float, default=0.7, help="noise around topics and source documents")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--ef", type=int, nargs="+", default=[settings.RETRIEVER_HNSW_EF_SEARCH],
+                        help="HNSW search breadths to compare")
+    parser.add_argument("--rerank", type=int, nargs="+", default=[settings.RETRIEVER_RERANK_FACTOR],
+                        help="candidates re-ranked per result with quantized codes")
+    parser.add_argument("--quantization", nargs="*", choices=list(QUANTIZERS), default=list(QUANTIZERS))
+    parser.add_argument("--no-hnsw", action="store_true")
+    parser.add_argument("--qdrant", action="store_true", help=f"also load and query Qdrant at {settings.VECTOR_DB_URL}")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    vectors, queries = synthetic_corpus(args.docs, args.queries, args.dim, args.clusters, args.spread, args.seed)
+    truth = [list(top_k(vectors @ q, args.k)[0]) for q in queries]
+    docs = [{"doc_id": f"doc-{i}", "text": ""} for i in range(args.docs)]
+    print(f"{args.docs} vectors x {args.dim} dims ({vectors.nbytes / 2**20:.0f} MB), "
+          f"{args.queries} queries, recall@{args.k} against exact search\n")
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        started = time.perf_counter()
+        flat = EmbeddedIndex.write(Path(tmp) / "flat", vectors, docs, graph="never", quantization="none")
+        print(f"embedded index written in {time.perf_counter() - started:.1f}s")
+        results["embedded, exhaustive"] = measure(lambda q, k: list(flat.search(q, k)[0]), queries, truth, args.k,
+                                                  flat.memory()["vectors"])
+
+        for quantization in args.quantization:
+            started = time.perf_counter()
+            quantized = EmbeddedIndex.write(Path(tmp) / quantization, vectors, docs, graph="never",
+                                            quantization=quantization)
+            print(f"embedded index with {quantization} codes written in {time.perf_counter() - started:.1f}s")
+            for factor in args.rerank:
+                settings.RETRIEVER_RERANK_FACTOR = factor
+                results[f"embedded, {quantization} (rerank {factor}x)"] = measure(
+                    lambda q, k: list(quantized.search(q, k)[0]), queries, truth, args.k, quantized.memory()["codes"]
+                )
+
+        if args.no_hnsw:
+            pass
+        elif _load_hnswlib() is not None:
+            started = time.perf_counter()
+            graph = EmbeddedIndex.write(Path(tmp) / "hnsw", vectors, docs, graph="always", quantization="none")
+            print(f"embedded index with HNSW graph written in {time.perf_counter() - started:.1f}s")
+            memory = graph.memory()["vectors"] + (Path(tmp) / "hnsw" / GRAPH_FILE).stat().st_size
+            for ef in args.ef:
+                settings.RETRIEVER_HNSW_EF_SEARCH = ef
+                results[f"embedded, HNSW (ef={ef})"] = \
+                    measure(lambda q, k: list(graph.search(q, k)[0]), queries, truth, args.k, memory)
+        else:
+            print("hnswlib is not installed, skipping the HNSW index")
+
+        if args.qdrant:
+            started = time.perf_counter()
+            search, cleanup = qdrant_search(vectors)
+            print(f"qdrant collection loaded in {time.perf_counter() - started:.1f}s")
+            try:
+                results["qdrant"] = measure(search, queries, truth, args.k, None)
+            finally:
+                cleanup()
+
+    print(f"\n{'backend':<34} {'recall@' + str(args.k):>9} {'p50 ms':>8} {'p95 ms':>8} {'mean ms':>8} {'memory MB':>10}")
+    for name, r in results.items():
+        memory = f"{r['memory'] / 2**20:.1f}" if r["memory"] is not None else "-"
+        print(f"{name:<34} {r['recall']:>9.3f} {r['p50']:>8.2f} {r['p95']:>8.2f} {r['mean']:>8.2f} {memory:>10}")
+
+
+if __name__ == "__main__":
+    main()
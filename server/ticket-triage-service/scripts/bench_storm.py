@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""Replays a synthetic incident storm through the classify stage's StormIndex.
+
+Most tickets are paraphrases of a handful of incidents ("VPN is down"), the
+rest are unrelated background tickets. Reports how many LLM calls clustering
+avoids, how clean the clusters are and what it costs per ticket:
+    python scripts/bench_storm.py --tickets 10000 --threshold 0.6
+"""
+import argparse
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from src.triage.llm.storm import StormIndex
+
+INCIDENTS = {
+    "vpn": [
+        "VPN is down", "vpn not connecting", "Cannot connect to the VPN",
+        "VPN connection keeps dropping", "vpn down again", "Unable to connect to VPN from home",
+    ],
+    "email": [
+        "Outlook not receiving emails", "Email is not working", "Cannot send emails from Outlook",
+        "emails stuck in outbox", "Outlook email not syncing",
+    ],
+    "sso": [
+        "Cannot log in with SSO", "SSO login page shows error 500", "Single sign on not working",
+        "SSO login failing for everyone", "unable to log in via SSO portal",
+    ],
+    "ci": [
+        "CI pipeline failing on main", "Build pipeline broken", "Jenkins builds failing",
+        "CI builds stuck in queue", "pipeline failing at deploy step",
+    ],
+    "wifi": [
+        "Office wifi not working", "WiFi keeps disconnecting on floor 3", "No wifi in the office",
+        "wifi very slow today", "cannot connect to office WiFi",
+    ],
+    "phishing": [
+        "Suspicious email asking for password", "Phishing email received", "Got a phishing mail from IT",
+        "Suspicious link in email claiming to be HR",
+    ],
+}
+DETAILS = [
+    "since 9am", "since this morning", "for the last hour", "again", "right now", "after the update",
+    "on my laptop", "for the whole team", "from home", "please help", "urgent", "ASAP",
+]
+GREETINGS = ["", "Hi team, ", "Hello, ", "Hey IT, ", "Good morning, "]
+BACKGROUND_WORDS = (
+    "request new laptop monitor install software license access repository database query slow "
+    "report export feature dashboard printer toner badge account password reset mailbox quota "
+    "calendar invite api timeout migration backup restore certificate expired kubernetes pod "
+    "deploy staging docker image disk space ticket invoice payroll onboarding keyboard mouse"
+).split()
+
+
+def typo(text, rng):
+    if len(text) < 6 or rng.random() > 0.3:
+        return text
+    i = rng.randrange(1, len(text) - 1)
+    return text[:i] + text[i + 1] + text[i] + text[i + 2:]
+
+
+def make_tickets(n, storm_share, rng):
+    tickets = []
+    labels = list(INCIDENTS)
+    for i in range(n):
+        if rng.random() < storm_share:
+            label = rng.choice(labels)
+            title = rng.choice(INCIDENTS[label])
+            body = GREETINGS[rng.randrange(len(GREETINGS))] + typo(title, rng).lower()
+            body += " " + " ".join(rng.sample(DETAILS, rng.randint(0, 2)))
+        else:
+            label = f"bg-{i}"
+            words = rng.sample(BACKGROUND_WORDS, rng.randint(6, 12))
+            title = " ".join(words[:4]).capitalize()
+            body = " ".join(words)
+        tickets.append((f"TKT-{i:06d}", label, f"{title}\n{body}"))
+    return tickets
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tickets", type=int, default=10000)
+    parser.add_argument("--storm-share", type=float, default=0.8, help="fraction of tickets from incidents")
+    parser.add_argument("--duration", type=float, default=1800, help="simulated arrival span in seconds")
+    parser.add_argument("--threshold", type=float, default=0.6)
+    parser.add_argument("--window", type=float, default=900)
+    parser.add_argument("--num-perm", type=int, default=64)
+    parser.add_argument("--bands", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    tickets = make_tickets(args.tickets, args.storm_share, rng)
+    index = StormIndex(args.threshold, args.window, args.num_perm, args.bands)
+
+    label_of = {}
+    latencies = []
+    clean = merged = wrong = background_merged = peak = 0
+    storm_total = sum(not label.startswith("bg-") for _, label, _ in tickets)
+    started = time.perf_counter()
+    for i, (ticket_id, label, text) in enumerate(tickets):
+        now = i * args.duration / len(tickets)
+        t0 = time.perf_counter()
+        leader = index.assign(ticket_id, text, now=now)
+        latencies.append(time.perf_counter() - t0)
+        if leader is None:
+            label_of[ticket_id] = label
+        else:
+            merged += 1
+            if label_of[leader.ticket_id] == label:
+                clean += 1
+            else:
+                wrong += 1
+                background_merged += label.startswith("bg-")
+        peak = max(peak, len(index))
+    elapsed = time.perf_counter() - started
+
+    leaders = index.stats["leaders"]
+    latencies.sort()
+    print(f"Tickets:            {len(tickets)} ({storm_total} from {len(INCIDENTS)} incidents)")
+    print(f"LLM calls:          {leaders} (leaders), {merged} avoided "
+          f"({merged / len(tickets):.1%} of tickets)")
+    print(f"Storm recall:       {clean / storm_total:.1%} of incident tickets joined a matching cluster")
+    print(f"Cluster purity:     {clean / merged:.2%} ({wrong} wrong merges, "
+          f"{background_merged} of them background tickets)" if merged else "Cluster purity:     n/a")
+    print(f"Index size:         peak {peak} leaders, {index.stats['evicted']} evicted "
+          f"(window {args.window:.0f}s)")
+    print(f"Throughput:         {len(tickets) / elapsed:.0f} tickets/s, "
+          f"p50 {statistics.median(latencies) * 1000:.2f} ms, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
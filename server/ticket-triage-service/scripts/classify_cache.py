@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""Inspect or reset the classification cache shared by the classify workers.
+
+    python scripts/classify_cache.py stats
+    python scripts/classify_cache.py invalidate   # after changing prompt rules by hand
+"""
+import argparse
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from src.triage.llm import classifier
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("action", choices=["stats", "invalidate"])
+    args = parser.parse_args()
+
+    if classifier.cache is None:
+        print("Classification cache is disabled (CLASSIFY_CACHE_ENABLED=false)")
+        return
+
+    if args.action == "invalidate":
+        classifier.cache.invalidate()
+        print(f"🧹 Cache invalidated, now on generation {classifier.cache.generation}")
+        return
+
+    stats = classifier.cache.stats()
+    print(f"Prompt/model version: {classifier.cache.version}")
+    print(f"Lookups:          {stats['hits_local'] + stats['hits_redis'] + stats['misses']}")
+    print(f"  local hits:     {stats['hits_local']}")
+    print(f"  redis hits:     {stats['hits_redis']}")
+    print(f"  misses:         {stats['misses']}")
+    print(f"Hit rate:         {stats['hit_rate']:.1%}")
+    print(f"LLM calls made:   {stats['llm_calls']} (avg {stats['avg_llm_seconds']:.2f}s)")
+    print(f"LLM calls saved:  {stats['llm_calls_saved']}")
+    print(f"Time saved:       {stats['time_saved_seconds']:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
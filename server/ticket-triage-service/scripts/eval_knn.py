@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""Offline check of the kNN fast path against stored LLM classifications.
+
+Loads the classifier's training set, holds out the newest --holdout share
+and predicts it from the rest, then prints fast-path rate and agreement
+with the LLM label at several confidence thresholds:
+    python scripts/eval_knn.py --holdout 0.2
+"""
+import argparse
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from src.triage.db.database import get_db
+from src.triage.llm.knn import KnnClassifier, LABELS
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--holdout", type=float, default=0.2)
+    parser.add_argument("--thresholds", default="0.5,0.6,0.7,0.8,0.9")
+    args = parser.parse_args()
+
+    knn = KnnClassifier(get_db())
+    knn.refresh()
+    total = len(knn.labels)
+    split = int(total * (1 - args.holdout))
+    if split < 1 or split == total:
+        print(f"Not enough classifications to evaluate ({total})")
+        return
+
+    train = (knn.vectors[:split], knn.labels[:split], knn.actions[:split])
+    predictions = [
+        (knn.predict_vector(knn.vectors[i], *train), knn.labels[i])
+        for i in range(split, total)
+    ]
+    print(f"Examples: {split} train, {total - split} held out")
+    print(f"{'threshold':>9}  {'fast path':>9}  {'agreement':>9}")
+    for threshold in (float(t) for t in args.thresholds.split(",")):
+        accepted = [(p, label) for p, label in predictions if p.confidence >= threshold]
+        agree = sum(
+            tuple(getattr(p.classification, name) for name in LABELS) == label for p, label in accepted
+        )
+        rate = len(accepted) / len(predictions)
+        agreement = f"{agree / len(accepted):.1%}" if accepted else "n/a"
+        print(f"{threshold:>9.2f}  {rate:>9.1%}  {agreement:>9}")
+
+
+if __name__ == "__main__":
+    main()
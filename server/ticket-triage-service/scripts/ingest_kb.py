@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""Load a directory of knowledge base documents into the retriever index.
+
+Markdown, text and HTML files are split into chunks, embedded in batches
+across a process pool and upserted into RETRIEVER_BACKEND (the embedded
+index or the Qdrant kb_docs collection). A manifest of content hashes
+makes re-runs incremental: only new or changed chunks are embedded and
+chunks of deleted or shortened documents are removed. The BM25 index
+used by RETRIEVER_MODE=hybrid is updated alongside.
+
+    python scripts/ingest_kb.py kb/
+    python scripts/ingest_kb.py kb/ --backend qdrant --workers 4
+    python scripts/ingest_kb.py kb/ --dry-run     # show what would change
+    python scripts/ingest_kb.py kb/ --full        # ignore the manifest
+"""
+import argparse
+import logging
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from src.triage.config import settings
+from src.triage.retriever.ingest import ingest, SINKS
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("root", type=Path, help="directory of KB documents")
+    parser.add_argument("--backend", choices=list(SINKS), default=settings.RETRIEVER_BACKEND)
+    parser.add_argument("--workers", type=int, default=None, help="embedding processes (default: one per core)")
+    parser.add_argument("--full", action="store_true", help="re-embed everything")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    if not args.root.is_dir():
+        parser.error(f"{args.root} is not a directory")
+
+    report = ingest(args.root, args.backend, args.workers, full=args.full, dry_run=args.dry_run)
+    print(f"\n{'Dry run: ' if args.dry_run else ''}{report['documents']} document(s), {report['chunks']} chunk(s)")
+    print(f"  unchanged:  {report['unchanged']}")
+    print(f"  embedded:   {report['embedded']}")
+    print(f"  deleted:    {report['deleted']}")
+    if "indexed" in report:
+        print(f"  in index:   {report['indexed']}")
+    if "keyword_indexed" in report:
+        print(f"  in BM25:    {report['keyword_indexed']}")
+    print(f"Scan {report['scan_seconds']:.1f}s, embedding {report['embed_seconds']:.1f}s "
+          f"({report['chunks_per_second']:.0f} chunks/s), total {report['total_seconds']:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
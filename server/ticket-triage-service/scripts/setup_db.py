@@ -1,22 +1,48 @@
 #!/usr/bin/env python3
+"""Creates the MongoDB indexes.
+
+    python scripts/setup_db.py                      # create indexes
+    python scripts/setup_db.py --dedupe --dry-run   # count duplicates blocking the unique indexes
+    python scripts/setup_db.py --dedupe             # delete them (keeps the oldest), then create indexes
+"""
+import argparse
 import sys
 from pathlib import Path
 
 # Add src to path
 sys.path.append(str(Path(__file__).parent.parent))
 
-from src.triage.db.database import Base, engine
-from src.triage.db.models import Ticket, Classification, EnrichedOutput
+from src.triage.db.database import db
+from src.triage.db.indexes import ensure_indexes, remove_duplicates, INDEXES
+
+def dedupe(dry_run):
+    for collection, keys, options in INDEXES:
+        if not options.get("unique"):
+            continue
+        count = remove_duplicates(db[collection], keys[0][0], dry_run=dry_run)
+        verb = "would be removed" if dry_run else "removed"
+        print(f"🧹 {collection}: {count} duplicate {keys[0][0]} document(s) {verb}")
 
 def setup_database():
-    print("🔧 Creating database tables...")
+    print("🔧 Creating MongoDB indexes...")
     try:
-        Base.metadata.create_all(bind=engine)
+        ensure_indexes()
         print("✅ Database setup complete!")
-        print(f"   Tables created: tickets, classifications, enriched_outputs")
+        for collection, keys, options in INDEXES:
+            print(f"   {collection}.{options['name']}: {keys}")
     except Exception as e:
         print(f"❌ Database setup failed: {e}")
         raise
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dedupe", action="store_true",
+                        help="delete documents with a duplicate ticketId (keeping the oldest) before indexing")
+    parser.add_argument("--dry-run", action="store_true", help="with --dedupe, only count the duplicates")
+    args = parser.parse_args()
+
+    if args.dedupe:
+        dedupe(args.dry_run)
+        if args.dry_run:
+            sys.exit(0)
     setup_database()
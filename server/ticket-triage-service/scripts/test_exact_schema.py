@@ -18,5 +18,5 @@ exact_ticket = {
 }
 
 print("📨 Pushing ticket with exact schema from image...")
-r.rpush("tickets_queue", json.dumps(exact_ticket))
+r.xadd("tickets_stream", {"data": json.dumps(exact_ticket)})
 print("✅ Done! Watch worker terminals...")
@@ -49,7 +49,7 @@ def test_triage_pipeline():
         ticket_data = create_test_ticket()
 
         print("\n--- Sending Ticket to Redis ---")
-        redis_client.rpush("tickets_queue", json.dumps(ticket_data))
+        redis_client.xadd("tickets_stream", {"data": json.dumps(ticket_data)})
         print(f"Successfully sent ticket {ticket_data['ticketId']} to the queue.")
 
         print("\n--- Verifying Worker Processing ---")
@@ -28,7 +28,7 @@ print(f"From: {test_ticket['sender_email']}")
 print("-"*70)
 
 # Push to queue
-r.rpush("tickets_queue", json.dumps(test_ticket))
+r.xadd("tickets_stream", {"data": json.dumps(test_ticket)})
 
 print("✅ Ticket pushed to Redis queue!")
 print("\n👀 Watch your 3 worker terminals for activity:")
@@ -13,7 +13,7 @@
 # settings = Settings()
 
 import os
-from typing import Optional
+from typing import Dict, List, Optional
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -24,6 +24,182 @@ class Settings(BaseSettings):
     VECTOR_DB_URL: Optional[str] = None
     EXPRESS_API_URL: str = "http://localhost:10000/api/ticket"
     EXPRESS_API_TIMEOUT: int = 10
+
+    # Redis Streams job queues (utils/queue.py)
+    QUEUE_STREAM_MAXLEN: int = 100000
+    QUEUE_BLOCK_MS: int = 5000
+    QUEUE_CLAIM_IDLE_MS: int = 60000
+    QUEUE_MAX_DELIVERIES: int = 5
+    QUEUE_MAINTENANCE_INTERVAL: int = 30
+
+    # redis_consumer micro-batching
+    CONSUMER_BATCH_SIZE: int = 50
+    CONSUMER_MAX_LINGER_MS: int = 50
+
+    # Worker runtime: "sync" (one job at a time) or "async" (workers/runtime.py)
+    WORKER_RUNTIME: str = "sync"
+    CLASSIFY_CONCURRENCY: int = 8
+    RAG_CONCURRENCY: int = 8
+    LLM_MAX_CONCURRENCY: int = 4
+    WORKER_DRAIN_TIMEOUT: int = 30
+
+    # Stream RAG replies into the chat: the text so far is pushed to Express at
+    # most every RAG_STREAM_FLUSH_MS while the completion is generated
+    RAG_STREAMING: bool = False
+    RAG_STREAM_FLUSH_MS: int = 250
+
+    # Supervisor (python -m triage.workers): [min, max] processes per stage
+    SUPERVISOR_SCALING: Dict[str, List[int]] = {"consumer": [1, 2], "classify": [1, 8], "rag": [1, 8]}
+    SUPERVISOR_JOBS_PER_PROCESS: int = 20
+    SUPERVISOR_MAX_JOB_AGE: int = 30
+    SUPERVISOR_POLL_INTERVAL: int = 5
+    SUPERVISOR_STAGGER_SECONDS: float = 2.0
+    SUPERVISOR_SCALE_DOWN_COOLDOWN: int = 60
+    SUPERVISOR_REPORT_INTERVAL: int = 30
+
+    # Classifier model cascade: cheapest first, escalating while confidence is
+    # below the model's threshold or its output fails validation
+    CLASSIFIER_MODELS: List[str] = ["llama-3.1-8b-instant", "openai/gpt-oss-120b"]
+    CLASSIFIER_ESCALATION_THRESHOLD: float = 0.7
+    CLASSIFIER_ESCALATION_THRESHOLDS: Dict[str, float] = {}
+    CLASSIFIER_STRUCTURED_OUTPUT_MODELS: List[str] = ["openai/gpt-oss-120b", "openai/gpt-oss-20b"]
+
+    # Shared Groq rate limit (llm/ratelimit.py): [requests/min, tokens/min] per model
+    RATE_LIMIT_ENABLED: bool = True
+    GROQ_RATE_LIMITS: Dict[str, List[int]] = {
+        "openai/gpt-oss-120b": [30, 8000],
+        "llama-3.1-8b-instant": [30, 6000],
+    }
+    GROQ_DEFAULT_RATE_LIMIT: List[int] = [30, 6000]
+    # Share of each bucket that urgent/high, medium and low priority calls must leave untouched
+    RATE_LIMIT_RESERVES: List[float] = [0.0, 0.2, 0.4]
+    RATE_LIMIT_MAX_SLEEP_MS: int = 2000
+    RATE_LIMIT_DEFAULT_BACKOFF: float = 5.0
+
+    # LLM provider (llm/provider.py): "groq", or "mock" to run offline against a
+    # simulated model with LLM_MOCK_LATENCY ("lognormal:median_ms:sigma", "fixed:ms",
+    # "uniform:lo_ms:hi_ms", "normal:mean_ms:std_ms" or "pareto:min_ms:alpha")
+    LLM_PROVIDER: str = "groq"
+    LLM_TIMEOUT: float = 30.0
+    CLASSIFY_LLM_TIMEOUT: float = 15.0
+    RAG_LLM_TIMEOUT: float = 45.0
+    # Hedging: send a backup request once the first is slower than this percentile
+    LLM_HEDGE_ENABLED: bool = False
+    LLM_HEDGE_PERCENTILE: float = 0.95
+    LLM_HEDGE_MIN_SAMPLES: int = 20
+    LLM_HEDGE_MIN_DELAY_MS: int = 250
+    LLM_HEDGE_THREADS: int = 16
+    LLM_LATENCY_WINDOW: int = 200
+    # Circuit breaker per model: open for LLM_BREAKER_COOLDOWN seconds when the error rate spikes
+    LLM_BREAKER_WINDOW: int = 20
+    LLM_BREAKER_MIN_CALLS: int = 10
+    LLM_BREAKER_ERROR_RATE: float = 0.5
+    LLM_BREAKER_COOLDOWN: float = 30.0
+    LLM_MOCK_LATENCY: str = "lognormal:600:0.5"
+    LLM_MOCK_LATENCIES: Dict[str, str] = {}
+    LLM_MOCK_ERROR_RATE: float = 0.0
+    LLM_MOCK_TOKEN_MS: int = 10
+    LLM_MOCK_SEED: Optional[int] = None
+
+    # Prompt building (llm/prompts.py): tiktoken encoding used to count tokens, and
+    # token budgets for a ticket description and for knowledge base context
+    PROMPT_TOKENIZER: str = "o200k_base"
+    PROMPT_STRIP_QUOTED: bool = True
+    PROMPT_DESCRIPTION_TOKENS: int = 800
+    PROMPT_CONTEXT_TOKENS: int = 1500
+
+    # Batched classification: tickets per LLM call (1 = off) and how long the worker waits to fill a batch
+    CLASSIFY_BATCH_SIZE: int = 1
+    CLASSIFY_BATCH_LINGER_MS: int = 200
+
+    # Combined triage (llm/combined.py): classification and first reply from one
+    # call, with retrieval done up front. Replaces batching and the RAG stage for
+    # tickets that reach the LLM; only valid while retrieval ignores the department.
+    COMBINED_TRIAGE: bool = False
+    COMBINED_MODEL: str = "openai/gpt-oss-120b"
+
+    # Sentence embeddings (retriever/encoder.py)
+    EMBEDDING_MODEL: str = "all-MiniLM-L6-v2"
+    EMBEDDING_DEVICE: str = "cpu"
+    EMBEDDING_BATCH_SIZE: int = 64
+    # "torch", or "onnx" to run EMBEDDING_ONNX_FILE (an int8-quantized export shipped
+    # with the model; needs sentence-transformers[onnx]) on CPU, falling back to torch
+    EMBEDDING_BACKEND: str = "torch"
+    EMBEDDING_ONNX_FILE: str = "onnx/model_quint8_avx2.onnx"
+    # Load the model when a worker starts instead of on its first ticket
+    EMBEDDING_WARM_START: bool = False
+    # Single-query encodes (retrieval, kNN): LRU cache entries, and how many
+    # concurrent queries one model call may take
+    EMBEDDING_CACHE_SIZE: int = 4096
+    EMBEDDING_QUERY_BATCH_SIZE: int = 32
+    EMBEDDING_QUERY_LINGER_MS: int = 0
+
+    # Knowledge base retrieval (retriever/rag.py): "qdrant" searches the
+    # RETRIEVER_COLLECTION collection at VECTOR_DB_URL, "embedded" a memory-mapped
+    # index in RETRIEVER_INDEX_PATH that is reloaded when it changes on disk
+    RETRIEVER_BACKEND: str = "embedded"
+    RETRIEVER_COLLECTION: str = "kb_docs"
+    RETRIEVER_INDEX_PATH: str = "data/kb_index"
+    RETRIEVER_RELOAD_SECONDS: int = 60
+    # Embedded index: exhaustive search below this many vectors, an HNSW graph
+    # (needs hnswlib) above it
+    RETRIEVER_HNSW_MIN_VECTORS: int = 50000
+    RETRIEVER_HNSW_M: int = 16
+    RETRIEVER_HNSW_EF_CONSTRUCTION: int = 200
+    RETRIEVER_HNSW_EF_SEARCH: int = 64
+    # Embedded index without a graph: scan "int8" or "binary" codes in memory instead
+    # of the float vectors ("none"), then re-rank RETRIEVER_RERANK_FACTOR x top_k
+    # candidates exactly. Applied when the index is written (scripts/ingest_kb.py --full).
+    RETRIEVER_QUANTIZATION: str = "none"
+    RETRIEVER_RERANK_FACTOR: int = 10
+    # "vector", or "hybrid" to fuse the vector results with BM25 keyword matches
+    # (exact error codes, hostnames, product names) by reciprocal rank fusion.
+    # The BM25 index in RETRIEVER_BM25_PATH is kept up to date by scripts/ingest_kb.py.
+    RETRIEVER_MODE: str = "vector"
+    RETRIEVER_BM25_PATH: str = "data/kb_bm25"
+    RETRIEVER_HYBRID_CANDIDATES: int = 50
+    RETRIEVER_RRF_K: int = 60
+    BM25_K1: float = 1.2
+    BM25_B: float = 0.75
+    BM25_HASH_BITS: int = 22
+    BM25_FLUSH_POSTINGS: int = 500000
+    BM25_MAX_SEGMENTS: int = 8
+
+    # Knowledge base ingestion (retriever/ingest.py, scripts/ingest_kb.py): chunk
+    # size and overlap in PROMPT_TOKENIZER tokens, embedding processes (0 = one per
+    # core) and the manifest of content hashes that makes re-runs incremental
+    KB_CHUNK_TOKENS: int = 200
+    KB_CHUNK_OVERLAP: int = 40
+    KB_EMBED_WORKERS: int = 0
+    KB_EMBED_BATCH: int = 256
+    KB_UPSERT_BATCH: int = 512
+    KB_MANIFEST_PATH: str = "data/kb_manifest.json"
+
+    # Local kNN fast path in front of the LLM (llm/knn.py)
+    KNN_ENABLED: bool = False
+    KNN_K: int = 10
+    KNN_THRESHOLD: float = 0.8
+    KNN_MIN_SIMILARITY: float = 0.6
+    KNN_MIN_EXAMPLES: int = 200
+    KNN_MAX_EXAMPLES: int = 50000
+    KNN_MIN_LABEL_CONFIDENCE: float = 0.6
+    KNN_REFRESH_SECONDS: int = 300
+    KNN_AUDIT_RATE: float = 0.05
+
+    # Classification cache (llm/cache.py)
+    CLASSIFY_CACHE_ENABLED: bool = True
+    CLASSIFY_CACHE_TTL: int = 86400
+    CLASSIFY_CACHE_LRU_SIZE: int = 2048
+    CLASSIFY_CACHE_GENERATION_SECONDS: int = 5  # how soon workers see an invalidate()
+
+    # Near-duplicate storm clustering in the classify stage (llm/storm.py)
+    STORM_ENABLED: bool = False
+    STORM_THRESHOLD: float = 0.6
+    STORM_WINDOW_SECONDS: int = 900
+    STORM_NUM_PERM: int = 64
+    STORM_BANDS: int = 16
+    STORM_MAX_LEADERS: int = 10000
+    STORM_FOLLOWER_WAIT: int = 30
     
     class Config:
         env_file = ".env"
@@ -1,4 +1,4 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, AsyncMongoClient
 from ..config import settings
 
 client = MongoClient(settings.MONGO_URL)
@@ -9,5 +9,14 @@ tickets_collection = db["tickets"]
 classifications_collection = db["classifications"]
 enriched_outputs_collection = db["enriched_outputs"]
 
+# Created on first use so the client binds to the running event loop
+async_client = None
+
 def get_db():
-    return db
\ No newline at end of file
+    return db
+
+def get_async_db():
+    global async_client
+    if async_client is None:
+        async_client = AsyncMongoClient(settings.MONGO_URL)
+    return async_client[settings.MONGO_DB_NAME]
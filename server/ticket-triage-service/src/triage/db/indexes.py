@@ -0,0 +1,61 @@
+import logging
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from .database import db
+
+LOG = logging.getLogger("indexes")
+
+# (collection, keys, options). create_index is a no-op when an identical
+# index already exists, so this can run on every worker start.
+INDEXES = [
+    ("tickets", [("ticketId", ASCENDING)], {"unique": True, "name": "ticketId_unique"}),
+    ("tickets", [("department", ASCENDING), ("priority", ASCENDING), ("_id", DESCENDING)],
+     {"name": "department_priority_recent"}),
+    ("tickets", [("status", ASCENDING), ("_id", DESCENDING)], {"name": "status_recent"}),
+    ("tickets", [("clusterId", ASCENDING)], {"name": "clusterId", "sparse": True}),
+    ("classifications", [("ticketId", ASCENDING)], {"unique": True, "name": "ticketId_unique"}),
+    ("classifications", [("data.department", ASCENDING), ("data.priority", ASCENDING)],
+     {"name": "department_priority"}),
+    ("enriched_outputs", [("ticketId", ASCENDING)], {"unique": True, "name": "ticketId_unique"}),
+]
+
+
+def duplicate_ids(collection, field="ticketId"):
+    """_ids of every document but the oldest per `field`."""
+    pipeline = [
+        {"$group": {"_id": f"${field}", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+    ]
+    extra = []
+    for group in collection.aggregate(pipeline, allowDiskUse=True):
+        extra += sorted(group["ids"])[1:]
+    return extra
+
+
+def remove_duplicates(collection, field="ticketId", dry_run=False):
+    """Keeps the oldest document per `field` so a unique index can be built
+    on data written before duplicate suppression moved into the index. Only
+    run from scripts/setup_db.py --dedupe; returns the number (to be) removed."""
+    extra = duplicate_ids(collection, field)
+    if dry_run or not extra:
+        return len(extra)
+    removed = 0
+    for i in range(0, len(extra), 1000):
+        removed += collection.delete_many({"_id": {"$in": extra[i:i + 1000]}}).deleted_count
+    LOG.warning(f"🧹 Removed {removed} duplicate {field} document(s) from {collection.name}")
+    return removed
+
+
+def ensure_indexes(database=db):
+    for name, keys, options in INDEXES:
+        collection = database[name]
+        try:
+            collection.create_index(keys, **options)
+        except (DuplicateKeyError, OperationFailure) as e:
+            if options.get("unique") and getattr(e, "code", None) == 11000:
+                # Never delete data from a worker start; deduplicate explicitly
+                LOG.error(f"❌ Cannot build unique index {name}.{options['name']}: the collection has duplicate "
+                          f"{keys[0][0]} values. Run scripts/setup_db.py --dedupe --dry-run to count them, "
+                          f"then scripts/setup_db.py --dedupe to keep the oldest of each.")
+            raise
+    LOG.info("✅ MongoDB indexes are in place")
@@ -0,0 +1,153 @@
+import hashlib
+import json
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter, OrderedDict
+from typing import Optional
+
+import redis
+
+from ..config import settings
+from ..schemas.models import ClassificationOutput
+
+STATS_KEY = "classify_cache:stats"
+GENERATION_KEY = "classify_cache:generation"
+STATS_FLUSH_SECONDS = 5
+
+
+def normalize_text(text: Optional[str]) -> str:
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def content_hash(ticket: dict) -> str:
+    source = f"{normalize_text(ticket.get('title'))}\n{normalize_text(ticket.get('description'))}"
+    return hashlib.sha256(source.encode()).hexdigest()
+
+
+class ClassificationCache:
+    """Two-layer cache of ClassificationOutput keyed by the normalized ticket text.
+
+    Layer 1 is an in-process LRU, layer 2 a Redis key with TTL shared by all
+    workers. Keys embed `version` (a hash of prompt, model and schema), so
+    changing any of them starts a fresh keyspace; invalidate() does the same
+    on demand by bumping a shared generation counter, which every worker
+    re-reads at most CLASSIFY_CACHE_GENERATION_SECONDS later.
+    """
+
+    def __init__(self, version: str, max_entries: int = None, ttl: int = None):
+        self.version = version
+        self.max_entries = max_entries or settings.CLASSIFY_CACHE_LRU_SIZE
+        self.ttl = ttl or settings.CLASSIFY_CACHE_TTL
+        self.local = OrderedDict()
+        self.lock = threading.Lock()
+        self.redis = redis.from_url(settings.REDIS_URL)
+        self.generation = None
+        self.generation_checked = 0.0
+        self.pending_stats = Counter()
+        self.last_flush = time.monotonic()
+
+    def _prefix(self) -> str:
+        if time.monotonic() - self.generation_checked >= settings.CLASSIFY_CACHE_GENERATION_SECONDS:
+            try:
+                self._set_generation(int(self.redis.get(GENERATION_KEY) or 0))
+                self.generation_checked = time.monotonic()
+            except redis.exceptions.RedisError:
+                pass
+        return f"classify_cache:{self.version}:{self.generation or 0}:"
+
+    def _set_generation(self, generation: int):
+        # Entries of the old generation can never be hit again, so free them
+        with self.lock:
+            if generation != self.generation:
+                self.local.clear()
+                self.generation = generation
+
+    def _record(self, **counters):
+        # Buffered so a local hit does not cost a Redis round trip
+        with self.lock:
+            self.pending_stats.update(counters)
+            if time.monotonic() - self.last_flush < STATS_FLUSH_SECONDS:
+                return
+        self.flush_stats()
+
+    def flush_stats(self):
+        with self.lock:
+            counters, self.pending_stats = self.pending_stats, Counter()
+            self.last_flush = time.monotonic()
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for name, amount in counters.items():
+                if isinstance(amount, float):
+                    pipe.hincrbyfloat(STATS_KEY, name, amount)
+                else:
+                    pipe.hincrby(STATS_KEY, name, amount)
+            pipe.execute()
+        except redis.exceptions.RedisError:
+            pass
+
+    def get(self, ticket: dict) -> Optional[ClassificationOutput]:
+        key = self._prefix() + content_hash(ticket)
+        with self.lock:
+            hit = self.local.get(key)
+            if hit is not None:
+                self.local.move_to_end(key)
+        if hit is not None:
+            self._record(hits_local=1)
+            return hit.model_copy(deep=True)
+
+        try:
+            raw = self.redis.get(key)
+        except redis.exceptions.RedisError:
+            raw = None
+        if raw is None:
+            self._record(misses=1)
+            return None
+
+        classification = ClassificationOutput(**json.loads(raw))
+        self._remember(key, classification)
+        self._record(hits_redis=1)
+        return classification.model_copy(deep=True)
+
+    def put(self, ticket: dict, classification: ClassificationOutput, llm_seconds: float = 0.0):
+        key = self._prefix() + content_hash(ticket)
+        self._remember(key, classification)
+        try:
+            self.redis.set(key, classification.model_dump_json(), ex=self.ttl)
+        except redis.exceptions.RedisError:
+            pass
+        self._record(llm_calls=1, llm_seconds=float(llm_seconds))
+
+    def _remember(self, key: str, classification: ClassificationOutput):
+        with self.lock:
+            self.local[key] = classification
+            self.local.move_to_end(key)
+            while len(self.local) > self.max_entries:
+                self.local.popitem(last=False)
+
+    def invalidate(self):
+        """Drops every cached classification, in this process and for all workers."""
+        self._set_generation(int(self.redis.incr(GENERATION_KEY)))
+        self.generation_checked = time.monotonic()
+
+    def stats(self) -> dict:
+        """Counters shared by every worker; hits are LLM calls saved, priced at
+        the average latency of the calls that did go to the LLM."""
+        self.flush_stats()
+        raw = {k.decode(): float(v) for k, v in self.redis.hgetall(STATS_KEY).items()}
+        hits = raw.get("hits_local", 0) + raw.get("hits_redis", 0)
+        lookups = hits + raw.get("misses", 0)
+        llm_calls = raw.get("llm_calls", 0)
+        avg_llm = raw.get("llm_seconds", 0) / llm_calls if llm_calls else 0.0
+        return {
+            "hits_local": int(raw.get("hits_local", 0)),
+            "hits_redis": int(raw.get("hits_redis", 0)),
+            "misses": int(raw.get("misses", 0)),
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "llm_calls": int(llm_calls),
+            "llm_calls_saved": int(hits),
+            "avg_llm_seconds": avg_llm,
+            "time_saved_seconds": hits * avg_llm,
+        }
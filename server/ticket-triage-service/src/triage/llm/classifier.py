@@ -1,9 +1,31 @@
-from groq import Groq
+from pydantic import ValidationError
 from ..config import settings
 from ..schemas.models import ClassificationOutput
+from .cache import ClassificationCache, normalize_text
+from .ratelimit import limiter, priority_class
+from .provider import provider
+from .prompts import prepare_ticket, system_message, record_prompt
+from collections import Counter
+from typing import Dict, Optional
+import asyncio
+import hashlib
 import json
+import logging
+import re
+import time
 
-client = Groq(api_key=settings.GROQ_API_KEY)
+LOG = logging.getLogger("classifier")
+
+CLASSIFIER_MODEL = "openai/gpt-oss-120b"
+
+JSON_MODE_INSTRUCTION = (
+    "Respond with one JSON object with exactly these keys: "
+    "department, type, priority, confidence, suggested_actions."
+)
+BATCH_JSON_MODE_INSTRUCTION = (
+    'Respond with one JSON object {"classifications": [...]} holding one object per ticket with '
+    "exactly these keys: ticketId, department, type, priority, confidence, suggested_actions."
+)
 
 CLASSIFICATION_SCHEMA = {
     "type": "object",
@@ -32,20 +54,26 @@ CLASSIFICATION_SCHEMA = {
     "additionalProperties": False
 }
 
-def classify_ticket(ticket: dict) -> ClassificationOutput:
-    
-    prompt = f"""You are an expert IT Service Management classifier for a large technology company.
-
-**Ticket Details:**
-- ID: {ticket.get('ticketId', 'N/A')}
-- Title: {ticket.get('title', 'N/A')}
-- Description: {ticket['description']}
-- Submitted By: {ticket.get('createdBy', 'N/A')}
+BATCH_CLASSIFICATION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "classifications": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {"ticketId": {"type": "string"}, **CLASSIFICATION_SCHEMA["properties"]},
+                "required": ["ticketId", *CLASSIFICATION_SCHEMA["required"]],
+                "additionalProperties": False
+            }
+        }
+    },
+    "required": ["classifications"],
+    "additionalProperties": False
+}
 
-**Task:**
-Analyze this ticket and provide accurate classification with:
+CLASSIFIER_ROLE = "You are an expert ITSM classifier. Provide accurate JSON classifications matching the exact schema required."
 
-1. **department** - Choose ONE from:
+CLASSIFICATION_GUIDE = """1. **department** - Choose ONE from:
    - IT: General IT support, helpdesk, hardware/software issues, user accounts, email, printers, laptops
    - DevOps: CI/CD pipelines, deployments, infrastructure as code, container orchestration, automation
    - Software: Application bugs, feature requests, code issues, API problems, frontend/backend development
@@ -116,42 +144,432 @@ Analyze this ticket and provide accurate classification with:
 - "urgent" keywords: down, critical, production, blocking, emergency, ASAP
 - "high" keywords: broken, not working, affecting multiple users, deadline
 - "medium" keywords: intermittent, slow, occasionally, need help
-- "low" keywords: question, clarification, nice to have, future
+- "low" keywords: question, clarification, nice to have, future"""
+
+CLASSIFICATION_INSTRUCTIONS = f"""You are an expert IT Service Management classifier for a large technology company.
+
+**Task:**
+Analyze each ticket you are given and provide accurate classification with:
+
+{CLASSIFICATION_GUIDE}
 
 Provide accurate, context-aware classification."""
 
+# Everything static lives in the system message so single, batched and
+# combined calls share one cacheable prefix; the user message is the ticket.
+SYSTEM_MESSAGE = system_message(CLASSIFIER_ROLE, CLASSIFICATION_INSTRUCTIONS)
+
+def build_classification_prompt(ticket: dict) -> str:
+    return f"""**Ticket Details:**
+- ID: {ticket.get('ticketId', 'N/A')}
+- Title: {ticket.get('title', 'N/A')}
+- Description: {ticket['description']}
+- Submitted By: {ticket.get('createdBy', 'N/A')}"""
+
+def build_batch_classification_prompt(tickets: list) -> str:
+    blocks = "\n\n".join(
+        f"""### Ticket {ticket['ticketId']}
+- Title: {ticket.get('title', 'N/A')}
+- Description: {ticket['description']}
+- Submitted By: {ticket.get('createdBy', 'N/A')}"""
+        for ticket in tickets
+    )
+    return f"""Classify each of the {len(tickets)} tickets below independently. Return exactly one entry per ticket in `classifications`, copying its ticketId verbatim.
+
+**Tickets:**
+
+{blocks}"""
+
+# Keywords from the prompt's Priority Rules, used to rank calls for rate-limit
+# budget before the model has decided the priority
+URGENT_HINTS = {"down", "outage", "critical", "production", "blocking", "emergency", "asap", "urgent"}
+HIGH_HINTS = {"broken", "deadline", "multiple"}
+
+def priority_hint(ticket: dict) -> str:
+    explicit = ticket.get("priority")
+    if explicit in ("urgent", "high", "low"):
+        return explicit
+    words = set(re.findall(r"[a-z]+", normalize_text(f"{ticket.get('title') or ''} {ticket.get('description') or ''}")))
+    if words & URGENT_HINTS:
+        return "urgent"
+    if words & HIGH_HINTS:
+        return "high"
+    return "medium"
+
+def batch_priority(tickets: list) -> str:
+    return min((priority_hint(ticket) for ticket in tickets), key=priority_class)
+
+def cascade_models() -> list:
+    """Models tried in order, cheapest first; the last one's answer is final."""
+    return settings.CLASSIFIER_MODELS or [CLASSIFIER_MODEL]
+
+def escalation_threshold(model: str) -> float:
+    return settings.CLASSIFIER_ESCALATION_THRESHOLDS.get(model, settings.CLASSIFIER_ESCALATION_THRESHOLD)
+
+def structured_request(model: str, prompt: str, schema_name: str, schema: dict, json_mode_instruction: str,
+                       max_tokens: int, system: dict = SYSTEM_MESSAGE, timeout: float = None) -> dict:
+    # Models without structured outputs get JSON mode; validate_classification
+    # then enforces the schema on our side.
+    if provider.supports_structured_output(model):
+        response_format = {
+            "type": "json_schema",
+            "json_schema": {"name": schema_name, "strict": True, "schema": schema}
+        }
+    else:
+        system = {"role": "system", "content": f"{system['content']} {json_mode_instruction}"}
+        response_format = {"type": "json_object"}
+    return dict(
+        model=model,
+        messages=[system, {"role": "user", "content": prompt}],
+        response_format=response_format,
+        temperature=0.3,
+        max_completion_tokens=max_tokens,
+        timeout=timeout or settings.CLASSIFY_LLM_TIMEOUT
+    )
+
+def classification_request(ticket: dict, model: str = CLASSIFIER_MODEL) -> dict:
+    """Keyword arguments for chat.completions.create, shared by the sync and async paths."""
+    return structured_request(model, build_classification_prompt(ticket), "ticket_classification",
+                              CLASSIFICATION_SCHEMA, JSON_MODE_INSTRUCTION, 512)
+
+def batch_classification_request(tickets: list, model: str = CLASSIFIER_MODEL) -> dict:
+    return structured_request(model, build_batch_classification_prompt(tickets), "ticket_classification_batch",
+                              BATCH_CLASSIFICATION_SCHEMA, BATCH_JSON_MODE_INSTRUCTION, 512 * len(tickets))
+
+def validate_classification(data: dict) -> ClassificationOutput:
+    """ClassificationOutput from a model's JSON, holding it to the required keys
+    and enums of CLASSIFICATION_SCHEMA. Raises ValueError otherwise."""
+    missing = [key for key in CLASSIFICATION_SCHEMA["required"] if key not in data]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+    for key, spec in CLASSIFICATION_SCHEMA["properties"].items():
+        if "enum" in spec and data[key] not in spec["enum"]:
+            raise ValueError(f"{key}={data[key]!r} is not one of {spec['enum']}")
+    return ClassificationOutput(**data)
+
+def parse_batch_response(content: str, tickets: list) -> Dict[str, ClassificationOutput]:
+    """Valid classifications in a batch response by ticketId. Entries for
+    unknown or repeated ticketIds and entries failing validation are dropped."""
+    wanted = {ticket["ticketId"] for ticket in tickets}
+    parsed = {}
+    for item in json.loads(content).get("classifications", []):
+        ticket_id = item.pop("ticketId", None)
+        if ticket_id not in wanted or ticket_id in parsed:
+            continue
+        try:
+            parsed[ticket_id] = validate_classification(item)
+        except ValueError:
+            continue
+    return parsed
+
+def _decide(ticket_id: str, model: str, classification: Optional[ClassificationOutput], error,
+            seconds: float, last: bool) -> bool:
+    """Whether to keep `model`'s answer or escalate to the next model, logged
+    with its latency so thresholds can be tuned."""
+    if error is not None:
+        reason = f"error: {error}"
+    elif classification.confidence < escalation_threshold(model) and not last:
+        reason = f"confidence {classification.confidence:.2f} < {escalation_threshold(model):.2f}"
+    else:
+        reason = None
+
+    usage[f"cascade:{model}:{'accepted' if reason is None else 'escalated'}"] += 1
+    if reason is None:
+        outcome = f"accepted (confidence {classification.confidence:.2f})"
+    else:
+        outcome = f"{'failed' if last else 'escalating'}, {reason}"
+    LOG.info(f"🔀 [{ticket_id}] {model} answered in {seconds * 1000:.0f} ms: {outcome}")
+    return reason is None
+
+def fallback_classification() -> ClassificationOutput:
+    return ClassificationOutput(
+        department="Other",
+        type="support",
+        priority="medium",
+        confidence=0.3,
+        suggested_actions=["Manual review required", "Contact submitter for more details"]
+    )
+
+def classification_version() -> str:
+    """Hash of everything besides the ticket that shapes a classification.
+    Editing the prompt, models, thresholds or schema changes it and so
+    retires old cache entries."""
+    blank = {"ticketId": "", "title": "", "description": "", "createdBy": ""}
+    template = {
+        "requests": [
+            {key: value for key, value in classification_request(blank, model).items() if key != "timeout"}
+            for model in cascade_models()
+        ],
+        "thresholds": [escalation_threshold(model) for model in cascade_models()[:-1]],
+    }
+    return hashlib.sha1(json.dumps(template, sort_keys=True).encode()).hexdigest()[:12]
+
+cache = ClassificationCache(classification_version()) if settings.CLASSIFY_CACHE_ENABLED else None
+
+# Per-process token and latency counters for single vs. batched calls
+usage = Counter()
+
+def record_usage(mode: str, tickets: int, response, seconds: float):
+    usage[f"{mode}_calls"] += 1
+    usage[f"{mode}_tickets"] += tickets
+    usage[f"{mode}_seconds"] += seconds
+    tokens = getattr(response, "usage", None)
+    if tokens is not None:
+        usage[f"{mode}_prompt_tokens"] += tokens.prompt_tokens or 0
+        usage[f"{mode}_completion_tokens"] += tokens.completion_tokens or 0
+        details = getattr(tokens, "prompt_tokens_details", None)
+        usage[f"{mode}_cached_tokens"] += getattr(details, "cached_tokens", None) or 0
+
+def usage_report() -> dict:
+    """Per-ticket prompt/completion tokens and LLM seconds for each mode
+    (single, batch, combined classification + reply), and the relative
+    savings of batching once both single and batch calls have been made."""
+    report = {"batch_fallbacks": usage["batch_fallbacks"]}
+    for mode in ("single", "batch", "combined"):
+        tickets = usage[f"{mode}_tickets"]
+        if not tickets:
+            continue
+        report[mode] = {
+            "calls": usage[f"{mode}_calls"],
+            "tickets": tickets,
+            "prompt_tokens_per_ticket": usage[f"{mode}_prompt_tokens"] / tickets,
+            "completion_tokens_per_ticket": usage[f"{mode}_completion_tokens"] / tickets,
+            "cached_prompt_share": (usage[f"{mode}_cached_tokens"] / usage[f"{mode}_prompt_tokens"]
+                                    if usage[f"{mode}_prompt_tokens"] else 0.0),
+            "seconds_per_ticket": usage[f"{mode}_seconds"] / tickets,
+            "seconds_per_call": usage[f"{mode}_seconds"] / usage[f"{mode}_calls"],
+        }
+    report["cascade"] = {
+        model: {
+            "accepted": usage[f"cascade:{model}:accepted"],
+            "escalated": usage[f"cascade:{model}:escalated"],
+        }
+        for model in cascade_models()
+    }
+    if "single" in report and "batch" in report:
+        single, batch = report["single"], report["batch"]
+        report["savings"] = {
+            metric: 1 - batch[metric] / single[metric]
+            for metric in ("prompt_tokens_per_ticket", "completion_tokens_per_ticket", "seconds_per_ticket")
+            if single[metric]
+        }
+    return report
+
+def format_usage_report(report: dict) -> list:
+    lines = []
+    for mode in ("single", "batch", "combined"):
+        if mode in report:
+            m = report[mode]
+            lines.append(
+                f"{mode}: {m['calls']} call(s), {m['tickets']} ticket(s), "
+                f"{m['prompt_tokens_per_ticket']:.0f} prompt + {m['completion_tokens_per_ticket']:.0f} "
+                f"completion tokens/ticket ({m['cached_prompt_share']:.0%} of prompt tokens cached), "
+                f"{m['seconds_per_ticket']:.2f}s/ticket, {m['seconds_per_call']:.2f}s/call"
+            )
+    if "savings" in report:
+        lines.append("batching saves " + ", ".join(
+            f"{value:.0%} {metric.replace('_', ' ')}" for metric, value in report["savings"].items()
+        ))
+    if any(counts["accepted"] or counts["escalated"] for counts in report.get("cascade", {}).values()):
+        lines.append("cascade: " + "; ".join(
+            f"{model} accepted {counts['accepted']}, escalated {counts['escalated']}"
+            for model, counts in report["cascade"].items()
+        ))
+    if report.get("batch_fallbacks"):
+        lines.append(f"{report['batch_fallbacks']} ticket(s) missing from batch responses were retried singly")
+    return lines
+
+# The classification flows below are written once for the sync and async
+# workers, as generators that yield each blocking step instead of running it:
+#   ("llm", request, priority)  a chat completion through the rate limiter
+#   ("call", fn, *args)         any other blocking call (the Redis cache)
+#   ("all", flows)              several flows, concurrently on the event loop
+# _run performs the steps with blocking calls and _arun on the event loop,
+# sending each result back into the flow or throwing its exception into it.
+
+def _run(flow):
+    result, error = None, None
+    while True:
+        try:
+            step = flow.send(result) if error is None else flow.throw(error)
+        except StopIteration as done:
+            return done.value
+        result, error = None, None
+        try:
+            if step[0] == "llm":
+                result = limiter.call(provider.complete, step[1], step[2])
+            elif step[0] == "all":
+                result = [_run(f) for f in step[1]]
+            else:
+                result = step[1](*step[2:])
+        except Exception as e:
+            error = e
+
+async def _arun(flow):
+    result, error = None, None
+    while True:
+        try:
+            step = flow.send(result) if error is None else flow.throw(error)
+        except StopIteration as done:
+            return done.value
+        result, error = None, None
+        try:
+            if step[0] == "llm":
+                result = await limiter.acall(provider.acomplete, step[1], step[2])
+            elif step[0] == "all":
+                result = await asyncio.gather(*(_arun(f) for f in step[1]))
+            else:
+                result = await asyncio.to_thread(step[1], *step[2:])
+        except Exception as e:
+            error = e
+
+def _more_confident(best: Optional[ClassificationOutput], classification: Optional[ClassificationOutput]):
+    if classification is not None and (best is None or classification.confidence > best.confidence):
+        return classification
+    return best
+
+def _cascade(ticket: dict, start: int = 0, best: ClassificationOutput = None):
+    """Walks the model cascade from position `start` until a model returns
+    valid output at or above its escalation threshold. If the last model
+    fails, the most confident valid earlier answer (or `best`, one carried
+    over from a batch) is used. Returns (classification, seconds)."""
+    models = cascade_models()
+    total, error = 0.0, None
+    for position in range(start, len(models)):
+        model = models[position]
+        classification, error = None, None
+        started = time.perf_counter()
+        try:
+            request = classification_request(ticket, model)
+            record_prompt("classification", request, ticket.get("ticketId"))
+            response = yield "llm", request, priority_hint(ticket)
+            record_usage("single", 1, response, time.perf_counter() - started)
+            classification = validate_classification(json.loads(response.choices[0].message.content))
+        except Exception as e:
+            error = e
+        seconds = time.perf_counter() - started
+        total += seconds
+        if _decide(ticket.get("ticketId"), model, classification, error, seconds, position == len(models) - 1):
+            return classification, total
+        best = _more_confident(best, classification)
+    if best is not None:
+        return best, total
+    raise error
+
+def _settle_batch(model: str, tickets: list, parsed: dict, error, seconds: float, last: bool,
+                  settled: dict, best: dict) -> list:
+    """Moves accepted answers into `settled` and keeps the most confident
+    rejected one per ticket in `best`; returns the tickets to escalate."""
+    remaining = []
+    for ticket in tickets:
+        ticket_id = ticket["ticketId"]
+        classification = parsed.get(ticket_id)
+        reason = error if error is not None else (None if classification else "missing or invalid in batch response")
+        if _decide(ticket_id, model, classification, reason, seconds / len(tickets), last):
+            settled[ticket_id] = classification
+        else:
+            best[ticket_id] = _more_confident(best.get(ticket_id), classification)
+            remaining.append(ticket)
+    return remaining
+
+def _uncached(ticket: dict, start: int = 0, best: ClassificationOutput = None):
     try:
-        response = client.chat.completions.create(
-            model="openai/gpt-oss-120b",
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are an expert ITSM classifier. Provide accurate JSON classifications matching the exact schema required."
-                },
-                {"role": "user", "content": prompt}
-            ],
-            response_format={
-                "type": "json_schema",
-                "json_schema": {
-                    "name": "ticket_classification",
-                    "strict": True,
-                    "schema": CLASSIFICATION_SCHEMA
-                }
-            },
-            temperature=0.3,
-            max_completion_tokens=512
-        )
-        
-        data = json.loads(response.choices[0].message.content)
-        return ClassificationOutput(**data)
-        
+        classification, seconds = yield from _cascade(ticket, start, best)
+        # Fallbacks are never cached, so a transient API error is retried next time
+        if cache:
+            yield "call", cache.put, ticket, classification, seconds
+        return classification
+
     except Exception as e:
-        print(f"❌ Classification error: {e}")
-        # Fallback classification
-        return ClassificationOutput(
-            department="Other",
-            type="support",
-            priority="medium",
-            confidence=0.3,
-            suggested_actions=["Manual review required", "Contact submitter for more details"]
-        )
+        LOG.error(f"❌ Classification error: {e}")
+        return fallback_classification()
+
+def _classify(ticket: dict):
+    ticket = prepare_ticket(ticket)
+    if cache:
+        cached = yield "call", cache.get, ticket
+        if cached:
+            return cached
+    return (yield from _uncached(ticket))
+
+def _classify_uncached(ticket: dict) -> ClassificationOutput:
+    return _run(_uncached(ticket))
+
+async def _aclassify_uncached(ticket: dict) -> ClassificationOutput:
+    return await _arun(_uncached(ticket))
+
+def classify_ticket(ticket: dict) -> ClassificationOutput:
+    return _run(_classify(ticket))
+
+async def aclassify_ticket(ticket: dict) -> ClassificationOutput:
+    return await _arun(_classify(ticket))
+
+def _batches(tickets: list):
+    size = max(1, settings.CLASSIFY_BATCH_SIZE)
+    for i in range(0, len(tickets), size):
+        yield tickets[i:i + size]
+
+def _batch_cascade(chunk: list):
+    """The model cascade for several tickets at once: each model gets one call
+    for the tickets still unsettled. Returns (settled, best, seconds)."""
+    settled, best, remaining, total = {}, {}, chunk, 0.0
+    models = cascade_models()
+    for position, model in enumerate(models):
+        if not remaining:
+            break
+        parsed, error = {}, None
+        started = time.perf_counter()
+        try:
+            request = batch_classification_request(remaining, model)
+            record_prompt("batch", request, f"{len(remaining)} tickets")
+            response = yield "llm", request, batch_priority(remaining)
+            record_usage("batch", len(remaining), response, time.perf_counter() - started)
+            parsed = parse_batch_response(response.choices[0].message.content, remaining)
+        except Exception as e:
+            LOG.error(f"❌ Batch classification error: {e}")
+            error = e
+        seconds = time.perf_counter() - started
+        total += seconds
+        remaining = _settle_batch(model, remaining, parsed, error, seconds, position == len(models) - 1,
+                                  settled, best)
+    return settled, best, total
+
+def _classify_batch(tickets: list):
+    tickets = [prepare_ticket(ticket) for ticket in tickets]
+    results = {}
+    pending = []
+    for ticket in tickets:
+        cached = (yield "call", cache.get, ticket) if cache else None
+        if cached:
+            results[ticket["ticketId"]] = cached
+        else:
+            pending.append(ticket)
+
+    for chunk in _batches(pending):
+        if len(chunk) == 1:
+            results[chunk[0]["ticketId"]] = yield from _uncached(chunk[0])
+            continue
+        settled, best, total = yield from _batch_cascade(chunk)
+
+        # Tickets still unsettled went through every model in the batch, so
+        # their single retry starts at the last one rather than the cheapest
+        remaining = [ticket for ticket in chunk if ticket["ticketId"] not in settled]
+        usage["batch_fallbacks"] += len(remaining)
+        last = len(cascade_models()) - 1
+        retried = yield "all", [_uncached(ticket, last, best.get(ticket["ticketId"])) for ticket in remaining]
+        results.update(zip((ticket["ticketId"] for ticket in remaining), retried))
+        for ticket in chunk:
+            if ticket["ticketId"] in settled:
+                results[ticket["ticketId"]] = settled[ticket["ticketId"]]
+                if cache:
+                    yield "call", cache.put, ticket, settled[ticket["ticketId"]], total / len(chunk)
+    return results
+
+def classify_batch(tickets: list) -> Dict[str, ClassificationOutput]:
+    """Classifies several tickets with one chat completion per
+    CLASSIFY_BATCH_SIZE of them. Tickets the response leaves out (or gets
+    wrong) fall back to a single call at the last model. Returns {ticketId: classification}."""
+    return _run(_classify_batch(tickets))
+
+async def aclassify_batch(tickets: list) -> Dict[str, ClassificationOutput]:
+    return await _arun(_classify_batch(tickets))
@@ -0,0 +1,113 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Optional, Tuple
+
+from ..config import settings
+from ..schemas.models import ClassificationOutput
+from .classifier import (
+    cache, CLASSIFICATION_SCHEMA, CLASSIFIER_ROLE, CLASSIFICATION_INSTRUCTIONS,
+    build_classification_prompt, structured_request, validate_classification, priority_hint, record_usage
+)
+from .provider import provider
+from .ratelimit import limiter
+from .prompts import prepare_ticket, system_message, record_prompt
+from .reply import REPLY_ROLE, REPLY_INSTRUCTIONS, build_rag_context
+
+LOG = logging.getLogger("combined")
+
+COMBINED_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "classification": CLASSIFICATION_SCHEMA,
+        "assistant_reply": {"type": "string"}
+    },
+    "required": ["classification", "assistant_reply"],
+    "additionalProperties": False
+}
+
+COMBINED_JSON_MODE_INSTRUCTION = (
+    'Respond with one JSON object {"classification": {...}, "assistant_reply": "..."} where classification '
+    "has exactly the keys department, type, priority, confidence, suggested_actions."
+)
+
+# Starts with the classifier's system prompt, so both share a cached prefix
+COMBINED_SYSTEM_MESSAGE = system_message(
+    CLASSIFIER_ROLE,
+    CLASSIFICATION_INSTRUCTIONS,
+    REPLY_ROLE,
+    "**Assistant Reply:**\nAlso write `assistant_reply`, the first message the submitter sees in the ticket "
+    "chat, using the knowledge base context given with the ticket.",
+    REPLY_INSTRUCTIONS
+)
+
+
+def build_combined_prompt(ticket: dict, context: str) -> str:
+    return f"""{build_classification_prompt(ticket)}
+
+Context from knowledge base:
+{context}"""
+
+
+def combined_request(ticket: dict, docs: list) -> dict:
+    return structured_request(
+        settings.COMBINED_MODEL,
+        build_combined_prompt(ticket, build_rag_context(docs)),
+        "ticket_triage",
+        COMBINED_SCHEMA,
+        COMBINED_JSON_MODE_INSTRUCTION,
+        512 + 500,
+        system=COMBINED_SYSTEM_MESSAGE,
+        timeout=settings.RAG_LLM_TIMEOUT
+    )
+
+
+def parse_combined_response(content: str) -> Tuple[ClassificationOutput, str]:
+    data = json.loads(content)
+    classification = validate_classification(data["classification"])
+    reply = (data.get("assistant_reply") or "").strip()
+    if not reply:
+        raise ValueError("empty assistant_reply")
+    return classification, reply
+
+
+def classify_and_reply(ticket: dict, docs: list) -> Optional[Tuple[ClassificationOutput, str]]:
+    """Classification and first reply from a single completion, with the
+    retrieved `docs` in the prompt. None if the call or its output fails,
+    so the caller can fall back to classify_ticket() and the RAG stage.
+    Does not consult the classification cache; callers check it before
+    paying for retrieval."""
+    ticket = prepare_ticket(ticket)
+    request = combined_request(ticket, docs)
+    record_prompt("combined", request, ticket.get("ticketId"))
+    started = time.perf_counter()
+    try:
+        response = limiter.call(provider.complete, request, priority_hint(ticket))
+        classification, reply = parse_combined_response(response.choices[0].message.content)
+    except Exception as e:
+        LOG.error(f"❌ Combined triage failed for {ticket.get('ticketId')}: {e}")
+        return None
+    seconds = time.perf_counter() - started
+    record_usage("combined", 1, response, seconds)
+    if cache:
+        cache.put(ticket, classification, seconds)
+    return classification, reply
+
+
+async def aclassify_and_reply(ticket: dict, docs: list) -> Optional[Tuple[ClassificationOutput, str]]:
+    ticket = prepare_ticket(ticket)
+    request = combined_request(ticket, docs)
+    record_prompt("combined", request, ticket.get("ticketId"))
+    started = time.perf_counter()
+    try:
+        response = await limiter.acall(provider.acomplete, request, priority_hint(ticket))
+        classification, reply = parse_combined_response(response.choices[0].message.content)
+    except Exception as e:
+        LOG.error(f"❌ Combined triage failed for {ticket.get('ticketId')}: {e}")
+        return None
+    seconds = time.perf_counter() - started
+    record_usage("combined", 1, response, seconds)
+    if cache:
+        await asyncio.to_thread(cache.put, ticket, classification, seconds)
+    return classification, reply
@@ -0,0 +1,209 @@
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import List, Optional
+
+import numpy as np
+
+from ..config import settings
+from .prompts import clean_description
+from ..retriever.encoder import encode, encode_query
+from ..schemas.models import ClassificationOutput
+
+LOG = logging.getLogger("knn")
+
+LABELS = ("department", "type", "priority")
+
+
+def ticket_text(ticket: dict) -> str:
+    """The text embedded for a ticket, with the description prepared the way
+    prepare_ticket() does for the classifiers, so stored examples and
+    queries are encoded from the same kind of input."""
+    description = ticket.get("description") or ""
+    if "rawDescriptionTokens" not in ticket:  # not prepared yet
+        description = clean_description(description)
+    return f"{ticket.get('title') or ''}\n{description}"
+
+
+@dataclass
+class Prediction:
+    classification: ClassificationOutput
+    confidence: float
+    top_similarity: float
+    audit: bool = False
+
+
+class KnnClassifier:
+    """Classifies a ticket by a similarity-weighted vote of the K most similar
+    tickets the LLM has already classified.
+
+    The confidence is the smallest vote share among department, type and
+    priority; predictions at or above `threshold` skip the LLM. start()
+    loads the example set when the worker starts and a background thread
+    then adds new db.classifications every `refresh_seconds`, leaving out
+    its own predictions, labels inherited through storm clusters and
+    low-confidence LLM answers. predict() never touches Mongo.
+    """
+
+    def __init__(self, database, k: int = None, threshold: float = None,
+                 max_examples: int = None, refresh_seconds: int = None):
+        self.db = database
+        self.k = k or settings.KNN_K
+        self.threshold = threshold or settings.KNN_THRESHOLD
+        self.max_examples = max_examples or settings.KNN_MAX_EXAMPLES
+        self.refresh_seconds = refresh_seconds or settings.KNN_REFRESH_SECONDS
+        self.vectors = None
+        self.labels: List[tuple] = []
+        self.actions: List[list] = []
+        self.last_id = None
+        self.last_refresh = 0.0
+        self.lock = threading.Lock()
+        self.thread = None
+        self.counters = Counter()
+
+    # --- training ---
+
+    def _training_filter(self) -> dict:
+        query = {
+            "source": {"$ne": "knn"},
+            "clusterId": {"$exists": False},
+            "data.confidence": {"$gte": settings.KNN_MIN_LABEL_CONFIDENCE},
+        }
+        if self.last_id is not None:
+            query["_id"] = {"$gt": self.last_id}
+        return query
+
+    def refresh(self) -> int:
+        """Adds classifications stored since the last refresh. Returns how many."""
+        self.last_refresh = time.monotonic()
+        cursor = self.db.classifications.find(self._training_filter(), {"ticketId": 1, "data": 1})
+        if self.last_id is None:
+            # Cold start: newest examples first, up to the cap
+            docs = list(cursor.sort("_id", -1).limit(self.max_examples))[::-1]
+        else:
+            docs = list(cursor.sort("_id", 1).limit(self.max_examples))
+        if not docs:
+            return 0
+        newest_id = docs[-1]["_id"]
+
+        tickets = {}
+        ids = [doc["ticketId"] for doc in docs]
+        for i in range(0, len(ids), 1000):
+            for ticket in self.db.tickets.find({"ticketId": {"$in": ids[i:i + 1000]}},
+                                               {"ticketId": 1, "title": 1, "description": 1}):
+                tickets[ticket["ticketId"]] = ticket
+        docs = [doc for doc in docs if doc["ticketId"] in tickets]
+        if not docs:
+            self.last_id = newest_id
+            return 0
+
+        vectors = encode([ticket_text(tickets[doc["ticketId"]]) for doc in docs])
+        with self.lock:
+            self.vectors = vectors if self.vectors is None else np.vstack([self.vectors, vectors])
+            self.labels += [tuple(doc["data"][label] for label in LABELS) for doc in docs]
+            self.actions += [doc["data"].get("suggested_actions", []) for doc in docs]
+            overflow = len(self.labels) - self.max_examples
+            if overflow > 0:
+                self.vectors = self.vectors[overflow:]
+                self.labels = self.labels[overflow:]
+                self.actions = self.actions[overflow:]
+            self.last_id = newest_id
+        LOG.info(f"🧠 kNN classifier learned {len(docs)} example(s), {len(self.labels)} in memory")
+        return len(docs)
+
+    def _refresh_safely(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            LOG.error(f"❌ kNN refresh failed: {e}")
+
+    def _refresh_loop(self):
+        while True:
+            time.sleep(max(0.0, self.last_refresh + self.refresh_seconds - time.monotonic()))
+            self._refresh_safely()
+
+    def start(self):
+        """Loads the example set (up to max_examples reads and encodes) and
+        starts the background refresh. Called once at worker start."""
+        if self.thread is not None:
+            return
+        self._refresh_safely()
+        self.thread = threading.Thread(target=self._refresh_loop, name="knn-refresh", daemon=True)
+        self.thread.start()
+
+    # --- inference ---
+
+    def predict(self, ticket: dict) -> Optional[Prediction]:
+        """None until KNN_MIN_EXAMPLES examples are loaded."""
+        with self.lock:
+            if self.vectors is None or len(self.labels) < settings.KNN_MIN_EXAMPLES:
+                return None
+            vectors, labels, actions = self.vectors, self.labels, self.actions
+
+        return self.predict_vector(encode_query(ticket_text(ticket)), vectors, labels, actions)
+
+    def predict_vector(self, query: np.ndarray, vectors: np.ndarray, labels: list, actions: list) -> Prediction:
+        scores = vectors @ query
+        k = min(self.k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        winners, shares = [], []
+        for position in range(len(LABELS)):
+            votes = Counter()
+            for i in top:
+                votes[labels[i][position]] += max(float(scores[i]), 0.0)
+            total = sum(votes.values())
+            label, weight = votes.most_common(1)[0]
+            winners.append(label)
+            shares.append(weight / total if total else 0.0)
+
+        top_similarity = float(scores[top[0]])
+        confidence = min(shares) if top_similarity >= settings.KNN_MIN_SIMILARITY else 0.0
+        nearest = next((i for i in top if list(labels[i]) == winners), top[0])
+        classification = ClassificationOutput(
+            department=winners[0],
+            type=winners[1],
+            priority=winners[2],
+            confidence=round(confidence, 3),
+            suggested_actions=list(actions[nearest]),
+        )
+        return Prediction(classification, confidence, top_similarity)
+
+    def accept(self, prediction: Optional[Prediction]) -> bool:
+        """Whether to use the prediction instead of calling the LLM. A
+        KNN_AUDIT_RATE sample of confident predictions is sent to the LLM
+        anyway so agreement is also measured where the fast path is taken."""
+        self.counters["lookups"] += 1
+        if prediction is None or prediction.confidence < self.threshold:
+            return False
+        if random.random() < settings.KNN_AUDIT_RATE:
+            prediction.audit = True
+            return False
+        self.counters["fast_path"] += 1
+        return True
+
+    def record_llm(self, prediction: Optional[Prediction], classification: ClassificationOutput):
+        """Compares a prediction that was not used with the LLM's answer."""
+        if prediction is None:
+            return
+        kind = "audit" if prediction.audit else "shadow"
+        agree = all(getattr(prediction.classification, label) == getattr(classification, label)
+                    for label in LABELS)
+        self.counters[f"{kind}_total"] += 1
+        self.counters[f"{kind}_agree"] += agree
+
+    def stats(self) -> dict:
+        c = self.counters
+        return {
+            "examples": len(self.labels),
+            "lookups": c["lookups"],
+            "fast_path": c["fast_path"],
+            "fast_path_rate": c["fast_path"] / c["lookups"] if c["lookups"] else 0.0,
+            "audit_agreement": c["audit_agree"] / c["audit_total"] if c["audit_total"] else None,
+            "shadow_agreement": c["shadow_agree"] / c["shadow_total"] if c["shadow_total"] else None,
+            "audited": c["audit_total"],
+        }
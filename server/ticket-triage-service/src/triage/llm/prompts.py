@@ -0,0 +1,229 @@
+import hashlib
+import logging
+import re
+import threading
+from collections import Counter
+
+from ..config import settings
+
+LOG = logging.getLogger("prompts")
+
+# Per-process prompt sizes by kind ("classification", "batch", "combined", "rag")
+# and how much trimming descriptions saved
+stats = Counter()
+
+# Lines that start a quoted reply or forwarded message in common mail clients
+QUOTE_HEADERS = [
+    re.compile(r"^\s*On .{0,300}wrote:\s*$", re.IGNORECASE | re.DOTALL),
+    re.compile(r"^\s*-{2,}\s*(Original|Forwarded) Message\s*-{2,}", re.IGNORECASE),
+    re.compile(r"^\s*Begin forwarded message:", re.IGNORECASE),
+    re.compile(r"^\s*_{10,}\s*$"),
+    re.compile(r"^\s*From:\s.+\n\s*(Sent|Date):\s.+", re.IGNORECASE),
+]
+
+# Lines that start a signature; closings only count near the end of the text
+SIGNATURE_MARKERS = [
+    re.compile(r"^--\s*$"),
+    re.compile(r"^\s*Sent from my \w+", re.IGNORECASE),
+    re.compile(r"^\s*Get Outlook for ", re.IGNORECASE),
+]
+CLOSINGS = re.compile(
+    r"^\s*((best|kind|warm|many)?\s*regards|thanks( (and|&) regards)?|thank you|cheers|sincerely|br)\s*[,.!]?\s*$",
+    re.IGNORECASE
+)
+SIGNATURE_TAIL_LINES = 12
+
+# A reply shorter than this is just a cover note ("see below"); the quoted
+# message it forwards is kept instead.
+MIN_OWN_TEXT = 80
+
+
+def _quote_start(lines: list, start: int = 0):
+    for i in range(start, len(lines)):
+        pair = "\n".join(lines[i:i + 2])
+        if any(header.match(lines[i]) or header.match(pair) for header in QUOTE_HEADERS):
+            return i
+    return None
+
+
+def _signature_start(lines: list):
+    content = [i for i, line in enumerate(lines) if line.strip()]
+    for i in content[1:]:
+        if any(marker.match(lines[i]) for marker in SIGNATURE_MARKERS):
+            return i
+    for i in content[1:][-SIGNATURE_TAIL_LINES:]:
+        if CLOSINGS.match(lines[i]):
+            return i
+    return None
+
+
+def strip_quoted_text(text: str) -> str:
+    """Removes "> " quoted lines, quoted replies and forwarded headers, and
+    the trailing signature, from an email-style description."""
+    lines = [line for line in text.replace("\r\n", "\n").split("\n") if not line.lstrip().startswith(">")]
+
+    kept, start, first = [], 0, True
+    while True:
+        end = _quote_start(lines, start if first else start + 1)
+        segment = lines[start:end]
+        if not first:
+            # Drop the header block of a quoted message we decided to keep
+            while segment and (any(h.match(segment[0]) for h in QUOTE_HEADERS)
+                               or re.match(r"^\s*(From|Sent|Date|To|Cc|Subject):", segment[0], re.IGNORECASE)):
+                segment = segment[1:]
+        kept += segment
+        if end is None or len(" ".join(kept).strip()) >= MIN_OWN_TEXT:
+            break
+        start, first = end, False
+
+    signature = _signature_start(kept)
+    if signature is not None:
+        kept = kept[:signature]
+    cleaned = re.sub(r"\n{3,}", "\n\n", "\n".join(kept)).strip()
+    return cleaned or text.strip()
+
+
+# --- token budget ---
+
+_encoding = None
+_lock = threading.Lock()
+
+
+def _get_encoding():
+    """tiktoken encoding, or None to estimate 4 characters per token when
+    tiktoken is missing or its vocabulary cannot be loaded."""
+    global _encoding
+    if _encoding is None:
+        with _lock:
+            if _encoding is None:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding(settings.PROMPT_TOKENIZER)
+                except Exception as e:
+                    LOG.warning(f"⚠️ Tokenizer unavailable ({e}), estimating tokens as characters / 4")
+                    _encoding = False
+    return _encoding or None
+
+
+def count_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, budget: int) -> str:
+    """Keeps the first three quarters and the last quarter of `budget`
+    tokens, marking what was cut. Error details often sit at the end."""
+    total = count_tokens(text)
+    if total <= budget:
+        return text
+    head, tail = int(budget * 0.75), budget - int(budget * 0.75)
+    encoding = _get_encoding()
+    if encoding is None:
+        start, end = text[:head * 4], text[len(text) - tail * 4:] if tail else ""
+    else:
+        tokens = encoding.encode(text, disallowed_special=())
+        start, end = encoding.decode(tokens[:head]), encoding.decode(tokens[total - tail:]) if tail else ""
+    return f"{start.rstrip()}\n[... {total - head - tail} tokens omitted ...]\n{end.lstrip()}".rstrip()
+
+
+def clean_description(text: str, budget: int = None) -> str:
+    if settings.PROMPT_STRIP_QUOTED:
+        text = strip_quoted_text(text)
+    return truncate_tokens(text, budget or settings.PROMPT_DESCRIPTION_TOKENS)
+
+
+def prepare_ticket(ticket: dict) -> dict:
+    """Copy of a classifier input with its description stripped of quoted
+    mail and signatures and cut to PROMPT_DESCRIPTION_TOKENS. Already
+    prepared tickets are returned as they are."""
+    if "rawDescriptionTokens" in ticket:
+        return ticket
+    description = ticket.get("description") or ""
+    cleaned = clean_description(description)
+    raw_tokens = count_tokens(description)
+    if cleaned != description:
+        kept = count_tokens(cleaned)
+        stats["trimmed_descriptions"] += 1
+        stats["trimmed_tokens"] += max(raw_tokens - kept, 0)
+        LOG.info(f"✂️ [{ticket.get('ticketId')}] Description cut from {raw_tokens} to {kept} tokens")
+    return {**ticket, "description": cleaned, "rawDescriptionTokens": raw_tokens}
+
+
+def build_context(docs: list, budget: int = None) -> str:
+    """Knowledge base passages in retrieval order within `budget` tokens."""
+    budget = budget or settings.PROMPT_CONTEXT_TOKENS
+    parts, used = [], 0
+    for doc in docs or []:
+        passage = f"[{doc['doc_id']}] {doc['text']}"
+        remaining = budget - used
+        if remaining <= 0:
+            break
+        passage = truncate_tokens(passage, remaining)
+        parts.append(passage)
+        used += count_tokens(passage)
+    return "\n\n".join(parts) if parts else "No specific documentation found."
+
+
+# --- messages and token accounting ---
+
+def system_message(*sections: str) -> dict:
+    """System message from static sections only. Nothing per-ticket may go
+    here: an unchanged prefix lets the provider reuse its prompt cache."""
+    return {"role": "system", "content": "\n\n".join(section.strip() for section in sections if section)}
+
+
+_system_tokens = {}
+
+
+def _system_count(content: str) -> int:
+    key = hashlib.sha1(content.encode()).hexdigest()
+    if key not in _system_tokens:
+        _system_tokens[key] = count_tokens(content)
+    return _system_tokens[key]
+
+
+def record_prompt(kind: str, request: dict, label=None) -> dict:
+    """Counts the system and user tokens of a chat request and logs them."""
+    counts = Counter()
+    for message in request.get("messages", []):
+        content = message.get("content") or ""
+        if message["role"] == "system":
+            counts["system"] += _system_count(content)
+        else:
+            counts["user"] += count_tokens(content)
+    stats[f"{kind}_prompts"] += 1
+    stats[f"{kind}_system_tokens"] += counts["system"]
+    stats[f"{kind}_user_tokens"] += counts["user"]
+    LOG.info(f"🧾 [{label}] {kind} prompt for {request.get('model')}: "
+              f"{counts['system']} system + {counts['user']} user tokens")
+    return dict(counts)
+
+
+def prompt_report() -> dict:
+    report = {
+        "trimmed_descriptions": stats["trimmed_descriptions"],
+        "trimmed_tokens": stats["trimmed_tokens"],
+    }
+    for kind in ("classification", "batch", "combined", "rag"):
+        prompts = stats[f"{kind}_prompts"]
+        if prompts:
+            report[kind] = {
+                "prompts": prompts,
+                "system_tokens": stats[f"{kind}_system_tokens"] / prompts,
+                "user_tokens": stats[f"{kind}_user_tokens"] / prompts,
+            }
+    return report
+
+
+def format_prompt_report(report: dict) -> list:
+    lines = [
+        f"{kind} prompts: {report[kind]['prompts']}, avg {report[kind]['system_tokens']:.0f} system "
+        f"(cacheable) + {report[kind]['user_tokens']:.0f} user tokens"
+        for kind in ("classification", "batch", "combined", "rag") if kind in report
+    ]
+    if report["trimmed_descriptions"]:
+        lines.append(f"{report['trimmed_descriptions']} description(s) trimmed, "
+                     f"{report['trimmed_tokens']} tokens removed")
+    return lines
@@ -0,0 +1,502 @@
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import random
+import re
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from types import SimpleNamespace
+
+from groq import Groq, AsyncGroq, APIConnectionError, APIStatusError, APITimeoutError, RateLimitError
+
+from ..config import settings
+from .ratelimit import limiter
+
+LOG = logging.getLogger("provider")
+
+
+class ProviderError(Exception):
+    pass
+
+
+# A call that ran out of time, from the mock (builtin) or the Groq SDK
+TIMEOUT_ERRORS = (TimeoutError, APITimeoutError)
+
+
+def retryable(error: BaseException) -> bool:
+    """Whether another attempt could succeed: timeouts, connection errors and
+    5xx. Other 4xx answers would fail the same way again; 429s are left to
+    the rate limiter."""
+    if isinstance(error, APIStatusError):
+        return error.status_code >= 500
+    return isinstance(error, TIMEOUT_ERRORS + (APIConnectionError, ProviderError))
+
+
+class CircuitOpenError(ProviderError):
+    """The model's circuit is open; `retry_after` is how long until it lets a probe through."""
+
+    def __init__(self, message: str, retry_after: float = 0.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+# --- backends ---
+
+class GroqProvider:
+    """chat.completions.create against the Groq API. SDK retries are off:
+    429s go to the rate limiter and other failures to ResilientProvider."""
+
+    def __init__(self):
+        self.client = Groq(api_key=settings.GROQ_API_KEY, max_retries=0)
+        self.async_client = AsyncGroq(api_key=settings.GROQ_API_KEY, max_retries=0)
+
+    def supports_structured_output(self, model: str) -> bool:
+        return model in settings.CLASSIFIER_STRUCTURED_OUTPUT_MODELS
+
+    def create(self, **request):
+        return self.client.chat.completions.create(**request)
+
+    async def acreate(self, **request):
+        return await self.async_client.chat.completions.create(**request)
+
+
+def latency_sampler(spec: str):
+    """Parses "fixed:ms", "uniform:lo_ms:hi_ms", "normal:mean_ms:std_ms",
+    "lognormal:median_ms:sigma" or "pareto:min_ms:alpha" into a function
+    rng -> seconds."""
+    kind, *params = spec.split(":")
+    p = [float(value) for value in params]
+    samplers = {
+        "fixed": lambda rng: p[0],
+        "uniform": lambda rng: rng.uniform(p[0], p[1]),
+        "normal": lambda rng: max(0.0, rng.gauss(p[0], p[1])),
+        "lognormal": lambda rng: rng.lognormvariate(math.log(p[0]), p[1]),
+        "pareto": lambda rng: p[0] * rng.paretovariate(p[1]),
+    }
+    if kind not in samplers:
+        raise ValueError(f"unknown latency distribution {spec!r}")
+    return lambda rng: samplers[kind](rng) / 1000
+
+
+MOCK_REPLY = """Thanks for reporting this, we are looking into it.
+1. Required Information:
+- Device or system affected: so we can find it in our inventory. Example: laptop asset tag LT-0421
+- When the problem started: to match it against recent changes. Example: today around 9am
+
+2. Next Steps:
+An engineer will review the ticket and reply within one business day."""
+
+
+def mock_value(schema: dict, prompt: str, rng: random.Random, name: str = ""):
+    if "enum" in schema:
+        return rng.choice(schema["enum"])
+    kind = schema.get("type")
+    if kind == "object":
+        return {key: mock_value(value, prompt, rng, key) for key, value in schema.get("properties", {}).items()}
+    if kind == "array":
+        items = schema.get("items", {})
+        if "ticketId" in items.get("properties", {}):
+            # Batched classification: one entry per "### Ticket <id>" heading in the prompt
+            return [
+                {**mock_value(items, prompt, rng), "ticketId": ticket_id}
+                for ticket_id in re.findall(r"^### Ticket (\S+)$", prompt, re.MULTILINE)
+            ]
+        return [mock_value(items, prompt, rng) for _ in range(2)]
+    if kind == "number":
+        return round(rng.uniform(0.55, 0.99), 2)
+    if kind == "integer":
+        return rng.randint(0, 10)
+    if kind == "boolean":
+        return rng.random() < 0.5
+    return MOCK_REPLY if name == "assistant_reply" else "Review the ticket and follow up with the user"
+
+
+def mock_content(request: dict) -> str:
+    """Schema-valid JSON for structured-output requests, a canned reply
+    otherwise. Seeded by the prompt so a hedged duplicate gives the same answer."""
+    prompt = "\n".join(m.get("content") or "" for m in request.get("messages", []))
+    rng = random.Random(hashlib.sha1(prompt.encode()).hexdigest())
+    response_format = request.get("response_format") or {}
+    if response_format.get("type") == "json_schema":
+        return json.dumps(mock_value(response_format["json_schema"]["schema"], prompt, rng))
+    if response_format.get("type") == "json_object":
+        return "{}"
+    return MOCK_REPLY
+
+
+def mock_response(request: dict, content: str):
+    prompt_chars = sum(len(m.get("content") or "") for m in request.get("messages", []))
+    usage = SimpleNamespace(prompt_tokens=prompt_chars // 4, completion_tokens=len(content) // 4)
+    usage.total_tokens = usage.prompt_tokens + usage.completion_tokens
+    message = SimpleNamespace(role="assistant", content=content)
+    return SimpleNamespace(model=request["model"], choices=[SimpleNamespace(message=message)], usage=usage)
+
+
+def mock_chunk(text: str):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+
+class MockProvider:
+    """Offline stand-in for the Groq API with configurable latency and error
+    rate per model. A call slower than its timeout raises TimeoutError after
+    the timeout, like a real client would. Streams wait the sampled latency
+    for the first token, then LLM_MOCK_TOKEN_MS per word."""
+
+    def __init__(self, latency: str = None, latencies: dict = None, error_rate: float = None, seed=None):
+        self.default = latency_sampler(latency or settings.LLM_MOCK_LATENCY)
+        specs = settings.LLM_MOCK_LATENCIES if latencies is None else latencies
+        self.samplers = {model: latency_sampler(spec) for model, spec in specs.items()}
+        self.error_rate = settings.LLM_MOCK_ERROR_RATE if error_rate is None else error_rate
+        self.rng = random.Random(settings.LLM_MOCK_SEED if seed is None else seed)
+
+    def supports_structured_output(self, model: str) -> bool:
+        return True
+
+    def _sample(self, request: dict):
+        latency = self.samplers.get(request["model"], self.default)(self.rng)
+        failed = self.rng.random() < self.error_rate
+        return latency, failed, request.get("timeout") or settings.LLM_TIMEOUT
+
+    @staticmethod
+    def _words(content: str):
+        return re.findall(r"\S+\s*", content)
+
+    def create(self, **request):
+        latency, failed, timeout = self._sample(request)
+        time.sleep(min(latency, timeout))
+        if latency > timeout:
+            raise TimeoutError(f"mock {request['model']} timed out after {timeout:.1f}s")
+        if failed:
+            raise ProviderError(f"mock {request['model']} error")
+        content = mock_content(request)
+        if not request.get("stream"):
+            return mock_response(request, content)
+
+        def chunks():
+            for word in self._words(content):
+                yield mock_chunk(word)
+                time.sleep(settings.LLM_MOCK_TOKEN_MS / 1000)
+        return chunks()
+
+    async def acreate(self, **request):
+        latency, failed, timeout = self._sample(request)
+        await asyncio.sleep(min(latency, timeout))
+        if latency > timeout:
+            raise TimeoutError(f"mock {request['model']} timed out after {timeout:.1f}s")
+        if failed:
+            raise ProviderError(f"mock {request['model']} error")
+        content = mock_content(request)
+        if not request.get("stream"):
+            return mock_response(request, content)
+
+        async def chunks():
+            for word in self._words(content):
+                yield mock_chunk(word)
+                await asyncio.sleep(settings.LLM_MOCK_TOKEN_MS / 1000)
+        return chunks()
+
+
+# --- resilience ---
+
+class LatencyTracker:
+    """Latencies of the last `window` successful calls."""
+
+    def __init__(self, window: int):
+        self.samples = deque(maxlen=window)
+
+    def add(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, q: float):
+        if len(self.samples) < settings.LLM_HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class CircuitBreaker:
+    """Opens once `error_rate` of the last `window` calls (at least
+    `min_calls` of them) failed, rejecting calls for `cooldown` seconds.
+    After that one probe call is let through: success closes the circuit,
+    failure opens it again."""
+
+    def __init__(self, name: str, window: int, min_calls: int, error_rate: float, cooldown: float):
+        self.name = name
+        self.outcomes = deque(maxlen=window)
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.cooldown = cooldown
+        self.opened_at = None
+        self.probing = False
+        self.trips = 0
+        self.lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if self.probing else "open"
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if not self.probing and time.monotonic() - self.opened_at >= self.cooldown:
+                self.probing = True
+                return True
+            return False
+
+    def release(self):
+        """Ends a probe that said nothing about the model's health (a 429, a
+        cancelled call), so the next call probes again."""
+        with self.lock:
+            self.probing = False
+
+    def retry_after(self) -> float:
+        """Seconds until the next probe call is allowed (0 if closed or probing)."""
+        with self.lock:
+            if self.opened_at is None or self.probing:
+                return 0.0
+            return max(0.0, self.opened_at + self.cooldown - time.monotonic())
+
+    def record(self, ok: bool):
+        with self.lock:
+            if self.probing:
+                self.probing = False
+                if ok:
+                    self.opened_at = None
+                    self.outcomes.clear()
+                    LOG.info(f"🟢 Circuit for {self.name} closed again")
+                else:
+                    self.opened_at = time.monotonic()
+                return
+            if self.opened_at is not None:
+                return
+            self.outcomes.append(ok)
+            failures = self.outcomes.count(False)
+            if len(self.outcomes) >= self.min_calls and failures / len(self.outcomes) >= self.error_rate:
+                self.opened_at = time.monotonic()
+                self.trips += 1
+                self.outcomes.clear()
+                LOG.warning(f"🔴 Circuit for {self.name} opened after {failures} failed calls, "
+                            f"retrying in {self.cooldown:.0f}s")
+
+
+class ResilientProvider:
+    """Deadlines, hedging and a circuit breaker around a backend.
+
+    complete()/acomplete() take chat.completions.create keyword arguments
+    plus an optional `timeout`, the deadline for the whole call. Once enough
+    latencies are known for the model and completion budget, a second
+    request is sent if the first has not answered by the
+    LLM_HEDGE_PERCENTILE latency; a failed first request is retried the same
+    way if hedging is on and the error is retryable(). Whichever answers
+    first wins. The backup only goes out if the rate
+    limiter has spare low-priority budget, and streamed calls are never
+    duplicated. While a model's circuit is open, calls fail at once with
+    CircuitOpenError so callers take their fallback path. 429s are left to
+    the rate limiter and do not count as failures.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.latency = {}
+        self.breakers = {}
+        self.counters = Counter()
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=settings.LLM_HEDGE_THREADS, thread_name_prefix="llm")
+
+    def supports_structured_output(self, model: str) -> bool:
+        return self.backend.supports_structured_output(model)
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        with self.lock:
+            if model not in self.breakers:
+                self.breakers[model] = CircuitBreaker(
+                    model,
+                    settings.LLM_BREAKER_WINDOW,
+                    settings.LLM_BREAKER_MIN_CALLS,
+                    settings.LLM_BREAKER_ERROR_RATE,
+                    settings.LLM_BREAKER_COOLDOWN
+                )
+            return self.breakers[model]
+
+    def _tracker(self, request: dict) -> LatencyTracker:
+        # Completion budget separates call kinds (classification vs. reply) on the same model
+        key = (request["model"], request.get("max_completion_tokens"))
+        with self.lock:
+            if key not in self.latency:
+                self.latency[key] = LatencyTracker(settings.LLM_LATENCY_WINDOW)
+            return self.latency[key]
+
+    def _hedge_delay(self, tracker: LatencyTracker):
+        if not settings.LLM_HEDGE_ENABLED:
+            return None
+        delay = tracker.percentile(settings.LLM_HEDGE_PERCENTILE)
+        return None if delay is None else max(delay, settings.LLM_HEDGE_MIN_DELAY_MS / 1000)
+
+    def _admit(self, request: dict):
+        breaker = self.breaker(request["model"])
+        if not breaker.allow():
+            self.counters["rejected"] += 1
+            raise CircuitOpenError(f"circuit for {request['model']} is open", breaker.retry_after())
+        request = dict(request)
+        timeout = request.get("timeout") or settings.LLM_TIMEOUT
+        request["timeout"] = timeout
+        return breaker, request, time.monotonic() + timeout
+
+    def _finish(self, breaker, error):
+        """Records the outcome of an admitted call. Must run on every way out
+        of one, or a half-open circuit keeps waiting for its probe."""
+        if error is None:
+            breaker.record(True)
+        elif isinstance(error, RateLimitError) or not isinstance(error, Exception):
+            breaker.release()  # 429s, cancellation
+        else:
+            breaker.record(False)
+            if isinstance(error, TIMEOUT_ERRORS):
+                self.counters["timeouts"] += 1
+
+    def _should_retry(self, error) -> bool:
+        return settings.LLM_HEDGE_ENABLED and retryable(error)
+
+    def _with_deadline(self, request: dict, deadline: float) -> dict:
+        return {**request, "timeout": max(deadline - time.monotonic(), 0.001)}
+
+    def _backup(self, request: dict, deadline: float):
+        response = limiter.try_call(self.backend.create, self._with_deadline(request, deadline), "low")
+        if response is None:
+            raise ProviderError("no spare budget for a backup request")
+        return response
+
+    async def _abackup(self, request: dict, deadline: float):
+        response = await limiter.atry_call(self.backend.acreate, self._with_deadline(request, deadline), "low")
+        if response is None:
+            raise ProviderError("no spare budget for a backup request")
+        return response
+
+    def complete(self, **request):
+        breaker, request, deadline = self._admit(request)
+        try:
+            response = self.backend.create(**request) if request.get("stream") else self._call(request, deadline)
+        except BaseException as e:
+            self._finish(breaker, e)
+            raise
+        self._finish(breaker, None)
+        return response
+
+    def _call(self, request: dict, deadline: float):
+        tracker = self._tracker(request)
+        started = time.monotonic()
+        hedge_at = self._hedge_delay(tracker)
+        hedge_at = None if hedge_at is None else started + hedge_at
+        primary = self.pool.submit(lambda: self.backend.create(**request))
+        pending, backup, error = {primary}, None, None
+        while pending:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            wake = deadline if backup or hedge_at is None else min(deadline, hedge_at)
+            done, pending = wait(pending, timeout=max(wake - now, 0), return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response = future.result()
+                except Exception as e:
+                    error = e
+                    if future is primary and isinstance(e, RateLimitError) and not pending:
+                        raise
+                    continue
+                tracker.add(time.monotonic() - started)
+                self.counters["calls"] += 1
+                if future is backup:
+                    self.counters["hedge_wins"] += 1
+                return response
+            if backup is None and (self._should_retry(error) if done else
+                                   hedge_at is not None and time.monotonic() >= hedge_at):
+                self.counters["hedges" if not done else "retries"] += 1
+                backup = self.pool.submit(self._backup, request, deadline)
+                pending.add(backup)
+        if pending:
+            error = TimeoutError(f"{request['model']} did not answer within {request['timeout']:.1f}s")
+        self.counters["calls"] += 1
+        raise error
+
+    async def acomplete(self, **request):
+        breaker, request, deadline = self._admit(request)
+        try:
+            if request.get("stream"):
+                response = await self.backend.acreate(**request)
+            else:
+                response = await self._acall(request, deadline)
+        except BaseException as e:
+            self._finish(breaker, e)
+            raise
+        self._finish(breaker, None)
+        return response
+
+    async def _acall(self, request: dict, deadline: float):
+        tracker = self._tracker(request)
+        started = time.monotonic()
+        hedge_at = self._hedge_delay(tracker)
+        hedge_at = None if hedge_at is None else started + hedge_at
+        primary = asyncio.ensure_future(self.backend.acreate(**request))
+        pending, backup, error = {primary}, None, None
+        try:
+            while pending:
+                now = time.monotonic()
+                if now >= deadline:
+                    break
+                wake = deadline if backup or hedge_at is None else min(deadline, hedge_at)
+                done, pending = await asyncio.wait(pending, timeout=max(wake - now, 0),
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    try:
+                        response = task.result()
+                    except Exception as e:
+                        error = e
+                        if task is primary and isinstance(e, RateLimitError) and not pending:
+                            raise
+                        continue
+                    tracker.add(time.monotonic() - started)
+                    self.counters["calls"] += 1
+                    if task is backup:
+                        self.counters["hedge_wins"] += 1
+                    return response
+                if backup is None and (self._should_retry(error) if done else
+                                       hedge_at is not None and time.monotonic() >= hedge_at):
+                    self.counters["hedges" if not done else "retries"] += 1
+                    backup = asyncio.ensure_future(self._abackup(request, deadline))
+                    pending.add(backup)
+        finally:
+            for task in pending:
+                task.cancel()
+        if pending:
+            error = TimeoutError(f"{request['model']} did not answer within {request['timeout']:.1f}s")
+        self.counters["calls"] += 1
+        raise error
+
+    def stats(self) -> dict:
+        c = self.counters
+        return {
+            "calls": c["calls"],
+            "hedges": c["hedges"],
+            "hedge_wins": c["hedge_wins"],
+            "retries": c["retries"],
+            "timeouts": c["timeouts"],
+            "rejected": c["rejected"],
+            "open_circuits": [name for name, breaker in self.breakers.items() if breaker.state != "closed"],
+        }
+
+
+def create_provider() -> ResilientProvider:
+    backends = {"groq": GroqProvider, "mock": MockProvider}
+    if settings.LLM_PROVIDER not in backends:
+        raise ValueError(f"unknown LLM_PROVIDER {settings.LLM_PROVIDER!r}")
+    return ResilientProvider(backends[settings.LLM_PROVIDER]())
+
+
+provider = create_provider()
@@ -0,0 +1,226 @@
+import asyncio
+import logging
+import random
+import time
+
+import redis
+import redis.asyncio as aioredis
+from groq import RateLimitError
+
+from ..config import settings
+
+LOG = logging.getLogger("ratelimit")
+
+# urgent/high tickets first; low-priority work only runs with budget to spare
+PRIORITY_CLASSES = {"urgent": 0, "high": 0, "medium": 1, "low": 2}
+
+# Refills the request and token buckets of one model, then takes one request
+# and ARGV[3] tokens if both allow it. Returns 0 on success, otherwise the
+# milliseconds to wait. Uses the Redis clock so hosts need not agree on time.
+ACQUIRE_LUA = """
+local rpm, tpm = tonumber(ARGV[1]), tonumber(ARGV[2])
+local cost, class, reserve = tonumber(ARGV[3]), tonumber(ARGV[4]), tonumber(ARGV[5])
+local t = redis.call('TIME')
+local now = t[1] * 1000 + math.floor(t[2] / 1000)
+
+local paused = tonumber(redis.call('GET', KEYS[2]) or '0')
+if paused > now then return paused - now end
+
+local state = redis.call('HMGET', KEYS[1], 'req', 'tok', 'ts')
+local req, tok, ts = tonumber(state[1]) or rpm, tonumber(state[2]) or tpm, tonumber(state[3]) or now
+local elapsed = math.max(0, now - ts)
+req = math.min(rpm, req + elapsed * rpm / 60000)
+tok = math.min(tpm, tok + elapsed * tpm / 60000)
+redis.call('HSET', KEYS[1], 'req', req, 'tok', tok, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], 120000)
+
+-- a waiting caller of a more urgent class goes first
+for i = 1, class do
+    if redis.call('EXISTS', KEYS[2 + i]) == 1 then return 250 end
+end
+
+cost = math.min(cost, tpm)
+local need_req = math.min(rpm, 1 + reserve * rpm)
+local need_tok = math.min(tpm, cost + reserve * tpm)
+if req >= need_req and tok >= need_tok then
+    redis.call('HSET', KEYS[1], 'req', req - 1, 'tok', tok - cost)
+    if class < 2 then redis.call('DEL', KEYS[3 + class]) end
+    return 0
+end
+
+local wait = math.ceil(math.max((need_req - req) * 60000 / rpm, (need_tok - tok) * 60000 / tpm, 1))
+if class < 2 then redis.call('SET', KEYS[3 + class], 1, 'PX', wait + 1000) end
+return wait
+"""
+
+# Corrects the token bucket once the real usage of a call is known
+SETTLE_LUA = """
+local tok = tonumber(redis.call('HINCRBYFLOAT', KEYS[1], 'tok', ARGV[1]))
+if tok > tonumber(ARGV[2]) then redis.call('HSET', KEYS[1], 'tok', ARGV[2]) end
+return 0
+"""
+
+# Stops every process from calling a model for ARGV[1] ms after a 429
+PAUSE_LUA = """
+local t = redis.call('TIME')
+local until_ms = t[1] * 1000 + math.floor(t[2] / 1000) + tonumber(ARGV[1])
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+if until_ms > current then redis.call('SET', KEYS[1], until_ms, 'PX', ARGV[1]) end
+return 0
+"""
+
+
+def estimate_tokens(request: dict) -> int:
+    """Upper estimate of a chat completion's tokens: ~4 characters per
+    prompt token plus the completion budget."""
+    prompt_chars = sum(len(m.get("content") or "") for m in request.get("messages", []))
+    return prompt_chars // 4 + request.get("max_completion_tokens", 0)
+
+
+def priority_class(priority) -> int:
+    return PRIORITY_CLASSES.get(priority or "medium", 1)
+
+
+def retry_after(error: RateLimitError) -> float:
+    try:
+        return float(error.response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return settings.RATE_LIMIT_DEFAULT_BACKOFF
+
+
+class RateLimiter:
+    """Distributed token bucket per Groq model, tracking requests per minute
+    and tokens per minute in Redis so every worker process shares one budget.
+
+    call()/acall() wait until both buckets allow the request and never fail
+    for lack of capacity: a 429 from Groq pauses the model for everyone for
+    its Retry-After and the request is sent again.
+    """
+
+    def __init__(self):
+        self.redis = redis.from_url(settings.REDIS_URL)
+        self.aredis = aioredis.from_url(settings.REDIS_URL)
+        self._acquire = self.redis.register_script(ACQUIRE_LUA)
+        self._settle = self.redis.register_script(SETTLE_LUA)
+        self._pause = self.redis.register_script(PAUSE_LUA)
+        self._aacquire = self.aredis.register_script(ACQUIRE_LUA)
+        self._asettle = self.aredis.register_script(SETTLE_LUA)
+        self._apause = self.aredis.register_script(PAUSE_LUA)
+
+    @staticmethod
+    def limits(model: str):
+        rpm, tpm = settings.GROQ_RATE_LIMITS.get(model, settings.GROQ_DEFAULT_RATE_LIMIT)
+        return rpm, tpm
+
+    @staticmethod
+    def keys(model: str) -> list:
+        base = f"ratelimit:{model}"
+        return [base, f"{base}:paused", f"{base}:waiting:0", f"{base}:waiting:1"]
+
+    def _args(self, model: str, tokens: int, priority) -> list:
+        rpm, tpm = self.limits(model)
+        klass = priority_class(priority)
+        return [rpm, tpm, tokens, klass, settings.RATE_LIMIT_RESERVES[klass]]
+
+    @staticmethod
+    def _sleep_for(wait_ms: int) -> float:
+        # Jitter keeps processes that were denied together from retrying together
+        return min(wait_ms, settings.RATE_LIMIT_MAX_SLEEP_MS) / 1000 * random.uniform(1.0, 1.2)
+
+    def acquire(self, model: str, tokens: int, priority=None) -> float:
+        """Blocks until the request fits the budget. Returns seconds waited."""
+        started = time.monotonic()
+        args = self._args(model, tokens, priority)
+        while True:
+            wait_ms = int(self._acquire(keys=self.keys(model), args=args))
+            if wait_ms == 0:
+                return time.monotonic() - started
+            time.sleep(self._sleep_for(wait_ms))
+
+    async def aacquire(self, model: str, tokens: int, priority=None) -> float:
+        started = time.monotonic()
+        args = self._args(model, tokens, priority)
+        while True:
+            wait_ms = int(await self._aacquire(keys=self.keys(model), args=args))
+            if wait_ms == 0:
+                return time.monotonic() - started
+            await asyncio.sleep(self._sleep_for(wait_ms))
+
+    def _log_wait(self, model: str, priority, waited: float):
+        if waited >= 1:
+            LOG.info(f"⏳ Waited {waited:.1f}s for {model} budget ({priority or 'medium'} priority)")
+
+    @staticmethod
+    def _used_tokens(response, estimated: int) -> int:
+        usage = getattr(response, "usage", None)
+        return getattr(usage, "total_tokens", None) or estimated
+
+    def call(self, fn, request: dict, priority=None):
+        """fn(**request) once the model's budget allows it."""
+        if not settings.RATE_LIMIT_ENABLED:
+            return fn(**request)
+        model, estimated = request["model"], estimate_tokens(request)
+        while True:
+            self._log_wait(model, priority, self.acquire(model, estimated, priority))
+            try:
+                response = fn(**request)
+            except RateLimitError as e:
+                pause = retry_after(e)
+                LOG.warning(f"🚦 {model} returned 429, pausing all callers for {pause:.1f}s")
+                self._pause(keys=[self.keys(model)[1]], args=[int(pause * 1000)])
+                continue
+            self._settle(keys=[self.keys(model)[0]],
+                         args=[estimated - self._used_tokens(response, estimated), self.limits(model)[1]])
+            return response
+
+    def try_call(self, fn, request: dict, priority=None):
+        """fn(**request) if the budget allows it right now, otherwise None.
+        For optional requests such as hedges, which should never wait."""
+        if not settings.RATE_LIMIT_ENABLED:
+            return fn(**request)
+        model, estimated = request["model"], estimate_tokens(request)
+        if int(self._acquire(keys=self.keys(model), args=self._args(model, estimated, priority))) != 0:
+            return None
+        try:
+            response = fn(**request)
+        except RateLimitError as e:
+            self._pause(keys=[self.keys(model)[1]], args=[int(retry_after(e) * 1000)])
+            raise
+        self._settle(keys=[self.keys(model)[0]],
+                     args=[estimated - self._used_tokens(response, estimated), self.limits(model)[1]])
+        return response
+
+    async def atry_call(self, fn, request: dict, priority=None):
+        if not settings.RATE_LIMIT_ENABLED:
+            return await fn(**request)
+        model, estimated = request["model"], estimate_tokens(request)
+        if int(await self._aacquire(keys=self.keys(model), args=self._args(model, estimated, priority))) != 0:
+            return None
+        try:
+            response = await fn(**request)
+        except RateLimitError as e:
+            await self._apause(keys=[self.keys(model)[1]], args=[int(retry_after(e) * 1000)])
+            raise
+        await self._asettle(keys=[self.keys(model)[0]],
+                            args=[estimated - self._used_tokens(response, estimated), self.limits(model)[1]])
+        return response
+
+    async def acall(self, fn, request: dict, priority=None):
+        if not settings.RATE_LIMIT_ENABLED:
+            return await fn(**request)
+        model, estimated = request["model"], estimate_tokens(request)
+        while True:
+            self._log_wait(model, priority, await self.aacquire(model, estimated, priority))
+            try:
+                response = await fn(**request)
+            except RateLimitError as e:
+                pause = retry_after(e)
+                LOG.warning(f"🚦 {model} returned 429, pausing all callers for {pause:.1f}s")
+                await self._apause(keys=[self.keys(model)[1]], args=[int(pause * 1000)])
+                continue
+            await self._asettle(keys=[self.keys(model)[0]],
+                                args=[estimated - self._used_tokens(response, estimated), self.limits(model)[1]])
+            return response
+
+
+limiter = RateLimiter()
@@ -0,0 +1,53 @@
+from ..config import settings
+from .prompts import build_context, clean_description, system_message
+
+REPLY_INSTRUCTIONS = """Provide a helpful solution in plain text, structured for a chat window without markdown support. Use simple formatting like line breaks, dashes, or numbered lists for clarity. The response should include:
+1. Immediate Acknowledgement: A brief, professional acknowledgment of the issue.
+2. Required Information: A list of details needed to process the request, with each item including what it is, why it's needed, and an example.
+3. Next Steps: A brief note on the expected timeline or process (e.g., warranty check, repair/replacement timeline).
+Exclude unrelated details (e.g., redis credentials).
+
+Example format:
+1. Required Information:
+- [Item 1]: [Why we need it]. Example: [Example]
+- [Item 2]: [Why we need it]. Example: [Example]
+
+3. Next Steps:
+[Describe next steps, e.g., warranty check, expected timeline]."""
+
+REPLY_ROLE = "You are an IT helpdesk assistant. Provide clear, actionable solutions in plain text for a chat window."
+
+# Static instructions first so every reply request shares a cacheable prefix
+REPLY_SYSTEM_MESSAGE = system_message(REPLY_ROLE, REPLY_INSTRUCTIONS)
+
+def build_rag_context(docs):
+    return build_context(docs)
+
+def build_rag_prompt(ticket, classification, context):
+    return f"""Ticket: {ticket.get('title', '')}
+Description: {clean_description(ticket['description'])}
+Category: {classification['data'].get('department')}
+
+Context from knowledge base:
+{context}"""
+
+def rag_request(prompt):
+    """Keyword arguments for chat.completions.create, shared by the sync and async paths."""
+    return dict(
+        model="openai/gpt-oss-120b",
+        messages=[REPLY_SYSTEM_MESSAGE, {"role": "user", "content": prompt}],
+        temperature=0.3,
+        max_completion_tokens=500,
+        timeout=settings.RAG_LLM_TIMEOUT
+    )
+
+def build_enriched(ticket_id, classification, assistant_reply, docs):
+    return {
+        "ticketId": ticket_id,
+        "classification": classification['data'],
+        "assistant_reply": assistant_reply,
+        "citations": [d["doc_id"] for d in docs] if docs else [],
+        "clarifying_questions": [],
+        "resolution_type": "needs_agent",
+        "automation_candidates": []
+    }
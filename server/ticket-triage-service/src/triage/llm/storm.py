@@ -0,0 +1,157 @@
+import re
+import random
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+from ..schemas.models import ClassificationOutput
+from .cache import normalize_text
+
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_TEXT_CHARS = 2000
+
+
+class MinHasher:
+    """MinHash signatures over character shingles of the normalized text.
+
+    Character shingles (rather than word n-grams) keep short tickets such as
+    "vpn not connecting" / "VPN not connecting!!" comparable."""
+
+    def __init__(self, num_perm: int = 64, shingle_size: int = 4, seed: int = 1):
+        rng = random.Random(seed)
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.perms = [(rng.randrange(1, MERSENNE_PRIME), rng.randrange(0, MERSENNE_PRIME))
+                      for _ in range(num_perm)]
+
+    def shingles(self, text: str) -> set:
+        text = re.sub(r"[^\w ]+", " ", normalize_text(text)[:MAX_TEXT_CHARS])
+        text = re.sub(r" +", " ", text).strip()
+        k = self.shingle_size
+        if len(text) <= k:
+            return {zlib.crc32(text.encode())}
+        return {zlib.crc32(text[i:i + k].encode()) for i in range(len(text) - k + 1)}
+
+    def signature(self, text: str) -> Tuple[int, ...]:
+        hashes = self.shingles(text)
+        return tuple(min((a * h + b) % MERSENNE_PRIME for h in hashes) for a, b in self.perms)
+
+
+def similarity(a: Tuple[int, ...], b: Tuple[int, ...]) -> float:
+    """Estimated Jaccard similarity of the texts behind two signatures."""
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+
+@dataclass
+class Leader:
+    ticket_id: str
+    signature: Tuple[int, ...]
+    added_at: float
+    bands: List[int]
+    followers: int = 0
+    classification: Optional[ClassificationOutput] = None
+    done: threading.Event = field(default_factory=threading.Event)
+
+
+class StormIndex:
+    """Rolling LSH index of recent cluster leaders.
+
+    A ticket whose estimated similarity to an indexed leader reaches
+    `threshold` joins that leader's cluster; otherwise it becomes a leader
+    itself. Leaders older than `window_seconds` are evicted (and the oldest
+    once `max_leaders` is reached), so memory stays bounded during a storm
+    and a long incident simply elects a fresh leader.
+
+    The index is per worker process: replicas elect their own leaders, which
+    still collapses a storm to one LLM call per cluster per replica.
+    """
+
+    def __init__(self, threshold: float = 0.6, window_seconds: float = 900, num_perm: int = 64,
+                 bands: int = 16, max_leaders: int = 10000):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.threshold = threshold
+        self.window_seconds = window_seconds
+        self.max_leaders = max_leaders
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.hasher = MinHasher(num_perm)
+        self.leaders = OrderedDict()
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.stats = {"tickets": 0, "leaders": 0, "followers": 0, "evicted": 0}
+
+    def _band_keys(self, signature) -> List[int]:
+        r = self.rows
+        return [hash((band, signature[band * r:(band + 1) * r])) for band in range(self.bands)]
+
+    def _drop(self, leader: Leader):
+        for key in leader.bands:
+            bucket = self.buckets.get(key)
+            if bucket is not None:
+                bucket.discard(leader.ticket_id)
+                if not bucket:
+                    del self.buckets[key]
+        leader.done.set()
+
+    def _evict(self, now: float):
+        while self.leaders:
+            oldest = next(iter(self.leaders.values()))
+            if now - oldest.added_at < self.window_seconds and len(self.leaders) < self.max_leaders:
+                break
+            self.leaders.popitem(last=False)
+            self._drop(oldest)
+            self.stats["evicted"] += 1
+
+    def assign(self, ticket_id: str, text: str, now: float = None) -> Optional[Leader]:
+        """Returns the leader `ticket_id` should follow, or None if it now leads its own cluster."""
+        signature = self.hasher.signature(text)
+        bands = self._band_keys(signature)
+        now = time.time() if now is None else now
+
+        with self.lock:
+            self._evict(now)
+            self.stats["tickets"] += 1
+            if ticket_id in self.leaders:  # redelivered leader job
+                return None
+            candidates = set()
+            for key in bands:
+                candidates.update(self.buckets.get(key, ()))
+
+            best, best_score = None, self.threshold
+            for candidate_id in candidates:
+                leader = self.leaders[candidate_id]
+                score = similarity(signature, leader.signature)
+                if score >= best_score:
+                    best, best_score = leader, score
+            if best is not None:
+                best.followers += 1
+                self.stats["followers"] += 1
+                return best
+
+            self.leaders[ticket_id] = Leader(ticket_id, signature, now, bands)
+            for key in bands:
+                self.buckets.setdefault(key, set()).add(ticket_id)
+            self.stats["leaders"] += 1
+            return None
+
+    def resolve(self, ticket_id: str, classification: ClassificationOutput):
+        """Publishes the leader's classification to current and future followers."""
+        with self.lock:
+            leader = self.leaders.get(ticket_id)
+            if leader is not None:
+                leader.classification = classification
+                leader.done.set()
+
+    def forget(self, ticket_id: str):
+        """Drops a leader whose classification failed, so followers classify themselves."""
+        with self.lock:
+            leader = self.leaders.pop(ticket_id, None)
+            if leader is not None:
+                self._drop(leader)
+
+    def __len__(self):
+        return len(self.leaders)
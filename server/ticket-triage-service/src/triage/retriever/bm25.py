@@ -0,0 +1,300 @@
+import json
+import logging
+import math
+import os
+import re
+import time
+import uuid
+import zlib
+from collections import Counter, defaultdict
+from pathlib import Path
+
+import numpy as np
+
+from ..config import settings
+from .index import top_k
+
+LOG = logging.getLogger("bm25")
+
+STATE_FILE = "bm25.json"
+DOCS_FILE = "docs.npz"
+IDS_FILE = "ids.json"
+
+# Words joined by . - _ : / @ stay one token (error codes, hostnames, paths,
+# versions); their parts are indexed as well
+TOKEN = re.compile(r"[a-z0-9]+(?:[._\-:/@][a-z0-9]+)*")
+SEPARATORS = re.compile(r"[._\-:/@]")
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have i in is it its me my not of on or our so "
+    "that the this to was we were what when where which will with you your".split()
+)
+
+
+def tokenize(text: str) -> list:
+    terms = []
+    for match in TOKEN.finditer(text.lower()):
+        token = match.group()
+        if token in STOPWORDS or len(token) > 100:
+            continue
+        terms.append(token)
+        if SEPARATORS.search(token):
+            terms += [part for part in SEPARATORS.split(token) if part and part not in STOPWORDS]
+    return terms
+
+
+def bucket(term: str) -> int:
+    """Terms are hashed into 2^BM25_HASH_BITS buckets, so no vocabulary is
+    kept in memory; a rare collision only merges two terms' postings."""
+    return zlib.crc32(term.encode()) & ((1 << settings.BM25_HASH_BITS) - 1)
+
+
+class Segment:
+    """Immutable postings: sorted term buckets, and for each one a run of
+    (document, term frequency) pairs in `docs`/`tfs` (6 bytes per posting)."""
+
+    def __init__(self, terms: np.ndarray, offsets: np.ndarray, docs: np.ndarray, tfs: np.ndarray, name: str = None):
+        self.terms = terms
+        self.offsets = offsets
+        self.docs = docs
+        self.tfs = tfs
+        self.name = name
+
+    def __len__(self):
+        return len(self.docs)
+
+    @property
+    def nbytes(self) -> int:
+        return self.terms.nbytes + self.offsets.nbytes + self.docs.nbytes + self.tfs.nbytes
+
+    @classmethod
+    def build(cls, terms: np.ndarray, docs: np.ndarray, tfs: np.ndarray) -> "Segment":
+        """From parallel arrays of postings in any order."""
+        order = np.lexsort((docs, terms))
+        terms, docs, tfs = terms[order], docs[order], tfs[order]
+        unique, starts = np.unique(terms, return_index=True)
+        offsets = np.append(starts, len(terms)).astype(np.int64)
+        return cls(unique.astype(np.uint32), offsets, docs.astype(np.uint32), tfs.astype(np.uint16))
+
+    @classmethod
+    def from_pending(cls, pending: dict) -> "Segment":
+        terms = np.fromiter((term for term, postings in pending.items() for _ in range(len(postings) // 2)),
+                            dtype=np.uint32)
+        flat = np.fromiter((value for postings in pending.values() for value in postings), dtype=np.int64)
+        return cls.build(terms, flat[0::2], flat[1::2])
+
+    @classmethod
+    def merge(cls, segments: list, remap: np.ndarray) -> "Segment":
+        """One segment from several, keeping postings of documents that `remap`
+        maps to a new number (dead documents map to -1)."""
+        terms = np.concatenate([np.repeat(s.terms, np.diff(s.offsets)) for s in segments])
+        docs = remap[np.concatenate([s.docs for s in segments])]
+        tfs = np.concatenate([s.tfs for s in segments])
+        keep = docs >= 0
+        return cls.build(terms[keep], docs[keep], tfs[keep])
+
+    def postings(self, term: int):
+        i = np.searchsorted(self.terms, term)
+        if i == len(self.terms) or self.terms[i] != term:
+            return None
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.docs[start:end], self.tfs[start:end]
+
+
+class BM25Index:
+    """Inverted index over knowledge base chunks, updated in place.
+
+    Added chunks collect in a pending buffer that is frozen into a new
+    segment every BM25_FLUSH_POSTINGS postings; past BM25_MAX_SEGMENTS the
+    smallest segments are merged. Removing a chunk only marks its document
+    dead; merges drop dead postings, and once half the documents are dead
+    everything is renumbered. Memory is the hashed postings plus 5 bytes and
+    the chunk id per document.
+    """
+
+    def __init__(self):
+        self.segments = []
+        self.pending = defaultdict(list)
+        self.pending_postings = 0
+        self.doc_len = np.zeros(1024, dtype=np.uint32)
+        self.alive = np.zeros(1024, dtype=bool)
+        self.chunk_ids = []
+        self.rows = {}
+        self.total_len = 0
+        self.removed = []
+
+    def __len__(self):
+        return len(self.rows)
+
+    # --- updates ---
+
+    def add(self, chunk_id: str, text: str):
+        """Indexes a chunk, replacing an earlier version with the same id."""
+        self.remove(chunk_id)
+        terms = Counter(bucket(term) for term in tokenize(text))
+        doc = len(self.chunk_ids)
+        if doc == len(self.alive):
+            self.doc_len = np.resize(self.doc_len, doc * 2)
+            self.alive = np.resize(self.alive, doc * 2)
+        length = sum(terms.values())
+        self.doc_len[doc], self.alive[doc] = length, True
+        self.chunk_ids.append(chunk_id)
+        self.rows[chunk_id] = doc
+        self.total_len += length
+        for term, tf in terms.items():
+            self.pending[term] += (doc, min(tf, 65535))
+        self.pending_postings += len(terms)
+        if self.pending_postings >= settings.BM25_FLUSH_POSTINGS:
+            self.flush()
+
+    def remove(self, chunk_id: str):
+        doc = self.rows.pop(chunk_id, None)
+        if doc is not None:
+            self.alive[doc] = False
+            self.total_len -= int(self.doc_len[doc])
+
+    def flush(self):
+        if self.pending:
+            self.segments.append(Segment.from_pending(self.pending))
+            self.pending, self.pending_postings = defaultdict(list), 0
+        dead = len(self.chunk_ids) - len(self.rows)
+        if dead and dead >= len(self.rows):
+            self.compact()
+        elif len(self.segments) > settings.BM25_MAX_SEGMENTS:
+            self.segments.sort(key=len)
+            count = len(self.segments) - settings.BM25_MAX_SEGMENTS // 2 + 1
+            identity = np.where(self.alive[:len(self.chunk_ids)], np.arange(len(self.chunk_ids)), -1)
+            merged = Segment.merge(self.segments[:count], identity)
+            self.removed += [s.name for s in self.segments[:count] if s.name]
+            self.segments = self.segments[count:] + [merged]
+
+    def compact(self):
+        """Renumbers the live documents and merges everything into one segment."""
+        alive = self.alive[:len(self.chunk_ids)]
+        remap = np.full(len(self.chunk_ids), -1, dtype=np.int64)
+        remap[alive] = np.arange(int(alive.sum()))
+        merged = Segment.merge(self.segments, remap) if self.segments else None
+        self.removed += [s.name for s in self.segments if s.name]
+        self.segments = [merged] if merged is not None and len(merged) else []
+        self.chunk_ids = [chunk_id for chunk_id, live in zip(self.chunk_ids, alive) if live]
+        self.rows = {chunk_id: doc for doc, chunk_id in enumerate(self.chunk_ids)}
+        lengths = self.doc_len[:len(alive)][alive]
+        self.doc_len = np.zeros(max(len(lengths) * 2, 1024), dtype=np.uint32)
+        self.doc_len[:len(lengths)] = lengths
+        self.alive = np.zeros(len(self.doc_len), dtype=bool)
+        self.alive[:len(lengths)] = True
+
+    # --- search ---
+
+    def search(self, query: str, k: int) -> list:
+        """(chunk id, BM25 score) of the k best matching chunks, best first."""
+        if self.pending:
+            self.flush()
+        live = len(self.rows)
+        terms = {bucket(term) for term in tokenize(query)}
+        if not live or not terms:
+            return []
+        k1, b = settings.BM25_K1, settings.BM25_B
+        avg_len = self.total_len / live or 1.0
+        docs, weights = [], []
+        for term in terms:
+            found = [p for p in (segment.postings(term) for segment in self.segments) if p is not None]
+            if not found:
+                continue
+            term_docs = np.concatenate([d for d, _ in found])
+            tf = np.concatenate([t for _, t in found]).astype(np.float32)
+            live_postings = self.alive[term_docs]
+            term_docs, tf = term_docs[live_postings], tf[live_postings]
+            df = len(term_docs)
+            if not df:
+                continue
+            idf = math.log(1 + (live - df + 0.5) / (df + 0.5))
+            norm = k1 * (1 - b + b * self.doc_len[term_docs] / avg_len)
+            docs.append(term_docs)
+            weights.append(idf * tf * (k1 + 1) / (tf + norm))
+        if not docs:
+            return []
+        scores = np.bincount(np.concatenate(docs), weights=np.concatenate(weights), minlength=len(self.chunk_ids))
+        rows, values = top_k(scores, k)
+        return [(self.chunk_ids[row], float(value)) for row, value in zip(rows, values) if value > 0]
+
+    def memory(self) -> dict:
+        return {
+            "postings": sum(len(s) for s in self.segments),
+            "segments": len(self.segments),
+            "bytes": sum(s.nbytes for s in self.segments) + self.doc_len.nbytes + self.alive.nbytes,
+        }
+
+    # --- persistence ---
+
+    def save(self, path):
+        """Writes new segments and the document table; index state last."""
+        self.flush()
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        for segment in self.segments:
+            if segment.name is None:
+                segment.name = f"seg-{uuid.uuid4().hex[:12]}.npz"
+                with open(path / segment.name, "wb") as f:
+                    np.savez(f, terms=segment.terms, offsets=segment.offsets, docs=segment.docs, tfs=segment.tfs)
+        count = len(self.chunk_ids)
+        tmp = path / f".{DOCS_FILE}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, doc_len=self.doc_len[:count], alive=self.alive[:count])
+        os.replace(tmp, path / DOCS_FILE)
+        tmp = path / f".{IDS_FILE}.{os.getpid()}.tmp"
+        tmp.write_text(json.dumps(self.chunk_ids))
+        os.replace(tmp, path / IDS_FILE)
+        tmp = path / f".{STATE_FILE}.{os.getpid()}.tmp"
+        tmp.write_text(json.dumps({
+            "segments": [s.name for s in self.segments],
+            "documents": count,
+            "hash_bits": settings.BM25_HASH_BITS,
+            "written_at": time.time(),
+        }))
+        os.replace(tmp, path / STATE_FILE)
+        for name in self.removed:
+            (path / name).unlink(missing_ok=True)
+        self.removed = []
+
+    @classmethod
+    def load(cls, path) -> "BM25Index":
+        path = Path(path)
+        state = json.loads((path / STATE_FILE).read_text())
+        if state["hash_bits"] != settings.BM25_HASH_BITS:
+            raise ValueError(f"BM25 index at {path} uses {state['hash_bits']} hash bits, "
+                             f"BM25_HASH_BITS is {settings.BM25_HASH_BITS}; rebuild it")
+        index = cls()
+        for name in state["segments"]:
+            with np.load(path / name) as data:
+                index.segments.append(Segment(data["terms"], data["offsets"], data["docs"], data["tfs"], name))
+        with np.load(path / DOCS_FILE) as data:
+            doc_len, alive = data["doc_len"], data["alive"]
+        index.chunk_ids = json.loads((path / IDS_FILE).read_text())
+        if len(index.chunk_ids) != state["documents"] or len(doc_len) != state["documents"]:
+            raise ValueError(f"BM25 index at {path} is incomplete")
+        capacity = max(len(doc_len) * 2, 1024)
+        index.doc_len = np.zeros(capacity, dtype=np.uint32)
+        index.doc_len[:len(doc_len)] = doc_len
+        index.alive = np.zeros(capacity, dtype=bool)
+        index.alive[:len(alive)] = alive
+        index.rows = {chunk_id: doc for doc, chunk_id in enumerate(index.chunk_ids) if alive[doc]}
+        index.total_len = int(doc_len[alive].sum())
+        return index
+
+    @staticmethod
+    def version(path):
+        try:
+            return (Path(path) / STATE_FILE).stat().st_mtime
+        except FileNotFoundError:
+            return None
+
+
+def reciprocal_rank_fusion(rankings: list, k: int = None) -> list:
+    """Ids ordered by the sum of 1 / (k + rank) over the rankings they appear
+    in, with their fused scores. Ranks start at 1."""
+    k = k or settings.RETRIEVER_RRF_K
+    fused = defaultdict(float)
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            fused[item] += 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: -item[1])
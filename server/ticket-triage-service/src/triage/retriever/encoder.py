@@ -0,0 +1,196 @@
+import hashlib
+import logging
+import queue
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+
+from ..config import settings
+
+LOG = logging.getLogger("encoder")
+
+# Loading the model takes seconds and ~100 MB, so it happens on first use
+# (or in warm() at worker start) rather than at import time.
+_model = None
+_backend = None
+_lock = threading.Lock()
+
+stats = Counter()
+
+
+def _load_model():
+    global _backend
+    from sentence_transformers import SentenceTransformer
+    started = time.perf_counter()
+    if settings.EMBEDDING_BACKEND == "onnx":
+        try:
+            model = SentenceTransformer(settings.EMBEDDING_MODEL, device=settings.EMBEDDING_DEVICE, backend="onnx",
+                                        model_kwargs={"file_name": settings.EMBEDDING_ONNX_FILE})
+            LOG.info(f"🧠 Encoder {settings.EMBEDDING_MODEL} ({settings.EMBEDDING_ONNX_FILE}) loaded "
+                     f"in {time.perf_counter() - started:.1f}s")
+            _backend = "onnx"
+            return model
+        except Exception as e:
+            LOG.warning(f"⚠️ ONNX encoder unavailable ({e}), using the PyTorch model")
+    model = SentenceTransformer(settings.EMBEDDING_MODEL, device=settings.EMBEDDING_DEVICE)
+    LOG.info(f"🧠 Encoder {settings.EMBEDDING_MODEL} loaded in {time.perf_counter() - started:.1f}s")
+    _backend = "torch"
+    return model
+
+
+def get_encoder():
+    global _model
+    if _model is None:
+        with _lock:
+            if _model is None:
+                _model = _load_model()
+    return _model
+
+
+def warm():
+    """Loads the model and runs one encode, so the first request doesn't pay for it."""
+    encode(["warm up"])
+
+
+def encode(texts: list) -> np.ndarray:
+    """L2-normalized float32 embeddings, one row per text, so a dot product is cosine similarity."""
+    if not texts:
+        return np.zeros((0, embedding_dim()), dtype=np.float32)
+    vectors = get_encoder().encode(
+        texts,
+        batch_size=settings.EMBEDDING_BATCH_SIZE,
+        normalize_embeddings=True,
+        convert_to_numpy=True,
+        show_progress_bar=False,
+    )
+    return vectors.astype(np.float32, copy=False)
+
+
+def embedding_dim() -> int:
+    return get_encoder().get_sentence_embedding_dimension()
+
+
+class EncodeBatcher:
+    """Coalesces single-text encodes from many threads into one model call.
+
+    A background thread takes the first waiting text, collects whatever else
+    is queued (waiting up to `linger_ms` for more, 0 by default) up to
+    `max_size`, encodes the batch and hands each caller its row. Texts that
+    arrive while a batch is encoding go into the next one.
+    """
+
+    def __init__(self, max_size: int, linger_ms: int):
+        self.max_size = max(1, max_size)
+        self.linger = linger_ms / 1000
+        self.queue = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def encode(self, text: str) -> np.ndarray:
+        future = Future()
+        self.queue.put((text, future))
+        if self.thread is None:
+            with self.lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self._run, name="encode-batcher", daemon=True)
+                    self.thread.start()
+        return future.result()
+
+    def _collect(self) -> list:
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.linger
+        while len(batch) < self.max_size:
+            try:
+                remaining = deadline - time.monotonic()
+                batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                vectors = encode([text for text, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            stats["batches"] += 1
+            stats["batched_texts"] += len(batch)
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(vector)
+
+
+class EmbeddingCache:
+    """LRU of query embeddings keyed by a hash of the model, the backend that
+    loaded it, the ONNX file and the text, so vectors from one setup are
+    never served to another."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(text: str) -> bytes:
+        # _backend is only known once the model is loaded (see encode_query)
+        model = f"{settings.EMBEDDING_MODEL}\0{_backend}\0{settings.EMBEDDING_ONNX_FILE}"
+        return hashlib.blake2b(f"{model}\0{text}".encode(), digest_size=16).digest()
+
+    def get(self, key: bytes):
+        with self.lock:
+            vector = self.entries.get(key)
+            if vector is not None:
+                self.entries.move_to_end(key)
+            return vector
+
+    def put(self, key: bytes, vector: np.ndarray):
+        vector.setflags(write=False)  # shared between callers
+        with self.lock:
+            self.entries[key] = vector
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+
+_batcher = EncodeBatcher(settings.EMBEDDING_QUERY_BATCH_SIZE, settings.EMBEDDING_QUERY_LINGER_MS)
+_cache = EmbeddingCache(settings.EMBEDDING_CACHE_SIZE) if settings.EMBEDDING_CACHE_SIZE > 0 else None
+
+
+def encode_query(text: str) -> np.ndarray:
+    """Embedding of one query (a ticket, a search), read-only. Served from the
+    LRU cache when the same text was encoded recently; otherwise batched with
+    concurrent queries from other threads."""
+    key = None
+    if _cache is not None:
+        get_encoder()  # the key depends on the backend that loaded
+        key = EmbeddingCache.key(text)
+        vector = _cache.get(key)
+        if vector is not None:
+            stats["cache_hits"] += 1
+            return vector
+    stats["cache_misses"] += 1
+    if settings.EMBEDDING_QUERY_BATCH_SIZE > 1:
+        vector = _batcher.encode(text)
+    else:
+        vector = encode([text])[0]
+        stats["batches"] += 1
+        stats["batched_texts"] += 1
+    if key is not None:
+        _cache.put(key, vector)
+    return vector
+
+
+def encoder_report() -> dict:
+    lookups = stats["cache_hits"] + stats["cache_misses"]
+    return {
+        "backend": _backend,
+        "queries": lookups,
+        "cache_hit_rate": stats["cache_hits"] / lookups if lookups else 0.0,
+        "batches": stats["batches"],
+        "avg_batch": stats["batched_texts"] / stats["batches"] if stats["batches"] else 0.0,
+    }
@@ -0,0 +1,218 @@
+import json
+import logging
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+
+from ..config import settings
+from .quantize import QUANTIZERS
+
+LOG = logging.getLogger("index")
+
+VECTORS_FILE = "vectors.npy"
+DOCS_FILE = "docs.jsonl"
+GRAPH_FILE = "hnsw.bin"
+CODES_FILE = "codes.npy"
+QUANTIZER_FILE = "quantizer.npy"
+META_FILE = "index.json"
+
+
+def _load_hnswlib():
+    try:
+        import hnswlib
+        return hnswlib
+    except ImportError:
+        return None
+
+
+def top_k(scores: np.ndarray, k: int):
+    """Indices of the k highest scores, best first, and their scores."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    return top, scores[top]
+
+
+class EmbeddedIndex:
+    """Knowledge base vectors in a directory, searched in-process.
+
+    The L2-normalized float32 vectors live in a .npy file that is memory-mapped
+    read-only, so processes on the same host share the page cache instead of
+    each holding a copy. Search is a dot product over all rows and a partial
+    sort; from RETRIEVER_HNSW_MIN_VECTORS vectors an HNSW graph is built next
+    to them (when hnswlib is installed) and searched instead.
+
+    With RETRIEVER_QUANTIZATION set to "int8" or "binary", compact codes of
+    the vectors are held in memory and searched instead; the best
+    RETRIEVER_RERANK_FACTOR x k candidates are then re-scored exactly against
+    the float vectors, of which only those rows are read from disk.
+
+    Files: vectors.npy, docs.jsonl (one payload per row), hnsw.bin, codes.npy
+    and quantizer.npy (optional) and index.json, which is written last and
+    marks a complete index.
+    """
+
+    def __init__(self, path, vectors: np.ndarray, docs: list, meta: dict, graph=None,
+                 codes: np.ndarray = None, quantizer=None):
+        self.path = Path(path)
+        self.vectors = vectors
+        self.docs = docs
+        self.meta = meta
+        self.graph = graph
+        self.codes = codes
+        self.quantizer = quantizer
+
+    def __len__(self):
+        return len(self.docs)
+
+    @property
+    def dim(self) -> int:
+        return self.meta["dim"]
+
+    # --- writing ---
+
+    @classmethod
+    def write(cls, path, vectors: np.ndarray, docs: list, graph: str = "auto",
+              quantization: str = None) -> "EmbeddedIndex":
+        """Replaces the index at `path`. `graph` is "auto" (build an HNSW graph
+        above RETRIEVER_HNSW_MIN_VECTORS), "always" or "never"; `quantization`
+        defaults to RETRIEVER_QUANTIZATION."""
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if len(vectors) != len(docs):
+            raise ValueError(f"{len(vectors)} vectors but {len(docs)} documents")
+        dim = vectors.shape[1] if vectors.ndim == 2 else 0
+
+        def replace(name, write):
+            tmp = path / f".{name}.{os.getpid()}.tmp"
+            write(tmp)
+            os.replace(tmp, path / name)
+
+        def save(array):
+            def write(tmp):
+                with open(tmp, "wb") as f:
+                    np.save(f, array)
+            return write
+
+        def write_docs(tmp):
+            with open(tmp, "w", encoding="utf-8") as f:
+                for doc in docs:
+                    f.write(json.dumps(doc, ensure_ascii=False) + "\n")
+
+        replace(VECTORS_FILE, save(vectors))
+        replace(DOCS_FILE, write_docs)
+
+        has_graph = False
+        if graph == "always" or (graph == "auto" and len(vectors) >= settings.RETRIEVER_HNSW_MIN_VECTORS):
+            hnswlib = _load_hnswlib()
+            if hnswlib is None:
+                LOG.warning("⚠️ hnswlib is not installed, the index will be searched exhaustively")
+            elif len(vectors):
+                started = time.perf_counter()
+                index = hnswlib.Index(space="ip", dim=dim)
+                index.init_index(max_elements=len(vectors), M=settings.RETRIEVER_HNSW_M,
+                                 ef_construction=settings.RETRIEVER_HNSW_EF_CONSTRUCTION)
+                index.add_items(vectors, np.arange(len(vectors)))
+                replace(GRAPH_FILE, lambda tmp: index.save_index(str(tmp)))
+                has_graph = True
+                LOG.info(f"🕸️ HNSW graph over {len(vectors)} vectors built in {time.perf_counter() - started:.1f}s")
+        if not has_graph and (path / GRAPH_FILE).exists():
+            (path / GRAPH_FILE).unlink()
+
+        quantization = quantization or settings.RETRIEVER_QUANTIZATION
+        if quantization != "none":
+            if quantization not in QUANTIZERS:
+                raise ValueError(f"Unknown quantization {quantization!r}, expected none or one of {', '.join(QUANTIZERS)}")
+            quantizer = QUANTIZERS[quantization].fit(vectors)
+            replace(QUANTIZER_FILE, save(quantizer.params))
+            replace(CODES_FILE, save(quantizer.encode(vectors)))
+        else:
+            for name in (CODES_FILE, QUANTIZER_FILE):
+                if (path / name).exists():
+                    (path / name).unlink()
+
+        meta = {
+            "dim": dim,
+            "count": len(vectors),
+            "model": settings.EMBEDDING_MODEL,
+            "graph": has_graph,
+            "quantization": quantization,
+            "written_at": time.time(),
+        }
+        replace(META_FILE, lambda tmp: tmp.write_text(json.dumps(meta)))
+        return cls.load(path)
+
+    # --- reading ---
+
+    @classmethod
+    def load(cls, path) -> "EmbeddedIndex":
+        path = Path(path)
+        meta = json.loads((path / META_FILE).read_text())
+        vectors = np.load(path / VECTORS_FILE, mmap_mode="r") if meta["count"] else \
+            np.zeros((0, meta["dim"]), dtype=np.float32)
+        with open(path / DOCS_FILE, encoding="utf-8") as f:
+            docs = [json.loads(line) for line in f if line.strip()]
+        if len(vectors) != meta["count"] or len(docs) != meta["count"]:
+            # Caught in the middle of a rewrite; the caller tries again later
+            raise ValueError(f"Index at {path} is incomplete ({len(vectors)} vectors, {len(docs)} documents, "
+                             f"{meta['count']} expected)")
+        if meta.get("model") and meta["model"] != settings.EMBEDDING_MODEL:
+            LOG.warning(f"⚠️ Index at {path} was built with {meta['model']}, queries use {settings.EMBEDDING_MODEL}")
+
+        graph = None
+        if meta.get("graph"):
+            hnswlib = _load_hnswlib()
+            if hnswlib is None:
+                LOG.warning("⚠️ Index has an HNSW graph but hnswlib is not installed, searching exhaustively")
+            else:
+                graph = hnswlib.Index(space="ip", dim=meta["dim"])
+                graph.load_index(str(path / GRAPH_FILE), max_elements=meta["count"])
+                graph.set_ef(settings.RETRIEVER_HNSW_EF_SEARCH)
+
+        codes = quantizer = None
+        if meta.get("quantization", "none") != "none" and meta["count"]:
+            # Loaded into memory: the codes are what every query scans
+            quantizer = QUANTIZERS[meta["quantization"]](np.load(path / QUANTIZER_FILE))
+            codes = np.load(path / CODES_FILE)
+        return cls(path, vectors, docs, meta, graph, codes, quantizer)
+
+    @staticmethod
+    def version(path):
+        """Modification time of index.json, or None when there is no index."""
+        try:
+            return (Path(path) / META_FILE).stat().st_mtime
+        except FileNotFoundError:
+            return None
+
+    def memory(self) -> dict:
+        """Bytes of float vectors on disk and of codes held in memory."""
+        return {
+            "vectors": int(self.vectors.nbytes),
+            "codes": int(self.codes.nbytes) if self.codes is not None else 0,
+        }
+
+    # --- search ---
+
+    def search(self, query: np.ndarray, k: int, exact: bool = False):
+        """Row indices and cosine similarities of the k nearest vectors, best
+        first. `exact` skips the HNSW graph and the quantized codes."""
+        if not len(self.docs) or k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        query = np.asarray(query, dtype=np.float32)
+        if self.graph is not None and not exact:
+            k = min(k, len(self.docs))
+            self.graph.set_ef(max(settings.RETRIEVER_HNSW_EF_SEARCH, k))
+            labels, distances = self.graph.knn_query(query, k=k)
+            # hnswlib's "ip" distance is 1 - dot product
+            return labels[0].astype(np.int64), (1.0 - distances[0]).astype(np.float32)
+        if self.codes is not None and not exact:
+            candidates, _ = top_k(self.quantizer.scores(self.codes, query), k * settings.RETRIEVER_RERANK_FACTOR)
+            candidates.sort()  # read the float rows in file order
+            order, scores = top_k(np.asarray(self.vectors[candidates]) @ query, k)
+            return candidates[order], scores
+        return top_k(self.vectors @ query, k)
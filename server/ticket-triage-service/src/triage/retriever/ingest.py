@@ -0,0 +1,386 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from html.parser import HTMLParser
+from pathlib import Path
+
+import numpy as np
+
+from ..config import settings
+from ..llm.prompts import count_tokens
+from .bm25 import BM25Index
+from .encoder import encode, warm
+from .index import EmbeddedIndex
+
+LOG = logging.getLogger("ingest")
+
+EXTENSIONS = {".md", ".markdown", ".txt", ".html", ".htm"}
+
+
+# --- reading and chunking ---
+
+class _TextExtractor(HTMLParser):
+    BLOCK_TAGS = {"p", "div", "br", "li", "tr", "section", "article", "pre", "table",
+                  "h1", "h2", "h3", "h4", "h5", "h6"}
+    SKIP_TAGS = {"script", "style", "head", "nav", "footer"}
+
+    def __init__(self):
+        super().__init__()
+        self.parts, self.skipping = [], 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP_TAGS:
+            self.skipping += 1
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append("\n\n")
+        if tag in ("h1", "h2", "h3", "h4", "h5", "h6") and not self.skipping:
+            self.parts.append("#" * int(tag[1]) + " ")
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS:
+            self.skipping = max(self.skipping - 1, 0)
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append("\n\n")
+
+    def handle_data(self, data):
+        if not self.skipping:
+            self.parts.append(re.sub(r"[ \t\r\n]+", " ", data))
+
+
+def read_document(path: Path) -> str:
+    text = path.read_text(encoding="utf-8", errors="replace")
+    if path.suffix.lower() in (".html", ".htm"):
+        extractor = _TextExtractor()
+        extractor.feed(text)
+        text = "".join(extractor.parts)
+    return re.sub(r"\n[ \t]*\n\s*", "\n\n", text).strip()
+
+
+def _split_long(block: str, max_tokens: int) -> list:
+    """Splits a paragraph over the budget at sentence ends, then between words."""
+    pieces = re.split(r"(?<=[.!?])\s+", block)
+    if len(pieces) == 1:
+        words = block.split()
+        step = max(int(max_tokens * 0.75), 1)  # words run a little over one token each
+        pieces = [" ".join(words[i:i + step]) for i in range(0, len(words), step)]
+    out, current = [], ""
+    for piece in pieces:
+        candidate = f"{current} {piece}".strip()
+        if current and count_tokens(candidate) > max_tokens:
+            out.append(current)
+            current = piece
+        else:
+            current = candidate
+    if current:
+        out.append(current)
+    return out
+
+
+def chunk_text(text: str, max_tokens: int = None, overlap: int = None) -> list:
+    """Packs paragraphs into chunks of at most `max_tokens` tokens. A markdown
+    heading always starts a new chunk, and each chunk repeats up to `overlap`
+    tokens of trailing paragraphs from the one before it in the same section."""
+    max_tokens = max_tokens or settings.KB_CHUNK_TOKENS
+    overlap = settings.KB_CHUNK_OVERLAP if overlap is None else overlap
+
+    blocks = []
+    for block in re.split(r"\n\s*\n", text):
+        block = block.strip()
+        if not block:
+            continue
+        if count_tokens(block) > max_tokens:
+            blocks += [(piece, False) for piece in _split_long(block, max_tokens)]
+        else:
+            blocks.append((block, block.startswith("#")))
+
+    chunks, current, used = [], [], 0
+    for block, heading in blocks:
+        size = count_tokens(block)
+        if current and (heading or used + size > max_tokens):
+            chunks.append("\n\n".join(current))
+            carried, carried_size = [], 0
+            if not heading:
+                for previous in reversed(current):
+                    previous_size = count_tokens(previous)
+                    if carried_size + previous_size > overlap or carried_size + previous_size + size > max_tokens:
+                        break
+                    carried.insert(0, previous)
+                    carried_size += previous_size
+            current, used = carried, carried_size
+        current.append(block)
+        used += size
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()[:32]
+
+
+@dataclass
+class Chunk:
+    id: str
+    doc_id: str
+    text: str
+    hash: str = field(init=False)
+
+    def __post_init__(self):
+        self.hash = content_hash(self.text)
+
+    def payload(self) -> dict:
+        return {"id": self.id, "doc_id": self.doc_id, "text": self.text, "hash": self.hash}
+
+
+def scan(root: Path) -> list:
+    """Chunks of every KB document under `root`, identified by relative path
+    and content hash (plus an occurrence number when the same text repeats in
+    a document), so inserting a paragraph does not change the id of every
+    chunk after it and unchanged text is never re-embedded."""
+    chunks = []
+    for path in sorted(root.rglob("*")):
+        relative = path.relative_to(root)
+        if not path.is_file() or path.suffix.lower() not in EXTENSIONS \
+                or any(part.startswith(".") for part in relative.parts):
+            continue
+        doc_id = relative.as_posix()
+        seen = Counter()
+        for text in chunk_text(read_document(path)):
+            key = content_hash(text)[:16]
+            seen[key] += 1
+            suffix = f".{seen[key]}" if seen[key] > 1 else ""
+            chunks.append(Chunk(f"{doc_id}#{key}{suffix}", doc_id, text))
+    return chunks
+
+
+# --- embedding ---
+
+def _init_embedder():
+    # One process per core already; keep torch from spawning a thread per core in each
+    try:
+        import torch
+        torch.set_num_threads(1)
+    except ImportError:
+        pass
+    warm()
+
+
+def _embed(texts: list) -> np.ndarray:
+    return encode(texts)
+
+
+def embed_batches(chunks: list, workers: int, batch_size: int):
+    """Yields (chunks, vectors) per batch, in order. With more than one worker
+    the batches are encoded in a process pool, each process loading the model once."""
+    batches = [chunks[i:i + batch_size] for i in range(0, len(chunks), batch_size)]
+    if workers <= 1 or len(batches) <= 1:
+        for batch in batches:
+            yield batch, encode([chunk.text for chunk in batch])
+        return
+    with ProcessPoolExecutor(max_workers=min(workers, len(batches)), initializer=_init_embedder) as pool:
+        for batch, vectors in zip(batches, pool.map(_embed, [[chunk.text for chunk in batch] for batch in batches])):
+            yield batch, vectors
+
+
+# --- destinations ---
+
+class EmbeddedSink:
+    """Rewrites the embedded index once at the end, keeping unchanged rows."""
+
+    def __init__(self, path: str = None):
+        self.path = path or settings.RETRIEVER_INDEX_PATH
+        self.target = f"embedded:{Path(self.path).resolve()}"
+        self.removed, self.vectors, self.docs = set(), [], []
+        self.replace = False
+
+    def reset(self, keep: set):
+        """Without a manifest every chunk is re-embedded; drop the old rows."""
+        self.replace = True
+
+    def upsert(self, chunks: list, vectors: np.ndarray):
+        self.removed.update(chunk.id for chunk in chunks)
+        self.vectors.append(vectors)
+        self.docs += [chunk.payload() for chunk in chunks]
+
+    def delete(self, ids: list):
+        self.removed.update(ids)
+
+    def commit(self):
+        if not self.replace and EmbeddedIndex.version(self.path) is not None:
+            index = EmbeddedIndex.load(self.path)
+            keep = [row for row, doc in enumerate(index.docs) if doc.get("id") not in self.removed]
+            old_vectors, old_docs = np.asarray(index.vectors[keep]), [index.docs[row] for row in keep]
+        else:
+            old_vectors, old_docs = None, []
+        parts = ([old_vectors] if old_vectors is not None and len(old_vectors) else []) + self.vectors
+        vectors = np.vstack(parts) if parts else np.zeros((0, 0), dtype=np.float32)
+        EmbeddedIndex.write(self.path, vectors, old_docs + self.docs)
+        return len(old_docs) + len(self.docs)
+
+
+class QdrantSink:
+    """Upserts and deletes points in the Qdrant collection as batches arrive."""
+
+    def __init__(self, url: str = None, collection: str = None):
+        from qdrant_client import QdrantClient
+        self.client = QdrantClient(url=url or settings.VECTOR_DB_URL, timeout=60, check_compatibility=False)
+        self.collection = collection or settings.RETRIEVER_COLLECTION
+        self.target = f"qdrant:{url or settings.VECTOR_DB_URL}/{self.collection}"
+        self.checked = False
+
+    @staticmethod
+    def point_id(chunk_id: str) -> str:
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, chunk_id))
+
+    def _ensure_collection(self, dim: int):
+        from qdrant_client.models import Distance, VectorParams
+        if not self.checked:
+            if self.collection not in [c.name for c in self.client.get_collections().collections]:
+                self.client.create_collection(self.collection,
+                                              vectors_config=VectorParams(size=dim, distance=Distance.COSINE))
+                LOG.info(f"✅ Created Qdrant collection '{self.collection}'")
+            self.checked = True
+
+    def reset(self, keep: set):
+        """Without a manifest, deletes the points of chunks that no longer exist."""
+        if self.collection not in [c.name for c in self.client.get_collections().collections]:
+            return
+        stale, offset = [], None
+        while True:
+            points, offset = self.client.scroll(self.collection, limit=1000, offset=offset,
+                                                with_payload=["id"], with_vectors=False)
+            stale += [p.id for p in points if (p.payload or {}).get("id") not in keep]
+            if offset is None:
+                break
+        if stale:
+            from qdrant_client.models import PointIdsList
+            self.client.delete(self.collection, points_selector=PointIdsList(points=stale), wait=True)
+            LOG.info(f"🧹 Removed {len(stale)} point(s) not in the knowledge base")
+
+    def upsert(self, chunks: list, vectors: np.ndarray):
+        from qdrant_client.models import PointStruct
+        self._ensure_collection(vectors.shape[1])
+        for i in range(0, len(chunks), settings.KB_UPSERT_BATCH):
+            points = [
+                PointStruct(id=self.point_id(chunk.id), vector=vector.tolist(), payload=chunk.payload())
+                for chunk, vector in zip(chunks[i:i + settings.KB_UPSERT_BATCH], vectors[i:i + settings.KB_UPSERT_BATCH])
+            ]
+            self.client.upsert(self.collection, points=points, wait=True)
+
+    def delete(self, ids: list):
+        from qdrant_client.models import PointIdsList
+        for i in range(0, len(ids), settings.KB_UPSERT_BATCH):
+            self.client.delete(self.collection, points_selector=PointIdsList(
+                points=[self.point_id(chunk_id) for chunk_id in ids[i:i + settings.KB_UPSERT_BATCH]]
+            ), wait=True)
+
+    def commit(self):
+        return self.client.count(self.collection).count
+
+
+SINKS = {"embedded": EmbeddedSink, "qdrant": QdrantSink}
+
+
+# --- manifest ---
+
+def load_manifest(path: Path, target: str) -> dict:
+    """chunk id -> content hash of what the target holds. Empty (everything is
+    re-embedded) when the manifest is missing or was written for another
+    target or embedding model."""
+    try:
+        manifest = json.loads(path.read_text())
+    except (FileNotFoundError, ValueError):
+        return {}
+    if manifest.get("target") != target or manifest.get("model") != settings.EMBEDDING_MODEL:
+        LOG.info("🔁 Manifest is for another index or model, ingesting everything")
+        return {}
+    return manifest.get("chunks", {})
+
+
+def save_manifest(path: Path, target: str, chunks: dict):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps({"target": target, "model": settings.EMBEDDING_MODEL, "chunks": chunks}))
+    os.replace(tmp, path)
+
+
+def update_bm25(chunks: list, changed: list, deleted: list, rebuild: bool) -> int:
+    """Applies the same changes to the BM25 index, or rebuilds it from every
+    chunk (no embedding needed) when there is none yet. Returns its size."""
+    path = settings.RETRIEVER_BM25_PATH
+    if rebuild or BM25Index.version(path) is None:
+        index, changed = BM25Index(), chunks
+        if Path(path).exists():
+            for stale in Path(path).glob("seg-*.npz"):
+                stale.unlink()
+    else:
+        index = BM25Index.load(path)
+    for chunk_id in deleted:
+        index.remove(chunk_id)
+    for chunk in changed:
+        index.add(chunk.id, chunk.text)
+    index.save(path)
+    memory = index.memory()
+    LOG.info(f"🔤 BM25 index: {len(index)} chunks, {memory['postings']} postings in {memory['segments']} "
+             f"segment(s), {memory['bytes'] / 2**20:.1f} MB")
+    return len(index)
+
+
+def ingest(root, backend: str = None, workers: int = None, full: bool = False, dry_run: bool = False) -> dict:
+    """Brings the knowledge base index in line with the documents under
+    `root`: new and changed chunks are embedded and upserted, chunks that
+    disappeared are deleted; the BM25 index follows. Returns counts and timings."""
+    started = time.perf_counter()
+    root = Path(root)
+    sink = SINKS[backend or settings.RETRIEVER_BACKEND]()
+    manifest_path = Path(settings.KB_MANIFEST_PATH)
+    known = {} if full else load_manifest(manifest_path, sink.target)
+
+    chunks = scan(root)
+    current = {chunk.id: chunk.hash for chunk in chunks}
+    changed = [chunk for chunk in chunks if known.get(chunk.id) != chunk.hash]
+    deleted = [chunk_id for chunk_id in known if chunk_id not in current]
+    report = {
+        "documents": len({chunk.doc_id for chunk in chunks}),
+        "chunks": len(chunks),
+        "unchanged": len(chunks) - len(changed),
+        "embedded": len(changed),
+        "deleted": len(deleted),
+        "scan_seconds": time.perf_counter() - started,
+    }
+    LOG.info(f"📄 {report['documents']} document(s), {len(chunks)} chunk(s): {len(changed)} new or changed, "
+             f"{len(deleted)} deleted")
+    if dry_run or (not changed and not deleted and known):
+        if not dry_run and BM25Index.version(settings.RETRIEVER_BM25_PATH) is None:
+            report["keyword_indexed"] = update_bm25(chunks, [], [], rebuild=True)
+        report["embed_seconds"] = report["chunks_per_second"] = 0.0
+        report["total_seconds"] = time.perf_counter() - started
+        return report
+    if not known:
+        sink.reset(set(current))
+
+    workers = workers if workers is not None else settings.KB_EMBED_WORKERS
+    workers = workers or os.cpu_count() or 1
+    embed_started, done = time.perf_counter(), 0
+    for batch, vectors in embed_batches(changed, workers, settings.KB_EMBED_BATCH):
+        sink.upsert(batch, vectors)
+        done += len(batch)
+        rate = done / (time.perf_counter() - embed_started)
+        LOG.info(f"🧮 Embedded {done}/{len(changed)} chunks ({rate:.0f} chunks/s)")
+    report["embed_seconds"] = time.perf_counter() - embed_started
+    report["chunks_per_second"] = len(changed) / report["embed_seconds"] if changed else 0.0
+
+    if deleted:
+        sink.delete(deleted)
+    report["indexed"] = sink.commit()
+    report["keyword_indexed"] = update_bm25(chunks, changed, deleted, rebuild=not known)
+    save_manifest(manifest_path, sink.target, current)
+    report["total_seconds"] = time.perf_counter() - started
+    return report
@@ -0,0 +1,83 @@
+import numpy as np
+
+# Rows compared at a time, so scoring never allocates a copy of the whole
+# code matrix. int8 rows are converted into a float buffer that stays in
+# cache (512 x 384 floats); larger blocks were slower than float32 itself.
+BLOCK_ROWS = 8192
+INT8_BLOCK_ROWS = 512
+
+if hasattr(np, "bitwise_count"):
+    _popcount = np.bitwise_count
+else:  # numpy < 2.0
+    _POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def _popcount(codes):
+        return _POPCOUNT[codes]
+
+
+class Int8Quantizer:
+    """Scalar quantization: each dimension scaled by its largest magnitude
+    and rounded to int8, a quarter of the float32 size. Scores are dot
+    products with the query multiplied by the same scales."""
+
+    name = "int8"
+
+    def __init__(self, params: np.ndarray):
+        self.scale = np.asarray(params, dtype=np.float32)
+
+    @classmethod
+    def fit(cls, vectors: np.ndarray) -> "Int8Quantizer":
+        scale = np.abs(vectors).max(axis=0) / 127.0 if len(vectors) else np.ones(vectors.shape[1])
+        return cls(np.maximum(scale, 1e-8))
+
+    @property
+    def params(self) -> np.ndarray:
+        return self.scale
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        return np.clip(np.rint(vectors / self.scale), -127, 127).astype(np.int8)
+
+    def scores(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        query = (query * self.scale).astype(np.float32)
+        out = np.empty(len(codes), dtype=np.float32)
+        buffer = np.empty((min(INT8_BLOCK_ROWS, len(codes)), codes.shape[1]), dtype=np.float32)
+        for i in range(0, len(codes), INT8_BLOCK_ROWS):
+            block = codes[i:i + INT8_BLOCK_ROWS]
+            np.copyto(buffer[:len(block)], block)
+            np.dot(buffer[:len(block)], query, out=out[i:i + len(block)])
+        return out
+
+
+class BinaryQuantizer:
+    """One bit per dimension (above or below the corpus mean), 1/32 of the
+    float32 size. Scores are negated Hamming distances, good enough to pick
+    candidates for an exact re-rank but not to order them."""
+
+    name = "binary"
+
+    def __init__(self, params: np.ndarray):
+        self.threshold = np.asarray(params, dtype=np.float32)
+
+    @classmethod
+    def fit(cls, vectors: np.ndarray) -> "BinaryQuantizer":
+        return cls(vectors.mean(axis=0) if len(vectors) else np.zeros(vectors.shape[1]))
+
+    @property
+    def params(self) -> np.ndarray:
+        return self.threshold
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        return np.packbits(vectors > self.threshold, axis=1)
+
+    def scores(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        bits = self.encode(query[None, :])[0]
+        out = np.empty(len(codes), dtype=np.float32)
+        for i in range(0, len(codes), BLOCK_ROWS):
+            out[i:i + BLOCK_ROWS] = -_popcount(codes[i:i + BLOCK_ROWS] ^ bits).sum(axis=1, dtype=np.int32)
+        return out
+
+
+QUANTIZERS = {
+    "int8": Int8Quantizer,
+    "binary": BinaryQuantizer,
+}
@@ -1,30 +1,181 @@
-from qdrant_client import QdrantClient
-# from sentence_transformers import SentenceTransformer
+import logging
+import threading
+import time
+
 from ..config import settings
+from .bm25 import BM25Index, reciprocal_rank_fusion
+from .encoder import encode_query
+from .index import EmbeddedIndex
+
+LOG = logging.getLogger("rag")
+
+
+class Reloader:
+    """An index loaded from disk and reloaded, at most every
+    RETRIEVER_RELOAD_SECONDS, when its version (state file mtime) changes."""
+
+    def __init__(self, path, index_class, label: str):
+        self.path = path
+        self.index_class = index_class
+        self.label = label
+        self.index = None
+        self.version = None
+        self.checked = 0.0
+        self.lock = threading.Lock()
+
+    def current(self):
+        """The loaded index, or None while there is none."""
+        if self.checked and time.monotonic() - self.checked < settings.RETRIEVER_RELOAD_SECONDS:
+            return self.index
+        with self.lock:
+            self.checked = time.monotonic()
+            version = self.index_class.version(self.path)
+            if version is None:
+                if self.version is None:
+                    LOG.warning(f"⚠️ No {self.label} at {self.path}, replies get no context from it")
+                    self.version = 0
+                return self.index
+            if version != self.version:
+                try:
+                    self.index = self.index_class.load(self.path)
+                    self.version = version
+                    LOG.info(f"📚 Loaded {self.label}: {len(self.index)} chunks")
+                except Exception as e:
+                    LOG.error(f"❌ Could not load {self.label} at {self.path}: {e}")
+        return self.index
+
+
+def _result(payload: dict, score) -> dict:
+    return {
+        "text": payload.get("text", ""),
+        "doc_id": payload.get("doc_id", ""),
+        "score": float(score),
+        "id": payload.get("id"),
+    }
+
+
+class QdrantRetriever:
+    """The kb_docs collection in Qdrant (scripts/setup_qdrant.py)."""
+
+    name = "qdrant"
+
+    def __init__(self, url: str = None, collection: str = None):
+        from qdrant_client import QdrantClient
+        self.client = QdrantClient(url=url or settings.VECTOR_DB_URL, check_compatibility=False)
+        self.collection = collection or settings.RETRIEVER_COLLECTION
+
+    def ready(self) -> bool:
+        return True
+
+    def fetch(self, ids: list) -> dict:
+        """Payloads of chunks by chunk id (points are stored under a uuid5 of it)."""
+        from .ingest import QdrantSink
+        points = self.client.retrieve(self.collection, ids=[QdrantSink.point_id(chunk_id) for chunk_id in ids],
+                                      with_payload=True)
+        return {p.payload.get("id"): p.payload for p in points if p.payload}
+
+    def search(self, vector, top_k: int) -> list:
+        if hasattr(self.client, "query_points"):
+            results = self.client.query_points(
+                collection_name=self.collection, query=vector.tolist(), limit=top_k, with_payload=True
+            ).points
+        else:
+            results = self.client.search(collection_name=self.collection, query_vector=vector.tolist(), limit=top_k)
+        return [_result(r.payload, r.score) for r in results]
+
+
+class EmbeddedRetriever:
+    """An EmbeddedIndex on local disk, reloaded when it is rewritten."""
+
+    name = "embedded"
+
+    def __init__(self, path: str = None):
+        self.index = Reloader(path or settings.RETRIEVER_INDEX_PATH, EmbeddedIndex, "knowledge base index")
+        self.rows, self.rows_for = {}, None
+
+    def ready(self) -> bool:
+        index = self.index.current()
+        return index is not None and len(index) > 0
+
+    def fetch(self, ids: list) -> dict:
+        index = self.index.current()
+        if index is None:
+            return {}
+        if self.rows_for is not index:
+            self.rows, self.rows_for = {doc.get("id"): row for row, doc in enumerate(index.docs)}, index
+        return {chunk_id: index.docs[self.rows[chunk_id]] for chunk_id in ids if chunk_id in self.rows}
+
+    def search(self, vector, top_k: int) -> list:
+        index = self.index.current()
+        if index is None:
+            return []
+        rows, scores = index.search(vector, top_k)
+        return [_result(index.docs[row], score) for row, score in zip(rows, scores)]
+
+
+BACKENDS = {
+    "qdrant": QdrantRetriever,
+    "embedded": EmbeddedRetriever,
+}
+
+# Created on first use so importing this module never connects to anything
+_retriever = None
+_bm25 = None
+_lock = threading.Lock()
+
+
+def get_retriever():
+    global _retriever
+    if _retriever is None:
+        with _lock:
+            if _retriever is None:
+                if settings.RETRIEVER_BACKEND not in BACKENDS:
+                    raise ValueError(f"Unknown RETRIEVER_BACKEND {settings.RETRIEVER_BACKEND!r}, "
+                                     f"expected one of {', '.join(BACKENDS)}")
+                _retriever = BACKENDS[settings.RETRIEVER_BACKEND]()
+    return _retriever
+
+
+def get_bm25() -> Reloader:
+    global _bm25
+    if _bm25 is None:
+        with _lock:
+            if _bm25 is None:
+                _bm25 = Reloader(settings.RETRIEVER_BM25_PATH, BM25Index, "BM25 index")
+    return _bm25
+
+
+def hybrid_search(retriever, query: str, vector, top_k: int) -> list:
+    """Vector and BM25 candidates merged by reciprocal rank fusion. "score" is
+    the fused score; without a BM25 index this is plain vector search."""
+    candidates = max(settings.RETRIEVER_HYBRID_CANDIDATES, top_k)
+    semantic = retriever.search(vector, candidates)
+    bm25 = get_bm25().current()
+    if bm25 is None:
+        return semantic[:top_k]
+    keyword = bm25.search(query, candidates)
+
+    found = {doc["id"]: doc for doc in semantic if doc.get("id")}
+    fused = reciprocal_rank_fusion([[doc["id"] for doc in semantic if doc.get("id")],
+                                    [chunk_id for chunk_id, _ in keyword]])[:top_k]
+    missing = [chunk_id for chunk_id, _ in fused if chunk_id not in found]
+    if missing:
+        found.update({chunk_id: _result(payload, 0.0) for chunk_id, payload in retriever.fetch(missing).items()})
+    return [{**found[chunk_id], "score": score} for chunk_id, score in fused if chunk_id in found]
 
-client = QdrantClient(url=settings.VECTOR_DB_URL, check_compatibility=False)
-# encoder = SentenceTransformer('paraphrase-MiniLM-L3-v2') 
 
 def retrieve_docs(query: str, top_k: int = 5):
-   
-    # try:
-    #     embedding = encoder.encode(query, show_progress_bar=False).tolist()
-        
-    #     results = client.search(
-    #         collection_name="kb_docs",
-    #         query_vector=embedding,
-    #         limit=top_k
-    #     )
-        
-    #     return [
-    #         {
-    #             "text": r.payload.get("text", ""),
-    #             "doc_id": r.payload.get("doc_id", ""),
-    #             "score": r.score
-    #         }
-    #         for r in results
-    #     ]
-    # except Exception as e:
-    #     print(f"⚠️ RAG retrieval failed: {e}")
-    #     return []  # Fallback to no docs
-    return []  # no need at the moment!
+    """Top `top_k` knowledge base passages for the query as
+    {"text", "doc_id", "score", "id"} dicts, best first. Empty when retrieval fails."""
+    try:
+        retriever = get_retriever()
+        # Don't load the encoder while there is nothing to search
+        if not retriever.ready():
+            return []
+        vector = encode_query(query)
+        if settings.RETRIEVER_MODE == "hybrid":
+            return hybrid_search(retriever, query, vector, top_k)
+        return retriever.search(vector, top_k)
+    except Exception as e:
+        print(f"⚠️ RAG retrieval failed: {e}")
+        return []  # Fallback to no docs
@@ -1,8 +1,309 @@
 import redis
+import redis.asyncio as aioredis
 import json
+import logging
+import os
+import socket
+import time
 from ..config import settings
 
+LOG = logging.getLogger("queue")
+
 r = redis.from_url(settings.REDIS_URL)
+ar = aioredis.from_url(settings.REDIS_URL)
+
+# Every stage reads from "<job_type>_stream" through a consumer group, so any
+# number of replicas can share a stage and a job is only XACKed once its
+# handler returned. Entries left pending by a dead worker are reclaimed after
+# QUEUE_CLAIM_IDLE_MS and moved to "<job_type>_dead" after too many deliveries.
+
+
+def stream_key(job_type: str) -> str:
+    return f"{job_type}_stream"
+
+
+def dead_letter_key(job_type: str) -> str:
+    return f"{job_type}_dead"
+
+
+def consumer_name() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
 
 def enqueue_job(job_type: str, data: dict):
-    r.rpush(f"{job_type}_queue", json.dumps(data))
+    r.xadd(
+        stream_key(job_type),
+        {"data": json.dumps(data)},
+        maxlen=settings.QUEUE_STREAM_MAXLEN,
+        approximate=True,
+    )
+
+
+def enqueue_jobs(job_type: str, items: list):
+    """Adds several jobs in one round trip."""
+    if not items:
+        return
+    pipe = r.pipeline(transaction=False)
+    for data in items:
+        pipe.xadd(
+            stream_key(job_type),
+            {"data": json.dumps(data)},
+            maxlen=settings.QUEUE_STREAM_MAXLEN,
+            approximate=True,
+        )
+    pipe.execute()
+
+
+def ensure_group(job_type: str, group: str):
+    try:
+        r.xgroup_create(stream_key(job_type), group, id="0", mkstream=True)
+        LOG.info(f"Created consumer group {group} on {stream_key(job_type)}")
+    except redis.exceptions.ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+def _decode_entries(entries):
+    jobs = []
+    for entry_id, fields in entries or []:
+        if fields is None:  # entry was trimmed while pending
+            continue
+        entry_id = entry_id.decode() if isinstance(entry_id, bytes) else entry_id
+        raw = fields.get(b"data") or fields.get("data")
+        jobs.append((entry_id, json.loads(raw)))
+    return jobs
+
+
+def read_jobs(job_type: str, group: str, consumer: str, count: int = 1, block_ms: int = None):
+    """Returns up to `count` new jobs as [(entry_id, data)]."""
+    result = r.xreadgroup(
+        group,
+        consumer,
+        {stream_key(job_type): ">"},
+        count=count,
+        block=settings.QUEUE_BLOCK_MS if block_ms is None else block_ms,
+    )
+    if not result:
+        return []
+    return _decode_entries(result[0][1])
+
+
+def read_batch(job_type: str, group: str, consumer: str, batch_size: int, linger_ms: int = 0):
+    """Blocks for the first job, then keeps reading for up to `linger_ms`
+    to fill the batch. Returns [(entry_id, data)]."""
+    jobs = read_jobs(job_type, group, consumer, batch_size)
+    if not jobs or linger_ms <= 0:
+        return jobs
+    deadline = time.monotonic() + linger_ms / 1000
+    while len(jobs) < batch_size:
+        remaining_ms = int((deadline - time.monotonic()) * 1000)
+        if remaining_ms <= 0:
+            break
+        more = read_jobs(job_type, group, consumer, batch_size - len(jobs), block_ms=remaining_ms)
+        if not more:
+            break
+        jobs.extend(more)
+    return jobs
+
+
+def ack_jobs(job_type: str, group: str, entry_ids: list):
+    if entry_ids:
+        r.xack(stream_key(job_type), group, *entry_ids)
+
+
+def reclaim_stale(job_type: str, group: str, consumer: str, count: int = 10, start_id: str = "0-0"):
+    """Takes over up to `count` jobs left pending for longer than
+    QUEUE_CLAIM_IDLE_MS, scanning the pending list from `start_id`. Jobs
+    delivered QUEUE_MAX_DELIVERIES times are moved to the dead-letter stream
+    instead of being retried forever. Returns (jobs, next_id); next_id is
+    "0-0" once the whole pending list has been scanned."""
+    key = stream_key(job_type)
+    pending = r.xpending_range(
+        key, group, min="-", max="+", count=count, idle=settings.QUEUE_CLAIM_IDLE_MS
+    )
+    poisoned = [p["message_id"] for p in pending if p["times_delivered"] >= settings.QUEUE_MAX_DELIVERIES]
+    if poisoned:
+        claimed = r.xclaim(key, group, consumer, settings.QUEUE_CLAIM_IDLE_MS, poisoned)
+        pipe = r.pipeline(transaction=False)
+        for entry_id, fields in claimed:
+            if fields:
+                pipe.xadd(dead_letter_key(job_type), fields, maxlen=settings.QUEUE_STREAM_MAXLEN, approximate=True)
+        pipe.xack(key, group, *poisoned)
+        pipe.execute()
+        LOG.error(f"☠️ Moved {len(poisoned)} job(s) from {key} to {dead_letter_key(job_type)}")
+
+    next_id, entries, *_ = r.xautoclaim(
+        key, group, consumer, min_idle_time=settings.QUEUE_CLAIM_IDLE_MS, start_id=start_id, count=count
+    )
+    jobs = _decode_entries(entries)
+    if jobs:
+        LOG.warning(f"♻️ Reclaimed {len(jobs)} stale job(s) from {key}")
+    return jobs, next_id.decode() if isinstance(next_id, bytes) else next_id
+
+
+def defer_job(job_type: str, group: str, consumer: str, entry_id: str):
+    """Leaves a job pending for redelivery after QUEUE_CLAIM_IDLE_MS without
+    spending one of its QUEUE_MAX_DELIVERIES, for failures that are not the
+    job's fault (an LLM circuit that is open)."""
+    key = stream_key(job_type)
+    pending = r.xpending_range(key, group, min=entry_id, max=entry_id, count=1)
+    if pending:
+        r.xclaim(key, group, consumer, 0, [entry_id],
+                 retrycount=max(0, pending[0]["times_delivered"] - 1), justid=True)
+
+
+def trim_stream(job_type: str):
+    """Drops entries every consumer group has already read and acknowledged."""
+    key = stream_key(job_type)
+    safe_id = None
+    for group in r.xinfo_groups(key):
+        candidates = [group["last-delivered-id"]]
+        if group["pending"]:
+            candidates.append(r.xpending(key, group["name"])["min"])
+        for candidate in candidates:
+            candidate = candidate.decode() if isinstance(candidate, bytes) else candidate
+            ms, seq = (int(x) for x in candidate.split("-"))
+            if safe_id is None or (ms, seq) < safe_id:
+                safe_id = (ms, seq)
+    if safe_id is not None:
+        r.xtrim(key, minid=f"{safe_id[0]}-{safe_id[1]}", approximate=True)
+
+
+def _id_age_seconds(entry_id) -> float:
+    entry_id = entry_id.decode() if isinstance(entry_id, bytes) else entry_id
+    return max(0.0, time.time() - int(entry_id.split("-")[0]) / 1000)
+
+
+def queue_depth(job_type: str, group: str) -> dict:
+    """Backlog of a stage: entries not yet delivered (lag), pending ones and
+    how many of those are stale (idle for QUEUE_CLAIM_IDLE_MS, i.e. held by a
+    dead consumer or failing), how many the group has read so far (Redis 7+)
+    and the age of the oldest entry not yet delivered."""
+    key = stream_key(job_type)
+    try:
+        groups = r.xinfo_groups(key)
+    except redis.exceptions.ResponseError:  # stream does not exist yet
+        return {"lag": 0, "pending": 0, "stale": 0, "entries_read": None, "oldest_age": 0.0}
+
+    for info in groups:
+        name = info["name"].decode() if isinstance(info["name"], bytes) else info["name"]
+        if name != group:
+            continue
+        stale = 0
+        if info["pending"]:
+            stale = len(r.xpending_range(key, group, min="-", max="+", count=min(info["pending"], 10000),
+                                         idle=settings.QUEUE_CLAIM_IDLE_MS))
+        last_id = info["last-delivered-id"]
+        last_id = last_id.decode() if isinstance(last_id, bytes) else last_id
+        undelivered = r.xrange(key, min=f"({last_id}", max="+", count=1)
+        lag = info.get("lag")
+        if lag is None:
+            lag = len(r.xrange(key, min=f"({last_id}", max="+", count=10000))
+        return {
+            "lag": lag,
+            "pending": info["pending"],
+            "stale": stale,
+            "entries_read": info.get("entries-read"),
+            "oldest_age": _id_age_seconds(undelivered[0][0]) if undelivered else 0.0,
+        }
+    first = r.xrange(key, count=1)
+    return {
+        "lag": r.xlen(key),
+        "pending": 0,
+        "stale": 0,
+        "entries_read": 0,
+        "oldest_age": _id_age_seconds(first[0][0]) if first else 0.0,
+    }
+
+
+# --- asyncio variants used by workers/runtime.py ---------------------------
+
+async def aenqueue_job(job_type: str, data: dict):
+    await ar.xadd(
+        stream_key(job_type),
+        {"data": json.dumps(data)},
+        maxlen=settings.QUEUE_STREAM_MAXLEN,
+        approximate=True,
+    )
+
+
+async def aread_jobs(job_type: str, group: str, consumer: str, count: int = 1, block_ms: int = None):
+    result = await ar.xreadgroup(
+        group,
+        consumer,
+        {stream_key(job_type): ">"},
+        count=count,
+        block=settings.QUEUE_BLOCK_MS if block_ms is None else block_ms,
+    )
+    if not result:
+        return []
+    return _decode_entries(result[0][1])
+
+
+async def aack_jobs(job_type: str, group: str, entry_ids: list):
+    if entry_ids:
+        await ar.xack(stream_key(job_type), group, *entry_ids)
+
+
+def consume(job_type: str, group: str, handler, batch_size: int = 1, batch_handler: bool = False,
+            linger_ms: int = 0):
+    """Blocking consume loop shared by the workers.
+
+    `handler` gets one job's data (or, with batch_handler=True, a list of
+    up to `batch_size` jobs gathered for at most `linger_ms`). Jobs are
+    acknowledged only after the handler returns; if it raises they stay
+    pending and are retried via reclaim_stale(). A batch handler can also
+    return the jobs of its list that failed, leaving only those pending.
+    An exception with a `retry_after` (CircuitOpenError) defers the job
+    instead (see defer_job) and pauses reading for that many seconds.
+    """
+    ensure_group(job_type, group)
+    consumer = consumer_name()
+    last_maintenance, reclaim_from = 0.0, "0-0"
+    LOG.info(f"Consuming {stream_key(job_type)} as {group}/{consumer}")
+
+    while True:
+        try:
+            jobs = []
+            if reclaim_from != "0-0" or time.monotonic() - last_maintenance >= settings.QUEUE_MAINTENANCE_INTERVAL:
+                # Keeps reclaiming on every pass until the pending list has been scanned
+                jobs, reclaim_from = reclaim_stale(job_type, group, consumer, batch_size, reclaim_from)
+                if reclaim_from == "0-0":
+                    trim_stream(job_type)
+                    last_maintenance = time.monotonic()
+            if not jobs:
+                jobs = read_batch(job_type, group, consumer, batch_size, linger_ms)
+            if not jobs:
+                continue
+
+            if batch_handler:
+                failed = handler([data for _, data in jobs]) or []
+                ack_jobs(job_type, group, [
+                    entry_id for entry_id, data in jobs if not any(data is job for job in failed)
+                ])
+                if failed:
+                    LOG.error(f"❌ {len(failed)} of {len(jobs)} job(s) on {stream_key(job_type)} failed, left pending")
+                continue
+
+            for entry_id, data in jobs:
+                try:
+                    handler(data)
+                    ack_jobs(job_type, group, [entry_id])
+                except Exception as e:
+                    retry_after = getattr(e, "retry_after", None)
+                    if retry_after is None:
+                        LOG.error(f"❌ Job {entry_id} on {stream_key(job_type)} failed, left pending: {e}")
+                        continue
+                    defer_job(job_type, group, consumer, entry_id)
+                    LOG.warning(f"⏸️ Job {entry_id} on {stream_key(job_type)} deferred, "
+                                f"pausing for {retry_after:.0f}s: {e}")
+                    time.sleep(retry_after)
+
+        except KeyboardInterrupt:
+            raise
+        except redis.exceptions.ConnectionError as e:
+            LOG.error(f"❌ Redis connection error: {e}")
+            time.sleep(1)
+        except Exception as e:
+            LOG.error(f"❌ Error in consume loop for {stream_key(job_type)}: {e}")
+            time.sleep(1)
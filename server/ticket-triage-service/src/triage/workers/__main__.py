@@ -0,0 +1,4 @@
+"""Run the worker supervisor: python -m triage.workers (from src/)."""
+from .supervisor import main
+
+main()
@@ -1,15 +1,32 @@
-import redis
+import asyncio
 import json
 import logging
 import sys
+import time
 from pathlib import Path
 import requests
 
 sys.path.append(str(Path(__file__).parent.parent.parent))
 
-from src.triage.llm.classifier import classify_ticket
-from src.triage.db.database import get_db
-from src.triage.utils.queue import enqueue_job
+from src.triage.llm.classifier import (
+    classify_ticket, aclassify_ticket, classify_batch, aclassify_batch,
+    fallback_classification, usage_report, format_usage_report, cache
+)
+from src.triage.llm.provider import provider
+from src.triage.llm.prompts import prepare_ticket, prompt_report, format_prompt_report
+from src.triage.llm.combined import classify_and_reply, aclassify_and_reply
+from src.triage.llm.reply import build_enriched
+from src.triage.llm.storm import StormIndex
+from src.triage.llm.knn import KnnClassifier
+from src.triage.db.database import get_db, get_async_db
+from src.triage.db.indexes import ensure_indexes
+from src.triage.utils.queue import enqueue_job, aenqueue_job, consume
+from src.triage.workers.runtime import run_stage, llm_slot, http_client, MicroBatcher
+from src.triage.workers.rag_worker import (
+    send_to_express_api as send_reply_to_express, asend_to_express_api as asend_reply_to_express
+)
+from src.triage.retriever.rag import retrieve_docs
+from src.triage.retriever.encoder import warm, encoder_report
 from src.triage.config import settings
 
 logging.basicConfig(
@@ -18,10 +35,140 @@ logging.basicConfig(
 )
 LOG = logging.getLogger("classify_worker")
 
-r = redis.from_url(settings.REDIS_URL)
 db = get_db()
 
 EXPRESS_API_URL = "http://localhost:10000/api/ticket"
+USAGE_LOG_INTERVAL = 60
+last_usage_log = 0.0
+
+storm = StormIndex(
+    threshold=settings.STORM_THRESHOLD,
+    window_seconds=settings.STORM_WINDOW_SECONDS,
+    num_perm=settings.STORM_NUM_PERM,
+    bands=settings.STORM_BANDS,
+    max_leaders=settings.STORM_MAX_LEADERS
+) if settings.STORM_ENABLED else None
+
+knn = KnnClassifier(db) if settings.KNN_ENABLED else None
+
+def build_express_payload(ticket_data):
+    return {
+        "ticketId": ticket_data["ticketId"],
+        "department": ticket_data["department"],
+        "type": ticket_data["type"],
+        "description": ticket_data["description"],
+        "title": ticket_data.get("title", "Email Ticket"),
+        "priority": ticket_data["priority"],
+        "status": ticket_data.get("status", "open"),
+        "useremail": ticket_data.get("createdBy"),
+        "assignedemail": ticket_data.get("assignedTo")
+    }
+
+def build_updated_ticket(ticket, classification):
+    return {
+        "ticketId": ticket["ticketId"],
+        "department": classification.department,
+        "type": classification.type,
+        "priority": classification.priority,
+        "description": ticket["description"],
+        "title": ticket.get("title"),
+        "status": ticket.get("status", "open"),
+        "createdBy": ticket.get("createdBy"),
+        "assignedTo": ticket.get("assignedTo")
+    }
+
+def classifier_input(ticket):
+    """The fields the classifiers see, with the description cleaned and
+    budgeted once (prepare_ticket) for the kNN, cache and LLM lookups alike."""
+    return prepare_ticket({
+        "ticketId": ticket["ticketId"],
+        "title": ticket.get("title"),
+        "description": ticket["description"],
+        "createdBy": ticket.get("createdBy"),
+        "priority": ticket.get("priority")
+    })
+
+def storm_text(ticket):
+    return f"{ticket.get('title') or ''}\n{ticket['description']}"
+
+def cluster_leader(ticket):
+    """Leader whose classification this ticket can inherit, or None if it
+    has to be classified (it leads a new cluster or clustering is off)."""
+    if storm is None:
+        return None
+    return storm.assign(ticket["ticketId"], storm_text(ticket))
+
+def publish_leader(ticket_id, classification):
+    # A fallback means the LLM call failed; followers should not inherit it
+    if classification == fallback_classification():
+        storm.forget(ticket_id)
+    else:
+        storm.resolve(ticket_id, classification)
+
+def local_prediction(ticket_input):
+    """kNN prediction for the ticket and whether it is confident enough to skip the LLM."""
+    if knn is None:
+        return None, False
+    try:
+        prediction = knn.predict(ticket_input)
+    except Exception as e:
+        LOG.error(f"❌ kNN prediction failed for {ticket_input['ticketId']}: {e}")
+        prediction = None
+    return prediction, knn.accept(prediction)
+
+def record_llm_result(prediction, classification):
+    if knn and classification != fallback_classification():
+        knn.record_llm(prediction, classification)
+
+def rag_query(ticket):
+    return f"{ticket.get('title', '')} {ticket['description']}"
+
+def combined_triage(ticket_input):
+    """Classification plus, when the LLM had to be called, the enriched reply
+    from the same call. A cache hit or a failed combined call returns no reply
+    and the ticket goes through the RAG stage as usual."""
+    cached = cache.get(ticket_input) if cache else None
+    if cached:
+        return cached, None
+    docs = retrieve_docs(rag_query(ticket_input), top_k=3)
+    result = classify_and_reply(ticket_input, docs)
+    if result is None:
+        return classify_ticket(ticket_input), None
+    classification, reply = result
+    return classification, build_enriched(ticket_input["ticketId"], {"data": classification.dict()}, reply, docs)
+
+async def acombined_triage(ticket_input):
+    cached = await asyncio.to_thread(cache.get, ticket_input) if cache else None
+    if cached:
+        return cached, None
+    docs = await asyncio.to_thread(retrieve_docs, rag_query(ticket_input), 3)
+    async with llm_slot():
+        result = await aclassify_and_reply(ticket_input, docs)
+        if result is None:
+            return await aclassify_ticket(ticket_input), None
+    classification, reply = result
+    return classification, build_enriched(ticket_input["ticketId"], {"data": classification.dict()}, reply, docs)
+
+def classification_doc(ticket_id, classification, leader_id=None, source=None):
+    doc = {"ticketId": ticket_id, "data": classification.dict()}
+    if leader_id:
+        doc["clusterId"] = leader_id
+    if source:
+        doc["source"] = source
+    return doc
+
+def ticket_update(classification, leader_id=None):
+    fields = {
+        "department": classification.department,
+        "type": classification.type,
+        "priority": classification.priority
+    }
+    if leader_id:
+        fields["clusterId"] = leader_id
+    return {"$set": fields}
+
+def leader_update(leader_id):
+    return {"$set": {"clusterId": leader_id}, "$inc": {"clusterSize": 1}}
 
 def send_to_express_api(ticket_data):
    
@@ -30,17 +177,7 @@ def send_to_express_api(ticket_data):
     LOG.info("=" * 80)
     
     try:
-        payload = {
-            "ticketId": ticket_data["ticketId"],
-            "department": ticket_data["department"],
-            "type": ticket_data["type"],
-            "description": ticket_data["description"],
-            "title": ticket_data.get("title", "Email Ticket"),
-            "priority": ticket_data["priority"],
-            "status": ticket_data.get("status", "open"),
-            "useremail": ticket_data.get("createdBy"),
-            "assignedemail": ticket_data.get("assignedTo")
-        }
+        payload = build_express_payload(ticket_data)
         
         LOG.info(f"📤 Sending ticket {payload['ticketId']} to Express API at {EXPRESS_API_URL}")
         LOG.info(f"📦 Full Payload: {json.dumps(payload, indent=2)}")
@@ -68,6 +205,57 @@ def send_to_express_api(ticket_data):
         traceback.print_exc()
         return False
 
+def inherited_classification(ticket_id, leader):
+    if leader is None or leader.classification is None:
+        return None
+    LOG.info(f"🌪️ {ticket_id} joins cluster {leader.ticket_id}, inheriting its classification")
+    return leader.classification
+
+def finish_classification(ticket, classification, leader_id=None, source=None, enriched=None):
+    """Stores the classification, updates the ticket, syncs it to Express and
+    queues RAG, or posts and stores `enriched` when combined triage already
+    produced the reply."""
+    ticket_id = ticket["ticketId"]
+    if leader_id:
+        db.tickets.update_one({"ticketId": leader_id}, leader_update(leader_id))
+
+    db.classifications.replace_one(
+        {"ticketId": ticket_id},
+        classification_doc(ticket_id, classification, leader_id, source),
+        upsert=True
+    )
+    
+    LOG.info(f"✅ Classified: {classification.department}/{classification.type} Priority: {classification.priority}")
+    
+    updated_ticket_data = build_updated_ticket(ticket, classification)
+    
+    db.tickets.update_one({"ticketId": ticket_id}, ticket_update(classification, leader_id))
+    LOG.info(f"💾 Updated ticket in MongoDB")
+    
+    LOG.info(f"\n{'*'*80}")
+    LOG.info(f"🚀 NOW CALLING send_to_express_api() FOR {ticket_id}")
+    LOG.info(f"{'*'*80}\n")
+    
+    api_success = send_to_express_api(updated_ticket_data)
+    
+    LOG.info(f"\n{'*'*80}")
+    LOG.info(f"📊 send_to_express_api() RETURNED: {api_success}")
+    LOG.info(f"{'*'*80}\n")
+    
+    if api_success and enriched:
+        if not send_reply_to_express(enriched):
+            raise RuntimeError(f"Failed to post the reply for {ticket_id} to Express API")
+        db.enriched_outputs.replace_one(
+            {"ticketId": ticket_id}, {"ticketId": ticket_id, "data": enriched}, upsert=True
+        )
+        LOG.info(f"✅ Saved combined reply for {ticket_id}, skipping RAG")
+    elif api_success:
+        LOG.info(f"✅ Enqueuing RAG job for {ticket_id}")
+        enqueue_job("rag", {"ticket_id": ticket_id})
+    else:
+        # Raised so the job stays pending and is retried; the writes above are upserts
+        raise RuntimeError(f"Failed to sync {ticket_id} with Express API")
+
 def process_classification(job_data):
     ticket_id = job_data["ticket_id"]
     LOG.info(f"\n{'='*80}")
@@ -82,84 +270,256 @@ def process_classification(job_data):
         
         LOG.info(f"📋 Found ticket: {ticket.get('title', 'No title')}")
         
-        classification = classify_ticket({
-            "ticketId": ticket["ticketId"],
-            "title": ticket.get("title"),
-            "description": ticket["description"],
-            "createdBy": ticket.get("createdBy")
-        })
-        
-        db.classifications.insert_one({
-            "ticketId": ticket_id,
-            "data": classification.dict()
-        })
-        
-        LOG.info(f"✅ Classified: {classification.department}/{classification.type} Priority: {classification.priority}")
+        leader = cluster_leader(ticket)
+        classification = inherited_classification(ticket_id, leader)
+        leader_id = leader.ticket_id if classification else None
+        source = enriched = None
+        if classification is None:
+            try:
+                ticket_input = classifier_input(ticket)
+                prediction, use_local = local_prediction(ticket_input)
+                if use_local:
+                    classification, source = prediction.classification, "knn"
+                    LOG.info(f"⚡ {ticket_id} classified locally (kNN confidence {prediction.confidence:.2f})")
+                else:
+                    if settings.COMBINED_TRIAGE:
+                        classification, enriched = combined_triage(ticket_input)
+                    else:
+                        classification = classify_ticket(ticket_input)
+                    record_llm_result(prediction, classification)
+            except Exception:
+                if storm and leader is None:
+                    storm.forget(ticket_id)
+                raise
+            if storm and leader is None:
+                publish_leader(ticket_id, classification)
         
-        updated_ticket_data = {
-            "ticketId": ticket["ticketId"],
-            "department": classification.department,
-            "type": classification.type,
-            "priority": classification.priority,
-            "description": ticket["description"],
-            "title": ticket.get("title"),
-            "status": ticket.get("status", "open"),
-            "createdBy": ticket.get("createdBy"),
-            "assignedTo": ticket.get("assignedTo")
-        }
+        finish_classification(ticket, classification, leader_id, source, enriched)
         
-        db.tickets.update_one(
+    except Exception as e:
+        LOG.error(f"❌ Classification failed for {ticket_id}: {e}")
+        import traceback
+        traceback.print_exc()
+        raise
+
+def process_classifications(batch):
+    """Micro-batched process_classification: tickets that neither hit the
+    cache nor inherit from a storm leader share batched LLM calls. Returns
+    the jobs that failed, which consume() leaves pending for a retry."""
+    ticket_ids = list(dict.fromkeys(job["ticket_id"] for job in batch))
+    tickets = {t["ticketId"]: t for t in db.tickets.find({"ticketId": {"$in": ticket_ids}})}
+    for ticket_id in ticket_ids:
+        if ticket_id not in tickets:
+            LOG.error(f"❌ Ticket {ticket_id} not found in MongoDB")
+    ticket_ids = [ticket_id for ticket_id in ticket_ids if ticket_id in tickets]
+
+    leaders = {}
+    to_classify = []
+    for ticket_id in ticket_ids:
+        leader = cluster_leader(tickets[ticket_id])
+        if leader is None:
+            to_classify.append(ticket_id)
+        else:
+            leaders[ticket_id] = leader
+
+    try:
+        classified, predictions = {}, {}
+        inputs = {ticket_id: classifier_input(tickets[ticket_id]) for ticket_id in to_classify}
+        for ticket_id in to_classify:
+            prediction, use_local = local_prediction(inputs[ticket_id])
+            if use_local:
+                classified[ticket_id] = prediction.classification
+            else:
+                predictions[ticket_id] = prediction
+        classified.update(classify_batch([inputs[ticket_id] for ticket_id in predictions]))
+    except Exception:
+        if storm:
+            for ticket_id in to_classify:
+                storm.forget(ticket_id)
+        raise
+    for ticket_id, prediction in predictions.items():
+        record_llm_result(prediction, classified[ticket_id])
+    if storm:
+        for ticket_id in to_classify:
+            publish_leader(ticket_id, classified[ticket_id])
+    LOG.info(f"🧮 Classified {len(predictions)} of {len(ticket_ids)} ticket(s) with the LLM, "
+             f"{len(to_classify) - len(predictions)} locally, {len(leaders)} matched a storm cluster")
+
+    failed = set()
+    for ticket_id in ticket_ids:
+        ticket = tickets[ticket_id]
+        try:
+            leader = leaders.get(ticket_id)
+            classification = inherited_classification(ticket_id, leader)
+            leader_id = leader.ticket_id if classification else None
+            source = "knn" if ticket_id in classified and ticket_id not in predictions else None
+            if classification is None:
+                classification = classified.get(ticket_id) or classify_ticket(classifier_input(ticket))
+            finish_classification(ticket, classification, leader_id, source)
+        except Exception as e:
+            LOG.error(f"❌ Classification failed for {ticket_id}: {e}")
+            failed.add(ticket_id)
+    log_usage()
+    return [job for job in batch if job["ticket_id"] in failed]
+
+def log_usage():
+    global last_usage_log
+    if time.monotonic() - last_usage_log < USAGE_LOG_INTERVAL:
+        return
+    last_usage_log = time.monotonic()
+    for line in format_usage_report(usage_report()):
+        LOG.info(f"📉 {line}")
+    for line in format_prompt_report(prompt_report()):
+        LOG.info(f"🧾 {line}")
+    stats = provider.stats()
+    LOG.info(f"🛡️ LLM calls: {stats['calls']}, {stats['hedges']} hedged ({stats['hedge_wins']} won by the backup), "
+             f"{stats['retries']} retried, {stats['timeouts']} timed out, {stats['rejected']} rejected by an open "
+             f"circuit{' (' + ', '.join(stats['open_circuits']) + ')' if stats['open_circuits'] else ''}")
+    if knn:
+        stats = knn.stats()
+        agreement = ", ".join(
+            f"{kind} agreement {stats[kind + '_agreement']:.0%}"
+            for kind in ("audit", "shadow") if stats[kind + "_agreement"] is not None
+        ) or "no agreement samples yet"
+        LOG.info(f"⚡ kNN fast path: {stats['fast_path']}/{stats['lookups']} ({stats['fast_path_rate']:.0%}), "
+                 f"{stats['examples']} examples, {agreement}")
+    stats = encoder_report()
+    if stats["queries"]:
+        LOG.info(f"🧠 Query embeddings: {stats['queries']}, {stats['cache_hit_rate']:.0%} from cache, "
+                 f"{stats['batches']} model call(s) averaging {stats['avg_batch']:.1f} queries")
+
+async def asend_to_express_api(ticket_data):
+    payload = build_express_payload(ticket_data)
+    try:
+        response = await http_client().post(EXPRESS_API_URL, json=payload)
+        if response.status_code == 201:
+            LOG.info(f"✅ Ticket {payload['ticketId']} created in Express API")
+            return True
+        LOG.error(f"❌ Express API rejected {payload['ticketId']}. Status: {response.status_code}")
+        return False
+    except Exception as e:
+        LOG.error(f"❌ EXCEPTION in asend_to_express_api: {e}")
+        return False
+
+async def aprocess_classification(job_data):
+    """asyncio counterpart of process_classification for the async runtime."""
+    ticket_id = job_data["ticket_id"]
+    adb = get_async_db()
+    try:
+        ticket = await adb.tickets.find_one({"ticketId": ticket_id})
+        if not ticket:
+            LOG.error(f"❌ Ticket {ticket_id} not found in MongoDB")
+            return
+
+        leader = cluster_leader(ticket)
+        if leader is not None and not leader.done.is_set():
+            # The leader is still in flight on this process; wait rather than call the LLM again
+            await asyncio.to_thread(leader.done.wait, settings.STORM_FOLLOWER_WAIT)
+
+        classification = inherited_classification(ticket_id, leader)
+        leader_id = leader.ticket_id if classification else None
+        source = enriched = None
+        if leader_id:
+            await adb.tickets.update_one({"ticketId": leader_id}, leader_update(leader_id))
+        else:
+            try:
+                ticket_input = classifier_input(ticket)
+                prediction, use_local = await asyncio.to_thread(local_prediction, ticket_input)
+                if use_local:
+                    classification, source = prediction.classification, "knn"
+                    LOG.info(f"⚡ {ticket_id} classified locally (kNN confidence {prediction.confidence:.2f})")
+                elif settings.COMBINED_TRIAGE:
+                    classification, enriched = await acombined_triage(ticket_input)
+                elif settings.CLASSIFY_BATCH_SIZE > 1:
+                    classification = await classify_batcher.submit(ticket_input)
+                else:
+                    async with llm_slot():
+                        classification = await aclassify_ticket(ticket_input)
+                if not use_local:
+                    record_llm_result(prediction, classification)
+            except BaseException:
+                if storm and leader is None:
+                    storm.forget(ticket_id)
+                raise
+            if storm and leader is None:
+                publish_leader(ticket_id, classification)
+
+        await adb.classifications.replace_one(
             {"ticketId": ticket_id},
-            {"$set": {
-                "department": classification.department,
-                "type": classification.type,
-                "priority": classification.priority
-            }}
+            classification_doc(ticket_id, classification, leader_id, source),
+            upsert=True
         )
-        LOG.info(f"💾 Updated ticket in MongoDB")
-        
-        LOG.info(f"\n{'*'*80}")
-        LOG.info(f"🚀 NOW CALLING send_to_express_api() FOR {ticket_id}")
-        LOG.info(f"{'*'*80}\n")
-        
-        api_success = send_to_express_api(updated_ticket_data)
-        
-        LOG.info(f"\n{'*'*80}")
-        LOG.info(f"📊 send_to_express_api() RETURNED: {api_success}")
-        LOG.info(f"{'*'*80}\n")
-        
-        if api_success:
-            LOG.info(f"✅ Enqueuing RAG job for {ticket_id}")
-            enqueue_job("rag", {"ticket_id": ticket_id})
+        await adb.tickets.update_one({"ticketId": ticket_id}, ticket_update(classification, leader_id))
+        LOG.info(f"✅ [{ticket_id}] Classified: {classification.department}/{classification.type} "
+                 f"Priority: {classification.priority}")
+
+        if not await asend_to_express_api(build_updated_ticket(ticket, classification)):
+            raise RuntimeError(f"Failed to sync {ticket_id} with Express API")
+        if enriched:
+            if not await asend_reply_to_express(enriched):
+                raise RuntimeError(f"Failed to post the reply for {ticket_id} to Express API")
+            await adb.enriched_outputs.replace_one(
+                {"ticketId": ticket_id}, {"ticketId": ticket_id, "data": enriched}, upsert=True
+            )
+            LOG.info(f"✅ [{ticket_id}] Saved combined reply, skipping RAG")
         else:
-            LOG.warning(f"⚠️ Failed to sync {ticket_id} with Express API")
-        
+            await aenqueue_job("rag", {"ticket_id": ticket_id})
+
     except Exception as e:
         LOG.error(f"❌ Classification failed for {ticket_id}: {e}")
-        import traceback
-        traceback.print_exc()
+        raise
+    finally:
+        log_usage()
+
+async def _aclassify_batch_limited(tickets):
+    async with llm_slot():
+        return await aclassify_batch(tickets)
+
+classify_batcher = MicroBatcher(
+    _aclassify_batch_limited,
+    key=lambda ticket: ticket["ticketId"],
+    max_size=settings.CLASSIFY_BATCH_SIZE,
+    linger_ms=settings.CLASSIFY_BATCH_LINGER_MS
+)
+
+CONSUMER_GROUP = "classify_workers"
 
 def run():
     LOG.info("🔍 Classify worker started, waiting for jobs...")
     LOG.info(f"📍 Express API URL: {EXPRESS_API_URL}")
-    
-    while True:
-        try:
-            result = r.blpop(["classify_queue"], timeout=60)
-            if result is None:
-                continue
-            
-            _, raw = result 
-            job_data = json.loads(raw)
-            process_classification(job_data)
-            
-        except KeyboardInterrupt:
-            LOG.info("\n👋 Classify worker stopped")
-            break
-        except Exception as e:
-            LOG.error(f"❌ Worker error: {e}")
-            import traceback
-            traceback.print_exc()
+    ensure_indexes()
+    if settings.EMBEDDING_WARM_START and (knn or settings.COMBINED_TRIAGE):
+        warm()
+    if knn:
+        knn.start()
+
+    try:
+        # Combined triage makes one call per ticket, so batching is skipped
+        if settings.CLASSIFY_BATCH_SIZE > 1 and not settings.COMBINED_TRIAGE:
+            consume(
+                "classify",
+                CONSUMER_GROUP,
+                process_classifications,
+                batch_size=settings.CLASSIFY_BATCH_SIZE,
+                batch_handler=True,
+                linger_ms=settings.CLASSIFY_BATCH_LINGER_MS,
+            )
+        else:
+            consume("classify", CONSUMER_GROUP, process_classification)
+    except KeyboardInterrupt:
+        LOG.info("\n👋 Classify worker stopped")
+
+def run_async():
+    LOG.info(f"🔍 Classify worker started (async, {settings.CLASSIFY_CONCURRENCY} in flight)")
+    ensure_indexes()
+    if settings.EMBEDDING_WARM_START and (knn or settings.COMBINED_TRIAGE):
+        warm()
+    if knn:
+        knn.start()
+    asyncio.run(run_stage("classify", CONSUMER_GROUP, aprocess_classification, settings.CLASSIFY_CONCURRENCY))
 
 if __name__ == "__main__":
-    run()
+    if settings.WORKER_RUNTIME == "async":
+        run_async()
+    else:
+        run()
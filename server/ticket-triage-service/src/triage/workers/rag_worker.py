@@ -1,15 +1,22 @@
-import redis
-import json
+import asyncio
 import logging
 import sys
+import time
 from pathlib import Path
 import requests
 
 sys.path.append(str(Path(__file__).parent.parent.parent))
 
 from src.triage.retriever.rag import retrieve_docs
-from src.triage.llm.classifier import client
-from src.triage.db.database import get_db
+from src.triage.retriever.encoder import warm
+from src.triage.llm.provider import provider, CircuitOpenError, TIMEOUT_ERRORS
+from src.triage.llm.ratelimit import limiter
+from src.triage.llm.reply import build_rag_context, build_rag_prompt, rag_request, build_enriched
+from src.triage.llm.prompts import record_prompt
+from src.triage.db.database import get_db, get_async_db
+from src.triage.db.indexes import ensure_indexes
+from src.triage.utils.queue import consume
+from src.triage.workers.runtime import run_stage, llm_slot, http_client
 from src.triage.config import settings
 
 logging.basicConfig(
@@ -18,7 +25,6 @@ logging.basicConfig(
 )
 LOG = logging.getLogger("rag_worker")
 
-r = redis.from_url(settings.REDIS_URL)
 db = get_db()
 
 EXPRESS_API_URL = "http://localhost:10000/api/messages"
@@ -47,6 +53,86 @@ def send_to_express_api(ticket_data):
         LOG.error(f"❌ Error sending to Express API: {e}")
         return False
 
+def start_stream_message(ticket_id):
+    """Opens an empty assistant message for a streamed reply. Returns its id, or None."""
+    try:
+        response = requests.post(f"{EXPRESS_API_URL}/{ticket_id}/messagesAI/stream", json={}, timeout=10)
+        if response.status_code == 201:
+            return response.json().get("_id")
+        LOG.error(f"❌ Failed to open streamed message for {ticket_id}. Status: {response.status_code}")
+    except Exception as e:
+        LOG.error(f"❌ Error opening streamed message for {ticket_id}: {e}")
+    return None
+
+def update_stream_message(ticket_id, message_id, content, done=False):
+    try:
+        response = requests.patch(
+            f"{EXPRESS_API_URL}/{ticket_id}/messagesAI/{message_id}",
+            json={"content": content, "done": done},
+            timeout=10
+        )
+        return response.status_code == 200
+    except Exception as e:
+        LOG.error(f"❌ Error updating streamed message for {ticket_id}: {e}")
+        return False
+
+def delete_stream_message(ticket_id, message_id):
+    try:
+        response = requests.delete(f"{EXPRESS_API_URL}/{ticket_id}/messagesAI/{message_id}", timeout=10)
+        return response.status_code == 200
+    except Exception as e:
+        LOG.error(f"❌ Error deleting streamed message for {ticket_id}: {e}")
+        return False
+
+def discard_stream_message(ticket_id, message_id, content):
+    """After a failed generation: removes the message so the retry's reply is
+    the only one, or at least closes it so it doesn't look in progress."""
+    if not delete_stream_message(ticket_id, message_id):
+        update_stream_message(ticket_id, message_id, content, done=True)
+
+def stream_metrics(ticket_id, started, first_token_at):
+    now = time.perf_counter()
+    metrics = {
+        "ttft_ms": round((first_token_at - started) * 1000) if first_token_at else None,
+        "total_ms": round((now - started) * 1000)
+    }
+    LOG.info(f"⏱️ [{ticket_id}] First token after {metrics['ttft_ms']} ms, reply complete after {metrics['total_ms']} ms")
+    return metrics
+
+def stream_reply(ticket_id, request, priority):
+    """Generates the reply with a streamed completion, pushing the text so far
+    into one chat message at most every RAG_STREAM_FLUSH_MS. Returns the
+    final text and its timings (time to first token, total) in ms."""
+    started = time.perf_counter()
+    stream = limiter.call(provider.complete, {**request, "stream": True}, priority)
+    message_id = start_stream_message(ticket_id)
+    parts, first_token_at, last_flush = [], None, 0.0
+    try:
+        for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if not delta:
+                continue
+            now = time.perf_counter()
+            first_token_at = first_token_at or now
+            parts.append(delta)
+            if message_id and (now - last_flush) * 1000 >= settings.RAG_STREAM_FLUSH_MS:
+                update_stream_message(ticket_id, message_id, "".join(parts))
+                last_flush = now
+
+        assistant_reply = "".join(parts) or "No reply generated"
+        if message_id:
+            posted = update_stream_message(ticket_id, message_id, assistant_reply, done=True)
+        else:
+            posted = send_to_express_api({"ticketId": ticket_id, "assistant_reply": assistant_reply})
+        if not posted:
+            raise RuntimeError(f"Failed to post the reply for {ticket_id} to Express API")
+    except Exception:
+        # The job is retried, which opens a new message
+        if message_id:
+            discard_stream_message(ticket_id, message_id, "".join(parts))
+        raise
+    return assistant_reply, stream_metrics(ticket_id, started, first_token_at)
+
 def process_rag(job_data):
     ticket_id = job_data["ticket_id"]
     LOG.info(f"Processing ticket: {ticket_id}")
@@ -61,72 +147,176 @@ def process_rag(job_data):
 
         query_text = f"{ticket.get('title', '')} {ticket['description']}"
         docs = retrieve_docs(query_text, top_k=3)
-        context = "\n\n".join([f"[{d['doc_id']}] {d['text']}" for d in docs]) if docs else "No specific documentation found."
-
-        prompt = f"""Ticket: {ticket.get('title', '')}
-Description: {ticket['description']}
-Category: {classification['data'].get('department')}
-
-Context from knowledge base:
-{context}
-
-Provide a helpful solution in plain text, structured for a chat window without markdown support. Use simple formatting like line breaks, dashes, or numbered lists for clarity. The response should include:
-1. Immediate Acknowledgement: A brief, professional acknowledgment of the issue.
-2. Required Information: A list of details needed to process the request, with each item including what it is, why it's needed, and an example.
-3. Next Steps: A brief note on the expected timeline or process (e.g., warranty check, repair/replacement timeline).
-Exclude unrelated details (e.g., redis credentials).
-
-Example format:
-1. Required Information:
-- [Item 1]: [Why we need it]. Example: [Example]
-- [Item 2]: [Why we need it]. Example: [Example]
-
-3. Next Steps:
-[Describe next steps, e.g., warranty check, expected timeline]."""
-
-        response = client.chat.completions.create(
-            model="openai/gpt-oss-120b",
-            messages=[
-                {"role": "system", "content": "You are an IT helpdesk assistant. Provide clear, actionable solutions in plain text for a chat window."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.3,
-            max_completion_tokens=500
+        request = rag_request(build_rag_prompt(ticket, classification, build_rag_context(docs)))
+        record_prompt("rag", request, ticket_id)
+
+        priority = classification["data"].get("priority")
+        output = {"ticketId": ticket_id}
+
+        if settings.RAG_STREAMING:
+            assistant_reply, output["metrics"] = stream_reply(ticket_id, request, priority)
+            enriched = build_enriched(ticket_id, classification, assistant_reply, docs)
+        else:
+            response = limiter.call(provider.complete, request, priority)
+            assistant_reply = response.choices[0].message.content or "No reply generated"
+            enriched = build_enriched(ticket_id, classification, assistant_reply, docs)
+            if not send_to_express_api(enriched):
+                raise RuntimeError(f"Failed to post the reply for {ticket_id} to Express API")
+
+        output["data"] = enriched
+        db.enriched_outputs.replace_one({"ticketId": ticket_id}, output, upsert=True)
+        LOG.info(f"[{ticket_id}] Successfully processed and saved enriched output")
+
+    except (CircuitOpenError, *TIMEOUT_ERRORS) as e:
+        # Not acked: redelivered after QUEUE_CLAIM_IDLE_MS, and an open circuit
+        # also pauses this worker (see consume) instead of using up the job's retries
+        LOG.warning(f"[{ticket_id}] LLM unavailable, leaving job pending: {e}")
+        raise
+    except Exception as e:
+        # Re-raised so the job stays pending and is retried instead of acked
+        LOG.error(f"[{ticket_id}] Error during RAG processing: {e}")
+        raise
+
+async def asend_to_express_api(ticket_data):
+    url = f"{EXPRESS_API_URL}/{ticket_data['ticketId']}/messagesAI"
+    try:
+        response = await http_client().post(url, json={"content": ticket_data["assistant_reply"], "attachment": ""})
+        if response.status_code == 201:
+            LOG.info(f"✅ Successfully sent ticket {ticket_data['ticketId']} to Express API")
+            return True
+        LOG.error(f"❌ Failed to send ticket {ticket_data['ticketId']}. Status: {response.status_code}")
+        return False
+    except Exception as e:
+        LOG.error(f"❌ Error sending to Express API: {e}")
+        return False
+
+async def astart_stream_message(ticket_id):
+    try:
+        response = await http_client().post(f"{EXPRESS_API_URL}/{ticket_id}/messagesAI/stream", json={})
+        if response.status_code == 201:
+            return response.json().get("_id")
+        LOG.error(f"❌ Failed to open streamed message for {ticket_id}. Status: {response.status_code}")
+    except Exception as e:
+        LOG.error(f"❌ Error opening streamed message for {ticket_id}: {e}")
+    return None
+
+async def aupdate_stream_message(ticket_id, message_id, content, done=False):
+    try:
+        response = await http_client().patch(
+            f"{EXPRESS_API_URL}/{ticket_id}/messagesAI/{message_id}", json={"content": content, "done": done}
         )
+        return response.status_code == 200
+    except Exception as e:
+        LOG.error(f"❌ Error updating streamed message for {ticket_id}: {e}")
+        return False
 
-        assistant_reply = response.choices[0].message.content or "No reply generated"
-        enriched = {
-            "ticketId": ticket_id,
-            "classification": classification['data'],
-            "assistant_reply": assistant_reply,
-            "citations": [d["doc_id"] for d in docs] if docs else [],
-            "clarifying_questions": [],
-            "resolution_type": "needs_agent",
-            "automation_candidates": []
-        }
+async def adelete_stream_message(ticket_id, message_id):
+    try:
+        response = await http_client().delete(f"{EXPRESS_API_URL}/{ticket_id}/messagesAI/{message_id}")
+        return response.status_code == 200
+    except Exception as e:
+        LOG.error(f"❌ Error deleting streamed message for {ticket_id}: {e}")
+        return False
+
+async def adiscard_stream_message(ticket_id, message_id, content):
+    if not await adelete_stream_message(ticket_id, message_id):
+        await aupdate_stream_message(ticket_id, message_id, content, done=True)
+
+async def astream_reply(ticket_id, request, priority):
+    started = time.perf_counter()
+    stream = await limiter.acall(provider.acomplete, {**request, "stream": True}, priority)
+    message_id = await astart_stream_message(ticket_id)
+    parts, first_token_at, last_flush = [], None, 0.0
+    try:
+        async for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if not delta:
+                continue
+            now = time.perf_counter()
+            first_token_at = first_token_at or now
+            parts.append(delta)
+            if message_id and (now - last_flush) * 1000 >= settings.RAG_STREAM_FLUSH_MS:
+                await aupdate_stream_message(ticket_id, message_id, "".join(parts))
+                last_flush = now
 
-        send_to_express_api(enriched)
-        db.enriched_outputs.insert_one({"ticketId": ticket_id, "data": enriched})
+        assistant_reply = "".join(parts) or "No reply generated"
+        if message_id:
+            posted = await aupdate_stream_message(ticket_id, message_id, assistant_reply, done=True)
+        else:
+            posted = await asend_to_express_api({"ticketId": ticket_id, "assistant_reply": assistant_reply})
+        if not posted:
+            raise RuntimeError(f"Failed to post the reply for {ticket_id} to Express API")
+    except BaseException:
+        if message_id:
+            await adiscard_stream_message(ticket_id, message_id, "".join(parts))
+        raise
+    return assistant_reply, stream_metrics(ticket_id, started, first_token_at)
+
+async def aprocess_rag(job_data):
+    """asyncio counterpart of process_rag for the async runtime."""
+    ticket_id = job_data["ticket_id"]
+    adb = get_async_db()
+    try:
+        ticket, classification = await asyncio.gather(
+            adb.tickets.find_one({"ticketId": ticket_id}),
+            adb.classifications.find_one({"ticketId": ticket_id}),
+        )
+        if not ticket or not classification:
+            LOG.error(f"[{ticket_id}] Could not find ticket or classification in DB")
+            return
+
+        query_text = f"{ticket.get('title', '')} {ticket['description']}"
+        docs = await asyncio.to_thread(retrieve_docs, query_text, 3)
+        request = rag_request(build_rag_prompt(ticket, classification, build_rag_context(docs)))
+        record_prompt("rag", request, ticket_id)
+
+        priority = classification["data"].get("priority")
+        output = {"ticketId": ticket_id}
+
+        if settings.RAG_STREAMING:
+            async with llm_slot():
+                assistant_reply, output["metrics"] = await astream_reply(ticket_id, request, priority)
+            enriched = build_enriched(ticket_id, classification, assistant_reply, docs)
+        else:
+            async with llm_slot():
+                response = await limiter.acall(provider.acomplete, request, priority)
+            assistant_reply = response.choices[0].message.content or "No reply generated"
+            enriched = build_enriched(ticket_id, classification, assistant_reply, docs)
+            if not await asend_to_express_api(enriched):
+                raise RuntimeError(f"Failed to post the reply for {ticket_id} to Express API")
+
+        output["data"] = enriched
+        await adb.enriched_outputs.replace_one({"ticketId": ticket_id}, output, upsert=True)
         LOG.info(f"[{ticket_id}] Successfully processed and saved enriched output")
 
+    except (CircuitOpenError, *TIMEOUT_ERRORS) as e:
+        LOG.warning(f"[{ticket_id}] LLM unavailable, leaving job pending: {e}")
+        raise
     except Exception as e:
         LOG.error(f"[{ticket_id}] Error during RAG processing: {e}")
+        raise
+
+CONSUMER_GROUP = "rag_workers"
 
 def run():
-    LOG.info("📚 RAG worker started. Waiting for jobs from 'rag_queue'...")
-    while True:
-        try:
-            result = r.blpop(["rag_queue"], timeout=60)
-            if result is None:
-                continue
-            _, raw = result
-            job_data = json.loads(raw)
-            process_rag(job_data)
-        except KeyboardInterrupt:
-            LOG.info("👋 RAG worker stopped by user")
-            break
-        except Exception as e:
-            LOG.error(f"❌ Critical error in worker loop: {e}")
+    LOG.info("📚 RAG worker started. Waiting for jobs from 'rag_stream'...")
+    ensure_indexes()
+    if settings.EMBEDDING_WARM_START:
+        warm()
+    try:
+        consume("rag", CONSUMER_GROUP, process_rag)
+    except KeyboardInterrupt:
+        LOG.info("👋 RAG worker stopped by user")
+
+def run_async():
+    LOG.info(f"📚 RAG worker started (async, {settings.RAG_CONCURRENCY} in flight)")
+    ensure_indexes()
+    if settings.EMBEDDING_WARM_START:
+        warm()
+    asyncio.run(run_stage("rag", CONSUMER_GROUP, aprocess_rag, settings.RAG_CONCURRENCY))
 
 if __name__ == "__main__":
-    run()
\ No newline at end of file
+    if settings.WORKER_RUNTIME == "async":
+        run_async()
+    else:
+        run()
\ No newline at end of file
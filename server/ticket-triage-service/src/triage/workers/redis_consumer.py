@@ -1,54 +1,142 @@
-import redis
-import json
 import logging
 import sys
 from pathlib import Path
 
 sys.path.append(str(Path(__file__).parent.parent.parent))
 
+from pydantic import ValidationError
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
 from src.triage.schemas.models import TicketInput
 from src.triage.db.database import get_db
-from src.triage.utils.queue import enqueue_job
+from src.triage.db.indexes import ensure_indexes
+from src.triage.utils.queue import enqueue_job, enqueue_jobs, consume
 from src.triage.config import settings
 
 logging.basicConfig(level=logging.INFO)
 LOG = logging.getLogger("redis_consumer")
 
-r = redis.from_url(settings.REDIS_URL)
 db = get_db()
 
-def run():
-    LOG.info("🚀 Redis consumer started, waiting for tickets...")
-    
-    while True:
+CONSUMER_GROUP = "redis_consumer"
+
+DUPLICATE_KEY = 11000
+
+def _insert_fields(ticket):
+    doc = ticket.dict()
+    doc.pop("ticketId", None)  # already set from the upsert filter
+    doc["classifyQueued"] = False  # set once the classify job is in the stream
+    return doc
+
+def _unqueued(ticket_ids):
+    """Tickets saved by an earlier delivery whose classify job was never
+    enqueued (Redis failed or the worker died in between) and that are not
+    classified yet."""
+    saved = [t["ticketId"] for t in db.tickets.find(
+        {"ticketId": {"$in": ticket_ids}, "classifyQueued": False}, {"ticketId": 1}
+    )]
+    if not saved:
+        return []
+    classified = {c["ticketId"] for c in db.classifications.find({"ticketId": {"$in": saved}}, {"ticketId": 1})}
+    return [ticket_id for ticket_id in saved if ticket_id not in classified]
+
+def _mark_queued(ticket_ids):
+    db.tickets.update_many({"ticketId": {"$in": ticket_ids}}, {"$set": {"classifyQueued": True}})
+
+def process_ticket(ticket_data):
+    LOG.info(f"📨 Received ticket: {ticket_data.get('ticketId')}")
+
+    ticket = TicketInput(**ticket_data)
+
+    # The unique ticketId index makes this insert-if-absent in one round trip
+    result = db.tickets.update_one(
+        {"ticketId": ticket.ticketId}, {"$setOnInsert": _insert_fields(ticket)}, upsert=True
+    )
+    if result.upserted_id is not None:
+        LOG.info(f"💾 Saved ticket {ticket.ticketId}")
+    elif _unqueued([ticket.ticketId]):
+        LOG.warning(f"🔁 Ticket {ticket.ticketId} was saved but never queued, enqueuing it now")
+    else:
+        LOG.warning(f"🔁 Duplicate ticket {ticket.ticketId}, skipping")
+        return
+
+    enqueue_job("classify", {"ticket_id": ticket.ticketId})
+    _mark_queued([ticket.ticketId])
+    LOG.info(f"✅ Enqueued classify job for {ticket.ticketId}")
+
+def process_tickets(batch):
+    """Micro-batched version of process_ticket: one validation pass, one
+    unordered bulk of upserts and one pipelined enqueue."""
+    tickets = {}
+    for ticket_data in batch:
         try:
-            result = r.blpop(["tickets_queue"], timeout=60)
-            print(f"ticket received from ticket queue: {result}")
-            if result is None:
-                continue
-            
-            _, raw = result
-            ticket_data = json.loads(raw)
-            LOG.info(f"📨 Received ticket: {ticket_data.get('ticketId')}")
-            
             ticket = TicketInput(**ticket_data)
-            
-            if db.tickets.find_one({"ticketId": ticket.ticketId}):
-                LOG.warning(f"🔁 Duplicate ticket {ticket.ticketId}, skipping")
-                continue
-            
-            db.tickets.insert_one(ticket.dict())
-            
-            LOG.info(f"💾 Saved ticket {ticket.ticketId}")
-            
-            enqueue_job("classify", {"ticket_id": ticket.ticketId})
-            LOG.info(f"✅ Enqueued classify job for {ticket.ticketId}")
-            
-        except KeyboardInterrupt:
-            LOG.info("\n👋 Redis consumer stopped")
-            break
-        except Exception as e:
-            LOG.error(f"❌ Error processing ticket: {e}")
+        except ValidationError as e:
+            LOG.error(f"❌ Invalid ticket {ticket_data.get('ticketId')}, dropping: {e}")
+            continue
+        if ticket.ticketId in tickets:
+            LOG.warning(f"🔁 Duplicate ticket {ticket.ticketId} within batch, skipping")
+            continue
+        tickets[ticket.ticketId] = ticket
+
+    if not tickets:
+        return
+
+    ticket_ids = list(tickets)
+    operations = [
+        UpdateOne({"ticketId": ticket_id}, {"$setOnInsert": _insert_fields(tickets[ticket_id])}, upsert=True)
+        for ticket_id in ticket_ids
+    ]
+    raced = set()
+    try:
+        upserted = db.tickets.bulk_write(operations, ordered=False).upserted_ids
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        if any(error["code"] != DUPLICATE_KEY for error in errors):
+            raise
+        # A concurrent upsert of the same ticketId lost the race on the unique
+        # index; the winner enqueues the ticket
+        upserted = {u["index"]: u["_id"] for u in e.details.get("upserted", [])}
+        raced = {ticket_ids[error["index"]] for error in errors}
+
+    new_ids = [ticket_ids[index] for index in sorted(upserted)]
+    handled = set(new_ids) | raced
+    existing = [ticket_id for ticket_id in ticket_ids if ticket_id not in handled]
+    requeued = _unqueued(existing) if existing else []
+    for ticket_id in requeued:
+        LOG.warning(f"🔁 Ticket {ticket_id} was saved but never queued, enqueuing it now")
+    for ticket_id in (set(existing) - set(requeued)) | raced:
+        LOG.warning(f"🔁 Duplicate ticket {ticket_id}, skipping")
+    queued = new_ids + requeued
+    if not queued:
+        return
+
+    if new_ids:
+        LOG.info(f"💾 Saved {len(new_ids)} ticket(s) from a batch of {len(batch)}")
+
+    enqueue_jobs("classify", [{"ticket_id": ticket_id} for ticket_id in queued])
+    _mark_queued(queued)
+    LOG.info(f"✅ Enqueued {len(queued)} classify job(s)")
+
+def run():
+    LOG.info("🚀 Redis consumer started, waiting for tickets...")
+    ensure_indexes()
+
+    try:
+        if settings.CONSUMER_BATCH_SIZE > 1:
+            consume(
+                "tickets",
+                CONSUMER_GROUP,
+                process_tickets,
+                batch_size=settings.CONSUMER_BATCH_SIZE,
+                batch_handler=True,
+                linger_ms=settings.CONSUMER_MAX_LINGER_MS,
+            )
+        else:
+            consume("tickets", CONSUMER_GROUP, process_ticket)
+    except KeyboardInterrupt:
+        LOG.info("\n👋 Redis consumer stopped")
 
 if __name__ == "__main__":
     run()
\ No newline at end of file
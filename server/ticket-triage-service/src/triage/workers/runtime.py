@@ -0,0 +1,197 @@
+import asyncio
+import logging
+import signal
+import time
+
+import httpx
+
+from ..config import settings
+from ..utils import queue
+
+LOG = logging.getLogger("runtime")
+
+# Shared by every stage in the process: caps concurrent LLM calls no matter
+# how many jobs each stage has in flight.
+_llm_semaphore = None
+_http_client = None
+
+
+def llm_slot() -> asyncio.Semaphore:
+    global _llm_semaphore
+    if _llm_semaphore is None:
+        _llm_semaphore = asyncio.Semaphore(settings.LLM_MAX_CONCURRENCY)
+    return _llm_semaphore
+
+
+def http_client() -> httpx.AsyncClient:
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(timeout=settings.EXPRESS_API_TIMEOUT)
+    return _http_client
+
+
+class MicroBatcher:
+    """Coalesces concurrent calls into one batched call.
+
+    submit(item) waits until `max_size` items are queued or `linger_ms` has
+    passed since the first one; `fn(items)` then runs once and each caller
+    receives its own entry of the returned {key(item): result} mapping.
+    """
+
+    def __init__(self, fn, key, max_size: int, linger_ms: int):
+        self.fn = fn
+        self.key = key
+        self.max_size = max(1, max_size)
+        self.linger = linger_ms / 1000
+        self.pending = []
+        self.timer = None
+        self.tasks = set()
+
+    async def submit(self, item):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((item, future))
+        if len(self.pending) >= self.max_size:
+            self._flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.linger, self._flush)
+        return await future
+
+    def _flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, []
+        if batch:
+            task = asyncio.create_task(self._run(batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _run(self, batch):
+        try:
+            results = await self.fn([item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for item, future in batch:
+            if future.done():  # caller was cancelled
+                continue
+            key = self.key(item)
+            if key in results:
+                future.set_result(results[key])
+            else:
+                future.set_exception(KeyError(key))
+
+
+class AsyncStage:
+    """Runs an async job handler with up to `concurrency` jobs in flight.
+
+    Reads from the stage's Redis stream consumer group, acks each job once
+    its handler returns and, on SIGINT/SIGTERM, stops reading and waits up
+    to WORKER_DRAIN_TIMEOUT seconds for in-flight jobs before exiting. Jobs
+    that do not finish stay pending and are reclaimed by another replica.
+    As in queue.consume(), a failure with a `retry_after` defers the job and
+    stops reading new ones until then.
+    """
+
+    def __init__(self, job_type: str, group: str, handler, concurrency: int):
+        self.job_type = job_type
+        self.group = group
+        self.handler = handler
+        self.concurrency = max(1, concurrency)
+        self.consumer = queue.consumer_name()
+        self.tasks = set()
+        self.stopping = asyncio.Event()
+        self.completed = 0
+        self.paused_until = 0.0
+
+    def stop(self):
+        if not self.stopping.is_set():
+            LOG.info(f"🛑 Stopping {self.job_type} stage, draining {len(self.tasks)} in-flight job(s)")
+            self.stopping.set()
+
+    async def _run_job(self, entry_id: str, data: dict):
+        try:
+            await self.handler(data)
+            await queue.aack_jobs(self.job_type, self.group, [entry_id])
+            self.completed += 1
+        except Exception as e:
+            retry_after = getattr(e, "retry_after", None)
+            if retry_after is None:
+                LOG.error(f"❌ Job {entry_id} on {queue.stream_key(self.job_type)} failed, left pending: {e}")
+                return
+            await asyncio.to_thread(queue.defer_job, self.job_type, self.group, self.consumer, entry_id)
+            self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+            LOG.warning(f"⏸️ Job {entry_id} on {queue.stream_key(self.job_type)} deferred, "
+                        f"pausing for {retry_after:.0f}s: {e}")
+
+    def _spawn(self, jobs):
+        for entry_id, data in jobs:
+            task = asyncio.create_task(self._run_job(entry_id, data))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.stop)
+            except NotImplementedError:  # Windows
+                pass
+
+        await asyncio.to_thread(queue.ensure_group, self.job_type, self.group)
+        LOG.info(f"⚙️ {self.job_type} stage running with {self.concurrency} in-flight jobs "
+                 f"(LLM cap {settings.LLM_MAX_CONCURRENCY})")
+        last_maintenance, reclaim_from = 0.0, "0-0"
+
+        while not self.stopping.is_set():
+            try:
+                free = self.concurrency - len(self.tasks)
+                if free <= 0:
+                    await asyncio.wait(self.tasks, return_when=asyncio.FIRST_COMPLETED)
+                    continue
+                pause = self.paused_until - time.monotonic()
+                if pause > 0:
+                    try:
+                        await asyncio.wait_for(self.stopping.wait(), timeout=pause)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                if reclaim_from != "0-0" or time.monotonic() - last_maintenance >= settings.QUEUE_MAINTENANCE_INTERVAL:
+                    # As in queue.consume(), keeps reclaiming until the pending list has been scanned
+                    reclaimed, reclaim_from = await asyncio.to_thread(
+                        queue.reclaim_stale, self.job_type, self.group, self.consumer, free, reclaim_from
+                    )
+                    if reclaim_from == "0-0":
+                        await asyncio.to_thread(queue.trim_stream, self.job_type)
+                        last_maintenance = time.monotonic()
+                    if reclaimed:
+                        self._spawn(reclaimed)
+                        continue
+
+                # Short block so a stop request is noticed quickly
+                jobs = await queue.aread_jobs(self.job_type, self.group, self.consumer, free, block_ms=1000)
+                self._spawn(jobs)
+            except Exception as e:
+                LOG.error(f"❌ Error in {self.job_type} stage loop: {e}")
+                await asyncio.sleep(1)
+
+        if self.tasks:
+            done, pending = await asyncio.wait(self.tasks, timeout=settings.WORKER_DRAIN_TIMEOUT)
+            if pending:
+                LOG.warning(f"⚠️ {len(pending)} job(s) still running after drain timeout, cancelling")
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+        LOG.info(f"👋 {self.job_type} stage stopped after {self.completed} job(s)")
+
+
+async def run_stage(job_type: str, group: str, handler, concurrency: int):
+    try:
+        await AsyncStage(job_type, group, handler, concurrency).run()
+    finally:
+        if _http_client is not None:
+            await _http_client.aclose()
@@ -0,0 +1,202 @@
+import logging
+import math
+import signal
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import List, Optional
+
+from ..config import settings
+from ..utils import queue
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+LOG = logging.getLogger("supervisor")
+
+WORKERS_DIR = Path(__file__).parent
+STOP_TIMEOUT = settings.WORKER_DRAIN_TIMEOUT + 5
+MAX_RESTART_BACKOFF = 60
+
+
+@dataclass
+class Stage:
+    name: str
+    script: str
+    job_type: str
+    group: str
+    min_procs: int = 1
+    max_procs: int = 1
+    procs: List[subprocess.Popen] = field(default_factory=list)
+    stopping: List[subprocess.Popen] = field(default_factory=list)
+    crashes: int = 0
+    next_restart_at: float = 0.0
+    last_scale_up: float = 0.0
+    last_entries_read: Optional[int] = None
+    last_pending: int = 0
+    last_sample_at: float = 0.0
+    throughput: Optional[float] = None
+    backlog: int = 0
+    stale: int = 0
+    oldest_age: float = 0.0
+
+
+def build_stages() -> List[Stage]:
+    specs = [
+        ("consumer", "redis_consumer.py", "tickets", "redis_consumer"),
+        ("classify", "classify_worker.py", "classify", "classify_workers"),
+        ("rag", "rag_worker.py", "rag", "rag_workers"),
+    ]
+    stages = []
+    for name, script, job_type, group in specs:
+        low, high = settings.SUPERVISOR_SCALING.get(name, [1, 1])
+        stages.append(Stage(name, script, job_type, group, max(0, low), max(low, high)))
+    return stages
+
+
+class Supervisor:
+    """Keeps min..max worker processes per stage, sized by queue backlog and
+    the age of the oldest job not yet delivered. Pending jobs idle past
+    QUEUE_CLAIM_IDLE_MS (a dead consumer, a poison message) are left out of
+    the backlog, since more processes would not drain them any faster.
+    Crashed children are restarted with exponential backoff and new
+    processes are started one at a time, SUPERVISOR_STAGGER_SECONDS apart,
+    so a burst does not stampede Mongo and Groq with cold starts."""
+
+    def __init__(self, stages: List[Stage]):
+        self.stages = stages
+        self.running = True
+        self.next_start_at = 0.0
+        self.last_report = 0.0
+
+    # --- process management ---
+
+    def _start(self, stage: Stage) -> bool:
+        now = time.monotonic()
+        if now < self.next_start_at:
+            return False
+        proc = subprocess.Popen([sys.executable, str(WORKERS_DIR / stage.script)])
+        stage.procs.append(proc)
+        self.next_start_at = now + settings.SUPERVISOR_STAGGER_SECONDS
+        LOG.info(f"▶️ Started {stage.name} worker pid={proc.pid} ({len(stage.procs)} running)")
+        return True
+
+    def _stop(self, stage: Stage, proc: subprocess.Popen):
+        # SIGINT lets sync workers leave via KeyboardInterrupt and async ones drain
+        stage.procs.remove(proc)
+        stage.stopping.append(proc)
+        proc.send_signal(signal.SIGINT)
+        proc.stop_deadline = time.monotonic() + STOP_TIMEOUT
+        LOG.info(f"⏹️ Stopping {stage.name} worker pid={proc.pid} ({len(stage.procs)} remaining)")
+
+    def _reap(self, stage: Stage):
+        now = time.monotonic()
+        for proc in list(stage.stopping):
+            if proc.poll() is not None:
+                stage.stopping.remove(proc)
+            elif now > proc.stop_deadline:
+                LOG.warning(f"⚠️ {stage.name} worker pid={proc.pid} ignored SIGINT, killing")
+                proc.kill()
+
+        for proc in list(stage.procs):
+            code = proc.poll()
+            if code is None:
+                continue
+            stage.procs.remove(proc)
+            stage.crashes += 1
+            backoff = min(MAX_RESTART_BACKOFF, 2 ** min(stage.crashes, 6))
+            stage.next_restart_at = now + backoff
+            LOG.error(f"💥 {stage.name} worker pid={proc.pid} exited with {code}, "
+                      f"restarting in {backoff}s")
+
+    # --- scaling ---
+
+    def _sample(self, stage: Stage):
+        depth = queue.queue_depth(stage.job_type, stage.group)
+        stage.backlog = depth["lag"] + depth["pending"] - depth["stale"]
+        stage.stale = depth["stale"]
+        stage.oldest_age = depth["oldest_age"]
+
+        now = time.monotonic()
+        entries_read = depth["entries_read"]
+        if entries_read is not None and stage.last_entries_read is not None and now > stage.last_sample_at:
+            # Jobs finished = jobs handed out minus growth of the pending list
+            done = (entries_read - stage.last_entries_read) - (depth["pending"] - stage.last_pending)
+            stage.throughput = max(0, done) / (now - stage.last_sample_at)
+        stage.last_entries_read = entries_read
+        stage.last_pending = depth["pending"]
+        stage.last_sample_at = now
+
+    def desired(self, stage: Stage) -> int:
+        want = math.ceil(stage.backlog / max(1, settings.SUPERVISOR_JOBS_PER_PROCESS))
+        if stage.oldest_age > settings.SUPERVISOR_MAX_JOB_AGE:
+            want = max(want, len(stage.procs) + 1)
+        return min(stage.max_procs, max(stage.min_procs, want))
+
+    def _scale(self, stage: Stage):
+        now = time.monotonic()
+        want = self.desired(stage)
+        current = len(stage.procs)
+        if current < want and now >= stage.next_restart_at:
+            if self._start(stage):
+                stage.last_scale_up = now
+        elif current > want and now - stage.last_scale_up >= settings.SUPERVISOR_SCALE_DOWN_COOLDOWN:
+            self._stop(stage, stage.procs[-1])
+            stage.last_scale_up = now  # one step per cooldown window
+        elif current == want and stage.crashes and all(p.poll() is None for p in stage.procs):
+            stage.crashes = 0
+
+    def report(self):
+        for stage in self.stages:
+            rate = f"{stage.throughput:.2f} jobs/s" if stage.throughput is not None else "n/a"
+            LOG.info(f"📊 {stage.name:9} procs={len(stage.procs)}/{stage.max_procs} "
+                     f"backlog={stage.backlog} stale={stage.stale} oldest={stage.oldest_age:.0f}s "
+                     f"throughput={rate}")
+
+    # --- main loop ---
+
+    def shutdown(self, *_):
+        self.running = False
+
+    def run(self):
+        signal.signal(signal.SIGINT, self.shutdown)
+        signal.signal(signal.SIGTERM, self.shutdown)
+        LOG.info("🧭 Supervisor started: " + ", ".join(
+            f"{s.name}[{s.min_procs}-{s.max_procs}]" for s in self.stages))
+
+        last_poll = 0.0
+        while self.running:
+            poll = time.monotonic() - last_poll >= settings.SUPERVISOR_POLL_INTERVAL
+            for stage in self.stages:
+                try:
+                    self._reap(stage)
+                    if poll:
+                        self._sample(stage)
+                    self._scale(stage)
+                except Exception as e:
+                    LOG.error(f"❌ Supervisor error on {stage.name}: {e}")
+            if poll:
+                last_poll = time.monotonic()
+            if time.monotonic() - self.last_report >= settings.SUPERVISOR_REPORT_INTERVAL:
+                self.report()
+                self.last_report = time.monotonic()
+            time.sleep(1)
+
+        LOG.info("👋 Supervisor stopping, draining workers...")
+        for stage in self.stages:
+            for proc in list(stage.procs):
+                self._stop(stage, proc)
+        deadline = time.monotonic() + STOP_TIMEOUT
+        for stage in self.stages:
+            for proc in stage.stopping:
+                try:
+                    proc.wait(timeout=max(0.1, deadline - time.monotonic()))
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+
+
+def main():
+    Supervisor(build_stages()).run()